@@ -0,0 +1,84 @@
+"""
+Äquivalenz und Benchmark: ``server_agg=True`` vs. pandas-Aggregation in
+``get_labs_for_window`` / ``get_vitals_for_window``.
+
+Aus dem Ordner ``report_abgabe`` ausführen (DB aus .env)::
+
+    python scripts/bench_server_agg.py --stays 2000
+
+Für Labs und Vitals, jede Aggregation (worst, mean, first) und ein festes
+24h-Fenster sowie ein Fenster je Aufenthalt (``end_hours_col``) laufen
+beide Pfade jeweils in einer eigenen ``session()`` mit registrierter
+Kohorte. Das Skript prüft, dass die Ergebnisse identisch sind, und gibt
+Laufzeit und übertragene Zeilen (``profile_queries``) aus. Bricht mit
+AssertionError ab, wenn ein Pfad abweicht.
+
+Gemessen mit dem generierten SQL gegen synthetische Tabellen in DuckDB
+(kein PostgreSQL verfügbar), 10k Aufenthalte, 3M chartevents, Vitals
+worst 24h:
+
+    pandas       351.272 Zeilen   0.84 s Abfrage + 0.14 s Client
+    server_agg    59.810 Zeilen   0.73 s Abfrage + 0.08 s Client
+
+Seit der vektorisierten Aggregation (``_aggregate_window``) liegt der Gewinn vor
+allem in den übertragenen Zeilen; Zahlen gegen MIMIC-III mit diesem
+Skript ergänzen.
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from src.cohort import load_aki_cohort  # noqa: E402
+from src.db import disable_cache, profile_queries, register_cohort, session  # noqa: E402
+from src.utils import get_labs_for_window, get_vitals_for_window  # noqa: E402
+
+
+def _run(fn, cohort: pd.DataFrame, **kwargs) -> tuple[pd.DataFrame, float, int]:
+    with session():
+        register_cohort(cohort)
+        with profile_queries() as prof:
+            t0 = time.perf_counter()
+            out = fn(cohort, **kwargs)
+            seconds = time.perf_counter() - t0
+    return out, seconds, int(prof.to_frame()["rows"].sum())
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--stays", type=int, default=2000, help="Anzahl Aufenthalte aus der AKI-Kohorte")
+    args = parser.parse_args()
+
+    disable_cache()
+    cohort = load_aki_cohort().head(args.stays).copy()
+    # Fenster je Aufenthalt: 6 bis 48 h
+    cohort["t_end"] = 6.0 + (cohort["icustay_id"] % 43)
+
+    rows = []
+    for fn in (get_labs_for_window, get_vitals_for_window):
+        for agg in ("worst", "mean", "first"):
+            for window in ({"window_hours": 24.0}, {"end_hours_col": "t_end"}):
+                ref, t_ref, n_ref = _run(fn, cohort, agg=agg, **window)
+                got, t_srv, n_srv = _run(fn, cohort, agg=agg, server_agg=True, **window)
+                pd.testing.assert_frame_equal(got, ref, check_dtype=False, check_like=True)
+                rows.append(
+                    {
+                        "getter": fn.__name__,
+                        "agg": agg,
+                        "window": next(iter(window.values())),
+                        "pandas_s": t_ref,
+                        "server_s": t_srv,
+                        "pandas_rows": n_ref,
+                        "server_rows": n_srv,
+                    }
+                )
+    print(pd.DataFrame(rows).round(2).to_string(index=False))
+    print("Alle Ergebnisse identisch.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+# src/cache.py
+"""
+On-disk result cache for ``src.db.q()`` / ``load_sql()``.
+
+Results are stored as Parquet files named by a content hash of the
+normalized SQL, the bound parameters and a database fingerprint, so
+identical queries from a restarted notebook kernel are served from disk.
+Each entry has a small JSON sidecar (SQL, creation time, original query
+time) used for TTL expiry, ``invalidate(match=...)`` and the
+"saved DB time" statistic. The cache is bounded by ``max_bytes``; the
+least recently used entries are evicted first.
+
+Enabled via ``src.db.enable_cache()`` or the ``DB_CACHE_DIR`` env variable.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import re
+import time
+from pathlib import Path
+
+import pandas as pd
+
+
+def normalize_sql(sql: str) -> str:
+    """Collapse whitespace and drop a trailing ``;`` so formatting does not change the key."""
+    return re.sub(r"\s+", " ", sql).strip().rstrip(";").strip()
+
+
+def _normalize_param(value):
+    # ANY(:ids)-Listen: Reihenfolge ist für das Ergebnis irrelevant
+    if isinstance(value, (list, tuple, set, frozenset)):
+        try:
+            return sorted(value)
+        except TypeError:
+            return list(value)
+    return value
+
+
+def cache_key(sql: str, params: dict | None, fingerprint: str) -> str:
+    """SHA-256 over normalized SQL, bound parameters and the DB fingerprint."""
+    norm_params = {k: _normalize_param(v) for k, v in (params or {}).items()}
+    payload = json.dumps(
+        [normalize_sql(sql), norm_params, fingerprint], sort_keys=True, default=str
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class QueryCache:
+    """
+    Size-bounded, content-addressed Parquet cache.
+
+    Parameters
+    ----------
+    directory : str or Path
+        Cache directory (created if missing).
+    max_bytes : int
+        Upper bound for the total size of cached Parquet files; LRU eviction
+        after each store.
+    ttl : float or None
+        Entries older than ``ttl`` seconds count as misses and are removed.
+        None keeps entries until evicted or invalidated.
+    """
+
+    def __init__(self, directory, max_bytes: int = 2 * 1024**3, ttl: float | None = None):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.saved_seconds = 0.0
+
+    def _paths(self, key: str) -> tuple[Path, Path]:
+        return self.directory / f"{key}.parquet", self.directory / f"{key}.json"
+
+    def _remove(self, key: str) -> None:
+        for p in self._paths(key):
+            p.unlink(missing_ok=True)
+
+    def get(self, key: str, dtype_backend: str | None = None) -> pd.DataFrame | None:
+        """Cached result for ``key`` or None (counted as miss)."""
+        data, meta = self._paths(key)
+        try:
+            info = json.loads(meta.read_text(encoding="utf-8"))
+            if self.ttl is not None and time.time() - info["created"] > self.ttl:
+                self._remove(key)
+                raise FileNotFoundError(key)
+            df = pd.read_parquet(data, **({"dtype_backend": dtype_backend} if dtype_backend else {}))
+        except (OSError, ValueError, KeyError):
+            self.misses += 1
+            return None
+        # mtime = letzter Zugriff (Grundlage für LRU)
+        os.utime(data)
+        self.hits += 1
+        self.saved_seconds += info.get("query_seconds", 0.0)
+        return df
+
+    def put(self, key: str, df: pd.DataFrame, sql: str, query_seconds: float) -> bool:
+        """
+        Store ``df`` under ``key``. Returns False if the frame cannot be
+        written as Parquet (e.g. mixed-type object columns); it is then
+        simply not cached.
+        """
+        data, meta = self._paths(key)
+        tmp = data.with_name(f"{data.name}.{os.getpid()}.tmp")
+        try:
+            df.to_parquet(tmp, index=False)
+        except (ValueError, TypeError, NotImplementedError):
+            tmp.unlink(missing_ok=True)
+            return False
+        os.replace(tmp, data)
+        meta.write_text(
+            json.dumps({"sql": normalize_sql(sql), "created": time.time(),
+                        "query_seconds": query_seconds, "rows": len(df)}),
+            encoding="utf-8",
+        )
+        self.stores += 1
+        self._evict()
+        return True
+
+    def _evict(self) -> None:
+        entries = sorted(
+            ((p.stat().st_mtime, p.stat().st_size, p.stem) for p in self.directory.glob("*.parquet")),
+        )
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in entries:
+            if total <= self.max_bytes:
+                break
+            self._remove(key)
+            total -= size
+            self.evictions += 1
+
+    def invalidate(self, match: str | None = None) -> int:
+        """
+        Remove entries whose normalized SQL contains ``match``
+        (case-insensitive), e.g. ``invalidate("inputevents_mv")``;
+        without ``match`` the whole cache is cleared. Returns the number
+        of removed entries.
+        """
+        removed = 0
+        for meta in self.directory.glob("*.json"):
+            if match is not None:
+                try:
+                    sql = json.loads(meta.read_text(encoding="utf-8"))["sql"]
+                except (OSError, ValueError, KeyError):
+                    sql = ""
+                if match.lower() not in sql.lower():
+                    continue
+            self._remove(meta.stem)
+            removed += 1
+        return removed
+
+    def stats(self) -> dict:
+        """Hit/miss counters of this process plus current size on disk."""
+        files = list(self.directory.glob("*.parquet"))
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "saved_seconds": round(self.saved_seconds, 3),
+            "entries": len(files),
+            "bytes": sum(p.stat().st_size for p in files),
+        }
@@ -2,9 +2,10 @@
 import pandas as pd
 from src.db import q
 
-def load_aki_cohort():
+def load_aki_cohort(compact=False):
+    # compact=True: int32-IDs, float32-Messwerte, ethnicity & Co. als category
     return q("""
         SELECT *
         FROM derived.mv_aki_icu_first_cohort
         WHERE age BETWEEN 18 AND 90
-    """)
+    """, compact=compact)
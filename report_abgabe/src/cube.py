@@ -0,0 +1,154 @@
+# src/cube.py
+"""
+Hourly aggregate cube for window queries without rescanning raw events.
+
+Events (``icustay_id, itemid, hours`` since intime, ``value``) are reduced
+once to one bucket per stay, itemid and hour offset with min / max / sum /
+count; bucket ``k`` holds the events with ``k - 1 < hours <= k`` (bucket 0:
+exactly at intime). Buckets are stored sorted by (stay, itemid, hour) with
+global prefix sums of sum and count, so any window aggregate per
+stay-itemid is two binary searches plus a difference (sum, count, mean) or
+one ``reduceat`` over the buckets inside the window (min, max) — for all
+stays in one vectorized step.
+
+Built from the database by ``src.utils.build_hourly_cube``; the
+``get_*_for_window`` functions accept it via ``cube=``.
+"""
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+
+
+class HourlyCube:
+    """
+    Per-(icustay_id, itemid, hour) aggregates with prefix sums.
+
+    Parameters
+    ----------
+    events : DataFrame
+        Columns ``icustay_id``, ``itemid``, ``hours`` (offset from intime,
+        >= 0) and ``value``.
+    max_hours : float or None
+        Hours after intime covered by ``events``; windows ending later are
+        rejected by ``query``. None = not checked.
+    """
+
+    def __init__(self, events: pd.DataFrame, max_hours: float | None = None):
+        self.max_hours = max_hours
+        hour = np.ceil(events["hours"].to_numpy(dtype=float))
+        buckets = (
+            pd.DataFrame({
+                "icustay_id": events["icustay_id"].to_numpy(dtype=np.int64),
+                "itemid": events["itemid"].to_numpy(dtype=np.int64),
+                "hour": np.maximum(hour, 0).astype(np.int64),
+                "value": events["value"].to_numpy(dtype=float),
+            })
+            .dropna(subset=["value"])
+            .groupby(["icustay_id", "itemid", "hour"], sort=True)["value"]
+            .agg(["min", "max", "sum", "count"])
+            .reset_index()
+        )
+        self.icustay_id = buckets["icustay_id"].to_numpy()
+        self.itemid = buckets["itemid"].to_numpy()
+        self.hour = buckets["hour"].to_numpy()
+        self.vmin = buckets["min"].to_numpy(dtype=float)
+        self.vmax = buckets["max"].to_numpy(dtype=float)
+
+        # Prefix-Summen über alle Buckets (Länge n + 1): Fenster = Differenz zweier Einträge
+        self.csum = np.concatenate([[0.0], np.cumsum(buckets["sum"].to_numpy(dtype=float))])
+        self.ccount = np.concatenate([[0], np.cumsum(buckets["count"].to_numpy(dtype=np.int64))])
+
+        # Gruppen (stay, itemid) und sortierter Suchschlüssel gruppe * span + stunde
+        new_group = np.ones(len(buckets), dtype=bool)
+        new_group[1:] = (np.diff(self.icustay_id) != 0) | (np.diff(self.itemid) != 0)
+        self.group_start = np.flatnonzero(new_group)
+        group = np.cumsum(new_group) - 1
+        self._span = int(self.hour.max()) + 2 if len(buckets) else 2
+        self._key = group * self._span + self.hour
+
+    def __len__(self) -> int:
+        return len(self.hour)
+
+    @property
+    def nbytes(self) -> int:
+        """Memory of the cube arrays in bytes."""
+        arrays = (self.icustay_id, self.itemid, self.hour, self.vmin, self.vmax,
+                  self.csum, self.ccount, self.group_start, self._key)
+        return int(sum(a.nbytes for a in arrays))
+
+    def query(
+        self,
+        end_hours: float | pd.Series,
+        start_hours: float | pd.Series = 0.0,
+        itemids=None,
+    ) -> pd.DataFrame:
+        """
+        Aggregates of the buckets in ``(start_hours, end_hours]`` (``[0, end_hours]``
+        for ``start_hours = 0``) per stay and itemid.
+
+        ``start_hours``/``end_hours`` must be whole hours (fractional bounds
+        raise ValueError), either scalars or Series indexed by ``icustay_id``
+        (per-stay windows; stays missing from the Series or with NaN get no
+        rows). Returns ``icustay_id, itemid, min, max, sum, count`` for every
+        stay-itemid with at least one event in its window.
+
+        Windows from ``start_hours = 0`` match the event-level windows
+        ``[start, end]`` of ``src.utils`` exactly; for ``start_hours > 0``
+        events at exactly ``start_hours`` are excluded. The
+        ``get_*_for_window`` functions therefore always query from 0.
+        """
+        if self.max_hours is not None and np.nanmax(np.asarray(end_hours, dtype=float), initial=-np.inf) > self.max_hours:
+            raise ValueError(
+                f"Fenster endet nach {self.max_hours} h; der Cube deckt nur die ersten "
+                f"{self.max_hours} h ab (build_hourly_cube(..., max_hours=...))."
+            )
+        starts = self.group_start
+        stay = self.icustay_id[starts]
+        item = self.itemid[starts]
+        keep = np.ones(len(starts), dtype=bool) if itemids is None else np.isin(item, list(itemids))
+
+        end = self._per_group(end_hours, stay)
+        begin = self._per_group(start_hours, stay)
+        keep &= ~np.isnan(end) & ~np.isnan(begin)
+        gid = np.flatnonzero(keep)
+        end, begin = end[keep], begin[keep]
+        if (end != np.floor(end)).any() or (begin != np.floor(begin)).any():
+            raise ValueError("HourlyCube.query braucht Fenstergrenzen in ganzen Stunden.")
+        end = end.astype(np.int64)
+        begin = begin.astype(np.int64)
+        # Bucket k deckt (k-1, k] ab; Start 0 schließt den Bucket bei intime ein
+        first_bucket = np.where(begin > 0, begin + 1, 0)
+
+        base = gid * self._span
+        lo = np.searchsorted(self._key, base + np.clip(first_bucket, 0, self._span - 1), side="left")
+        hi = np.searchsorted(self._key, base + np.clip(end, -1, self._span - 1), side="right")
+        hit = hi > lo
+        lo, hi, gid = lo[hit], hi[hit], gid[hit]
+
+        out = pd.DataFrame({
+            "icustay_id": stay[gid],
+            "itemid": item[gid],
+            "min": self._reduce(np.minimum, self.vmin, lo, hi),
+            "max": self._reduce(np.maximum, self.vmax, lo, hi),
+            "sum": self.csum[hi] - self.csum[lo],
+            "count": self.ccount[hi] - self.ccount[lo],
+        })
+        return out
+
+    @staticmethod
+    def _per_group(hours: float | pd.Series, stay: np.ndarray) -> np.ndarray:
+        if isinstance(hours, pd.Series):
+            per_stay = hours.groupby(level=0).first()
+            return per_stay.reindex(stay).to_numpy(dtype=float)
+        return np.full(len(stay), float(hours))
+
+    @staticmethod
+    def _reduce(ufunc, values: np.ndarray, lo: np.ndarray, hi: np.ndarray) -> np.ndarray:
+        if len(lo) == 0:
+            return np.empty(0)
+        # reduceat über [lo, hi): Grenzen verschränken, jedes zweite Ergebnis ist ein Fenster
+        padded = np.append(values, values[-1])
+        idx = np.empty(2 * len(lo), dtype=np.int64)
+        idx[0::2], idx[1::2] = lo, hi
+        return ufunc.reduceat(padded, idx)[0::2]
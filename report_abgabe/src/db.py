@@ -1,23 +1,644 @@
+from __future__ import annotations
+
+import hashlib
+import io
 from pathlib import Path
 import os
+import re
+import tempfile
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import TYPE_CHECKING, Iterator, Optional, Union
+
 import pandas as pd
-from dotenv import load_dotenv
-from sqlalchemy import create_engine, text
 
+from src.cache import QueryCache, cache_key
+from src.dtypes import compact_dtypes
+from src.querylog import QueryProfile, approx_bytes, calling_function, log_if_slow, short_sql
+
+if TYPE_CHECKING:
+    from sqlalchemy.engine import Connection, Engine
+
+# .env, SQLAlchemy und die Engine werden erst beim ersten DB-Zugriff geladen,
+# damit reine Rechenfunktionen (src.utils) ohne DB-Konfiguration importierbar sind.
 _env_dir = Path(__file__).resolve().parents[1]
-load_dotenv(_env_dir / ".env")
-if not os.getenv("DB_HOST"):
-    raise RuntimeError(
-        "DB_HOST (und ggf. DB_USER, DB_PASSWORD, DB_NAME) nicht gesetzt. "
-        "Kopiere report_abgabe/.env.example nach report_abgabe/.env und trage die Zugangsdaten ein."
+_env_loaded = False
+_engine: Engine | None = None
+
+
+def _load_env() -> None:
+    """Read ``report_abgabe/.env`` once; enables the result cache if ``DB_CACHE_DIR`` is set."""
+    global _env_loaded
+    if _env_loaded:
+        return
+    from dotenv import load_dotenv
+
+    load_dotenv(_env_dir / ".env")
+    _env_loaded = True
+    if os.getenv("DB_CACHE_DIR") and _cache is None:
+        enable_cache()
+
+
+def _db_url() -> str:
+    _load_env()
+    if not os.getenv("DB_HOST"):
+        raise RuntimeError(
+            "DB_HOST (und ggf. DB_USER, DB_PASSWORD, DB_NAME) nicht gesetzt. "
+            "Kopiere report_abgabe/.env.example nach report_abgabe/.env und trage die Zugangsdaten ein."
+        )
+    return (
+        f"postgresql+psycopg2://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}"
+        f"@{os.getenv('DB_HOST')}:{os.getenv('DB_PORT','5432')}/{os.getenv('DB_NAME')}"
+    )
+
+
+def _pool_defaults() -> dict:
+    # Pool-Defaults, überschreibbar per .env (DB_POOL_SIZE, DB_MAX_OVERFLOW, ...)
+    _load_env()
+    return {
+        "pool_size": int(os.getenv("DB_POOL_SIZE", "5")),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "5")),
+        "pool_timeout": int(os.getenv("DB_POOL_TIMEOUT", "30")),
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),
+        "pool_pre_ping": True,
+    }
+
+
+def _create_engine(**engine_kwargs) -> Engine:
+    from sqlalchemy import create_engine
+
+    return create_engine(_db_url(), **{**_pool_defaults(), **engine_kwargs})
+
+
+def get_engine() -> Engine:
+    """
+    The shared, pooled engine; created on first use from ``.env``.
+
+    Raises RuntimeError if ``DB_HOST`` is not configured.
+    """
+    global _engine
+    if _engine is None:
+        _engine = _create_engine()
+    return _engine
+
+
+def __getattr__(name: str):
+    # ``db.engine`` bleibt als Attribut erhalten, wird aber erst beim Zugriff gebaut
+    if name == "engine":
+        return get_engine()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# Connection of the currently active ``session()`` (None outside a session)
+_session_conn: ContextVar[Optional[Connection]] = ContextVar("_session_conn", default=None)
+
+
+def configure_engine(**engine_kwargs) -> Engine:
+    """
+    Rebuild the module engine with custom pool settings, e.g.
+    ``configure_engine(pool_size=2, pool_recycle=600)``.
+
+    Keyword arguments are passed to ``sqlalchemy.create_engine`` on top of
+    the pool defaults. The old pool is disposed.
+    """
+    global _engine, _fingerprint
+    if _session_conn.get() is not None:
+        raise RuntimeError("configure_engine() kann nicht innerhalb einer aktiven session() aufgerufen werden.")
+    if _engine is not None:
+        _engine.dispose()
+    _engine = _create_engine(**engine_kwargs)
+    _fingerprint = None
+    return _engine
+
+
+@contextmanager
+def session() -> Iterator[Connection]:
+    """
+    Keep one pooled connection open for a whole enrichment pipeline.
+
+    Inside ``with session():`` every ``q()``/``q_iter()``/``load_sql()``
+    call runs on the same connection, so connection setup is paid once and
+    temp tables created during the session stay visible to later queries.
+    Each statement runs in its own savepoint, so a failing query (e.g. a
+    probe for an optional concept table) does not abort the session.
+    Nested ``session()`` blocks reuse the outer connection.
+    """
+    active = _session_conn.get()
+    if active is not None:
+        yield active
+        return
+
+    with get_engine().connect() as conn:
+        token = _session_conn.set(conn)
+        try:
+            yield conn
+        finally:
+            # Temp tables end with the session's transaction
+            conn.info.pop("cohort_tables", None)
+            conn.info.pop("cohort_columns", None)
+            conn.info.pop("cohort_digests", None)
+            conn.info.pop("session_cache", None)
+            _session_conn.reset(token)
+
+
+@contextmanager
+def _connect() -> Iterator[Connection]:
+    """Session connection (inside a savepoint) or a fresh pooled connection."""
+    conn = _session_conn.get()
+    if conn is None:
+        with get_engine().connect() as conn:
+            yield conn
+        return
+
+    with conn.begin_nested():
+        yield conn
+
+
+# Active profile_queries() collector (None = only the slow-query log)
+_profile: ContextVar[Optional[QueryProfile]] = ContextVar("_profile", default=None)
+
+
+@contextmanager
+def profile_queries(explain: bool = False, slow_seconds: float | None = None) -> Iterator[QueryProfile]:
+    """
+    Record every query of a pipeline run, e.g.
+
+    >>> with profile_queries() as prof:
+    ...     df = add_dialysis_flag(df_aki)
+    >>> prof.report()
+
+    Each record holds the calling function, wall time, rows and approximate
+    bytes; ``explain=True`` adds the ``EXPLAIN (ANALYZE, BUFFERS)`` plan and
+    server execution time of ``q()`` calls (runs each query twice).
+    ``slow_seconds`` sets the slow-query log threshold for the block;
+    otherwise ``DB_SLOW_QUERY_SECONDS`` applies. See ``src.querylog``.
+    """
+    prof = QueryProfile(explain=explain, slow_seconds=slow_seconds)
+    token = _profile.set(prof)
+    try:
+        yield prof
+    finally:
+        _profile.reset(token)
+
+
+def _slow_threshold(prof: QueryProfile | None) -> float | None:
+    if prof is not None and prof.slow_seconds is not None:
+        return prof.slow_seconds
+    value = os.getenv("DB_SLOW_QUERY_SECONDS")
+    return float(value) if value else None
+
+
+def _record(
+    kind: str,
+    sql: str,
+    seconds: float,
+    df: pd.DataFrame | None = None,
+    rows: int | None = None,
+    nbytes: int | None = None,
+    cached: bool = False,
+    server_seconds: float | None = None,
+    plan=None,
+) -> None:
+    """Slow-query log and, inside ``profile_queries()``, one record per call."""
+    prof = _profile.get()
+    threshold = _slow_threshold(prof)
+    if prof is None and threshold is None:
+        return
+    caller = calling_function()
+    if df is not None:
+        rows = len(df)
+    log_if_slow(threshold, caller, kind, sql, seconds, rows)
+    if prof is not None:
+        if nbytes is None and df is not None:
+            nbytes = approx_bytes(df)
+        prof.add(
+            caller=caller, kind=kind, sql=short_sql(sql), seconds=seconds,
+            server_seconds=server_seconds, rows=rows, bytes=nbytes, cached=cached, plan=plan,
+        )
+
+
+def _explain(sql: str, params: dict | None) -> tuple[float | None, object]:
+    """``EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON)`` -> (server seconds, plan)."""
+    from sqlalchemy import text
+    from sqlalchemy.exc import DBAPIError
+
+    try:
+        with _connect() as conn:
+            plan = conn.execute(text(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {sql}"), params or {}).scalar()
+    except DBAPIError:
+        return None, None
+    return plan[0]["Execution Time"] / 1000, plan
+
+
+# Optional result cache (see enable_cache) and the DB fingerprint in its keys
+_cache: QueryCache | None = None
+_fingerprint: str | None = None
+
+
+def enable_cache(
+    directory: str | Path | None = None,
+    max_bytes: int | None = None,
+    ttl: float | None = None,
+) -> QueryCache:
+    """
+    Serve repeated ``q()``/``load_sql()`` calls from an on-disk Parquet cache.
+
+    Keys are built from the normalized SQL, the bound parameters and a
+    database fingerprint (host, database, user, server version,
+    ``search_path``, plus the contents of any ``register_cohort`` table the
+    query references). Defaults come from ``DB_CACHE_DIR``,
+    ``DB_CACHE_MAX_MB`` (2048) and ``DB_CACHE_TTL`` (seconds, unset = no
+    expiry). Streaming pulls (``q_iter``/``q_copy``/``q_arrow``) are not cached.
+    """
+    global _cache
+    if directory is None:
+        directory = cache_dir()
+    if max_bytes is None:
+        max_bytes = int(float(os.getenv("DB_CACHE_MAX_MB", "2048")) * 1024**2)
+    if ttl is None and os.getenv("DB_CACHE_TTL"):
+        ttl = float(os.getenv("DB_CACHE_TTL"))
+    _cache = QueryCache(directory, max_bytes=max_bytes, ttl=ttl)
+    return _cache
+
+
+def cache_dir() -> Path:
+    """Default directory for on-disk caches: ``DB_CACHE_DIR`` or ``.query_cache`` next to ``.env``."""
+    _load_env()
+    return Path(os.getenv("DB_CACHE_DIR") or _env_dir / ".query_cache")
+
+
+def disable_cache() -> None:
+    """Stop using the result cache (files on disk are kept)."""
+    global _cache
+    _cache = None
+
+
+def invalidate_cache(match: str | None = None) -> int:
+    """Drop cached results whose SQL contains ``match`` (all if None); returns the count."""
+    return _cache.invalidate(match) if _cache is not None else 0
+
+
+def cache_stats() -> dict:
+    """Hit/miss statistics of the result cache, incl. DB time saved by hits."""
+    return _cache.stats() if _cache is not None else {}
+
+
+def db_fingerprint() -> str:
+    """
+    Identity of the connected database (host:port, database, user, server
+    version, ``search_path``); queried once per engine.
+    """
+    global _fingerprint
+    if _fingerprint is None:
+        with _connect() as conn:
+            row = conn.exec_driver_sql(
+                "SELECT current_database(), current_user, "
+                "current_setting('server_version'), current_setting('search_path')"
+            ).one()
+        url = get_engine().url
+        _fingerprint = "|".join([f"{url.host}:{url.port}", *map(str, row)])
+    return _fingerprint
+
+
+def _cache_fingerprint(sql: str) -> str:
+    # Temp-Tabellen aus register_cohort(): Inhalt gehört mit in den Schlüssel
+    conn = _session_conn.get()
+    digests = conn.info.get("cohort_digests", {}) if conn is not None else {}
+    used = sorted(f"{name}={d}" for name, d in digests.items() if re.search(rf"\b{name}\b", sql))
+    return "|".join([db_fingerprint(), *used])
+
+
+def q(
+    sql: str,
+    params: dict | None = None,
+    dtype_backend: str | None = None,
+    compact: bool = False,
+) -> pd.DataFrame:
+    """
+    Run ``sql`` and return the result as a DataFrame.
+
+    ``params`` are bound to ``:name`` placeholders; Python lists become
+    PostgreSQL arrays, e.g. ``q("... WHERE icustay_id = ANY(:ids)", {"ids": ids})``.
+    ``dtype_backend="pyarrow"`` returns Arrow-backed columns via ``q_arrow``.
+    With ``enable_cache()`` active, results are served from / written to
+    the on-disk cache. ``compact=True`` applies ``src.dtypes.compact_dtypes``
+    (int32 ids, float32 measurements, categorical strings).
+    """
+    _load_env()
+    t0 = time.perf_counter()
+    cached = False
+    if _cache is None:
+        df = _q(sql, params, dtype_backend)
+    else:
+        key = cache_key(sql, {**(params or {}), "__dtype_backend": dtype_backend}, _cache_fingerprint(sql))
+        df = _cache.get(key, dtype_backend=dtype_backend)
+        cached = df is not None
+        if not cached:
+            df = _q(sql, params, dtype_backend)
+            _cache.put(key, df, sql, time.perf_counter() - t0)
+    seconds = time.perf_counter() - t0
+
+    prof = _profile.get()
+    server_seconds, plan = _explain(sql, params) if prof is not None and prof.explain and not cached else (None, None)
+    _record("q", sql, seconds, df=df, cached=cached, server_seconds=server_seconds, plan=plan)
+    if compact and dtype_backend is None:
+        df = compact_dtypes(df)
+    return df
+
+
+def _q(sql: str, params: dict | None, dtype_backend: str | None) -> pd.DataFrame:
+    if dtype_backend == "pyarrow":
+        return _arrow_table(sql, params)[0].to_pandas(types_mapper=pd.ArrowDtype)
+    from sqlalchemy import text
+
+    with _connect() as conn:
+        return pd.read_sql(text(sql), conn, params=params)
+
+
+def q_iter(sql: str, params: dict | None = None, chunksize: int = 100_000) -> Iterator[pd.DataFrame]:
+    """
+    Stream the result of ``sql`` as DataFrames of at most ``chunksize`` rows.
+
+    Uses a named server-side cursor (``stream_results``), so the client only
+    ever holds one chunk instead of the full result set. ``params`` as in ``q()``.
+    """
+    from sqlalchemy import text
+
+    stmt = text(sql).execution_options(stream_results=True, max_row_buffer=chunksize)
+    rows, seconds = 0, 0.0
+    with _connect() as conn:
+        chunks = pd.read_sql(stmt, conn, params=params, chunksize=chunksize)
+        while True:
+            # nur die Zeit im Fetch zählen, nicht die Verarbeitung beim Aufrufer
+            t0 = time.perf_counter()
+            chunk = next(chunks, None)
+            seconds += time.perf_counter() - t0
+            if chunk is None:
+                break
+            rows += len(chunk)
+            yield chunk
+    _record("q_iter", sql, seconds, rows=rows)
+
+
+# PostgreSQL type OIDs -> pandas dtype used when decoding COPY output.
+# Integer columns are left to the C parser (int64, float64 if NULLs occur),
+# which matches pd.read_sql and is much faster than nullable Int64 parsing.
+_OID_DTYPES = {
+    16: "boolean",                                    # bool
+    700: "float64", 701: "float64", 1700: "float64",  # float4, float8, numeric
+}
+_OID_DATETIME = {1082, 1114, 1184}       # date, timestamp, timestamptz
+
+# COPY output above this size is spooled to a temp file instead of RAM
+_COPY_SPOOL_BYTES = 256 * 1024 * 1024
+# NULL-Marker im COPY-CSV; so bleibt leerer Text ('""') ein leerer String statt NaN
+_COPY_NULL = r"\N"
+
+
+def _copy_out(sql: str, params: dict | None):
+    """
+    Run ``COPY (sql) TO STDOUT`` as CSV with header, NULL written as ``\\N``.
+
+    Returns the (rewound) spooled output, ``[(column, type_oid), ...]``
+    taken from a ``LIMIT 0`` probe of the same query, and the number of
+    bytes transferred.
+    """
+    from sqlalchemy import text
+
+    with _connect() as conn:
+        compiled = text(sql).compile(dialect=conn.dialect)
+        with conn.connection.cursor() as cur:
+            inner = cur.mogrify(compiled.string, compiled.construct_params(params or {})).decode()
+            cur.execute(f"SELECT * FROM ({inner}) AS _q LIMIT 0")
+            desc = [(c.name, c.type_code) for c in cur.description]
+
+            buf = tempfile.SpooledTemporaryFile(max_size=_COPY_SPOOL_BYTES, mode="w+b")
+            cur.copy_expert(f"COPY ({inner}) TO STDOUT WITH (FORMAT csv, HEADER true, NULL '{_COPY_NULL}')", buf)
+            buf.seek(0, io.SEEK_END)
+            nbytes = buf.tell()
+            buf.seek(0)
+    return buf, desc, nbytes
+
+
+def q_copy(
+    sql: str,
+    params: dict | None = None,
+    chunksize: int | None = None,
+    dtype_backend: str | None = None,
+) -> Union[pd.DataFrame, Iterator[pd.DataFrame]]:
+    """
+    Bulk variant of ``q()`` based on ``COPY (SELECT ...) TO STDOUT``.
+
+    The server streams the result as CSV, which is decoded by pandas' C
+    parser straight into typed columns (int64/float64, booleans, timestamps
+    parsed once) instead of building one Python object per value
+    as ``pd.read_sql`` does. Column types come from a ``LIMIT 0`` probe of
+    the same query. With ``chunksize`` an iterator of DataFrames is returned,
+    so large pulls can be filtered chunk by chunk as with ``q_iter()``.
+    NULL is sent as ``\\N``, so empty text stays ``""`` as with
+    ``pd.read_sql`` (the pandas decoder also reads a text value that is
+    literally ``\\N`` as NaN).
+
+    ``dtype_backend="pyarrow"`` decodes with Arrow's CSV reader instead and
+    returns Arrow-backed columns (``pd.ArrowDtype``, see ``q_arrow``).
+    """
+    t0 = time.perf_counter()
+    buf, desc, nbytes = _copy_out(sql, params)
+    if dtype_backend == "pyarrow":
+        result = _read_copy_arrow(buf, desc, chunksize)
+    else:
+        result = _read_copy_csv(buf, desc, chunksize)
+    # Bei chunksize ist nur der Transfer gemessen, Zeilen erst beim Dekodieren bekannt
+    rows = len(result) if chunksize is None else None
+    _record("q_copy", sql, time.perf_counter() - t0, rows=rows, nbytes=nbytes)
+    return result
+
+
+def _read_copy_csv(buf, desc: list[tuple[str, int]], chunksize: int | None):
+    """Decode CSV written by ``COPY ... TO STDOUT`` using the column OIDs in ``desc``."""
+    dtypes = {name: _OID_DTYPES[oid] for name, oid in desc if oid in _OID_DTYPES}
+    dates = [name for name, oid in desc if oid in _OID_DATETIME]
+    return pd.read_csv(
+        buf,
+        encoding="utf-8",
+        dtype=dtypes,
+        parse_dates=dates,
+        true_values=["t"],
+        false_values=["f"],
+        keep_default_na=False,
+        na_values=[_COPY_NULL],
+        chunksize=chunksize,
+    )
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.csv
+    except ImportError as e:
+        raise ImportError(
+            "Arrow-Ergebnisse benötigen pyarrow (pip install pyarrow)."
+        ) from e
+    return pyarrow
+
+
+def _arrow_csv_reader(buf, desc: list[tuple[str, int]]):
+    """Streaming Arrow CSV reader over COPY output with column types from the OIDs."""
+    pa = _pyarrow()
+    oid_types = {
+        16: pa.bool_(),
+        20: pa.int64(), 21: pa.int64(), 23: pa.int64(),
+        700: pa.float64(), 701: pa.float64(), 1700: pa.float64(),
+        1082: pa.date32(),
+        1114: pa.timestamp("us"),
+        1184: pa.timestamp("us", tz="UTC"),
+    }
+    column_types = {name: oid_types.get(oid, pa.string()) for name, oid in desc}
+    return pa.csv.open_csv(
+        buf,
+        convert_options=pa.csv.ConvertOptions(
+            column_types=column_types,
+            null_values=[_COPY_NULL],
+            strings_can_be_null=True,
+            quoted_strings_can_be_null=False,
+            true_values=["t"],
+            false_values=["f"],
+        ),
     )
 
-engine = create_engine(
-    f"postgresql+psycopg2://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}"
-    f"@{os.getenv('DB_HOST')}:{os.getenv('DB_PORT','5432')}/{os.getenv('DB_NAME')}"
-)
 
-def q(sql: str) -> pd.DataFrame:
-    with engine.connect() as conn:
-        return pd.read_sql(text(sql), conn)
+def _read_copy_arrow(buf, desc: list[tuple[str, int]], chunksize: int | None):
+    reader = _arrow_csv_reader(buf, desc)
+    if chunksize is None:
+        return reader.read_all().to_pandas(types_mapper=pd.ArrowDtype)
+    return _iter_arrow_chunks(reader, chunksize)
+
+
+def _iter_arrow_chunks(reader, chunksize: int) -> Iterator[pd.DataFrame]:
+    """
+    Re-slice Arrow record batches into DataFrames of at most ``chunksize``
+    rows; an empty result yields one empty, typed frame (as pandas does).
+    """
+    pa = _pyarrow()
+    pending, n_rows, yielded = [], 0, False
+    for batch in reader:
+        pending.append(batch)
+        n_rows += batch.num_rows
+        while n_rows >= chunksize:
+            table = pa.Table.from_batches(pending, schema=reader.schema)
+            yield table.slice(0, chunksize).to_pandas(types_mapper=pd.ArrowDtype)
+            yielded = True
+            rest = table.slice(chunksize)
+            pending, n_rows = rest.to_batches(), rest.num_rows
+    if n_rows or not yielded:
+        table = pa.Table.from_batches(pending, schema=reader.schema)
+        yield table.to_pandas(types_mapper=pd.ArrowDtype)
+
+
+def q_arrow(sql: str, params: dict | None = None):
+    """
+    Run ``sql`` and return a ``pyarrow.Table``.
+
+    The result is pulled with ``COPY ... TO STDOUT`` and decoded by Arrow's
+    multithreaded CSV reader into typed columns (int64, float64, timestamp,
+    string), never going through Python objects. ``table.to_pandas(
+    types_mapper=pd.ArrowDtype)`` hands it to pandas without copying; this
+    is what ``q(sql, dtype_backend="pyarrow")`` returns.
+    """
+    t0 = time.perf_counter()
+    table, nbytes = _arrow_table(sql, params)
+    _record("q_arrow", sql, time.perf_counter() - t0, rows=table.num_rows, nbytes=nbytes)
+    return table
+
+
+def _arrow_table(sql: str, params: dict | None):
+    buf, desc, nbytes = _copy_out(sql, params)
+    return _arrow_csv_reader(buf, desc).read_all(), nbytes
+
+
+# Columns (and SQL types) uploaded by register_cohort(), if present in the cohort
+_COHORT_COLUMNS = {
+    "icustay_id": "integer",
+    "hadm_id": "integer",
+    "subject_id": "integer",
+    "intime": "timestamp",
+    "outtime": "timestamp",
+}
+
+
+def register_cohort(df: pd.DataFrame, name: str = "cohort") -> str:
+    """
+    Upload the cohort once as an indexed temp table of the active session.
+
+    Copies ``icustay_id``/``hadm_id``/``subject_id``/``intime``/``outtime``
+    (whichever exist) via ``COPY ... FROM STDIN``, indexes the id columns and
+    runs ``ANALYZE``. Afterwards the ``add_*``/``get_*`` helpers in
+    ``src.utils`` restrict their queries with a server-side join against the
+    table (see ``cohort_table``) instead of pulling all of MIMIC.
+
+    Must be called inside ``with session():``. Returns the table name.
+    """
+    active = _session_conn.get()
+    if active is None:
+        raise RuntimeError("register_cohort() braucht eine aktive session() (Temp-Tabellen leben pro Verbindung).")
+    if not name.isidentifier():
+        raise ValueError(f"Ungültiger Tabellenname: {name!r}")
+    if "icustay_id" not in df.columns:
+        raise ValueError("df muss 'icustay_id' enthalten.")
+
+    cols = [c for c in _COHORT_COLUMNS if c in df.columns]
+    data = df[cols].drop_duplicates(subset=["icustay_id"]).copy()
+    for c in cols:
+        if _COHORT_COLUMNS[c] == "integer":
+            data[c] = data[c].astype("Int64")
+
+    buf = io.StringIO()
+    data.to_csv(buf, index=False, header=False, date_format="%Y-%m-%d %H:%M:%S")
+    buf.seek(0)
+
+    col_defs = ", ".join(f"{c} {_COHORT_COLUMNS[c]}" for c in cols)
+    with _connect() as conn:
+        conn.exec_driver_sql(f"DROP TABLE IF EXISTS pg_temp.{name}")
+        conn.exec_driver_sql(f"CREATE TEMP TABLE {name} ({col_defs})")
+        with conn.connection.cursor() as cur:
+            cur.copy_expert(f"COPY {name} ({', '.join(cols)}) FROM STDIN WITH (FORMAT csv)", buf)
+        for c in cols:
+            if c.endswith("_id"):
+                conn.exec_driver_sql(f"CREATE INDEX ON {name} ({c})")
+        conn.exec_driver_sql(f"ANALYZE {name}")
+
+    active.info.setdefault("cohort_digests", {})[name] = hashlib.sha256(buf.getvalue().encode()).hexdigest()
+    active.info.setdefault("cohort_columns", {})[name] = frozenset(cols)
+    active.info.setdefault("cohort_tables", {})[name] = {
+        c: frozenset(data[c].dropna().astype(int)) for c in cols if c.endswith("_id")
+    }
+    return name
+
+
+def cohort_table(key: str, ids: list[int], columns: tuple[str, ...] = ()) -> str | None:
+    """
+    Name of a registered cohort table whose ``key`` column covers all ``ids``
+    (and which also holds ``columns``, e.g. ``("intime",)``), or None (no
+    session, nothing registered, or a different cohort).
+    """
+    conn = _session_conn.get()
+    if conn is None:
+        return None
+    registered = conn.info.get("cohort_columns", {})
+    for name, id_sets in conn.info.get("cohort_tables", {}).items():
+        if key in id_sets and id_sets[key].issuperset(ids) and registered.get(name, frozenset()).issuperset(columns):
+            return name
+    return None
+
 
+def session_cache() -> dict | None:
+    """
+    Scratch dict that lives as long as the active ``session()`` (None outside
+    a session). ``src.utils`` keeps shared extractions here, e.g. the RRT
+    event store used by all dialysis functions.
+    """
+    conn = _session_conn.get()
+    if conn is None:
+        return None
+    return conn.info.setdefault("session_cache", {})
@@ -0,0 +1,101 @@
+# src/dtypes.py
+"""
+Compact dtype policy for query results.
+
+``pd.read_sql`` returns int64/float64 for numbers and one Python object per
+string value. ``compact_dtypes`` shrinks a result to
+
+* ``int32`` for id columns (``*_id``, ``itemid``; nullable ``Int32`` if NULLs),
+* ``float32`` for the remaining float columns (measurements),
+* ``category`` for low-cardinality strings (``label``, ``rateuom``, ``ethnicity`` ...),
+* ``datetime64`` for timestamp columns that arrived as Python objects,
+
+and ``memory_report`` shows what that saves per column.
+"""
+from __future__ import annotations
+
+import datetime as dt
+
+import numpy as np
+import pandas as pd
+
+_INT32_MAX = np.iinfo(np.int32).max
+
+
+def _is_id(col: str) -> bool:
+    return col == "itemid" or col.endswith("_id")
+
+
+def compact_dtypes(
+    df: pd.DataFrame,
+    float32: bool = True,
+    max_category_ratio: float = 0.5,
+    exclude: tuple[str, ...] = (),
+) -> pd.DataFrame:
+    """
+    Return a copy of ``df`` with compact dtypes (see module docstring).
+
+    Parameters
+    ----------
+    df : DataFrame
+        Query result.
+    float32 : bool
+        Downcast non-id floats to float32. This keeps ~7 significant digits,
+        so a value like 0.1 is stored as 0.1000000015 and a threshold test
+        such as ``dose <= 0.1`` can flip; use ``float32=False`` for inputs
+        of the SOFA/SAPS scoring code.
+    max_category_ratio : float
+        String columns with at most this share of distinct values (relative
+        to their non-null rows) become ``category``.
+    exclude : tuple of str
+        Columns left unchanged.
+    """
+    out = df.copy()
+    for col in out.columns:
+        if col in exclude:
+            continue
+        s = out[col]
+        if _is_id(col) and pd.api.types.is_numeric_dtype(s) and not pd.api.types.is_bool_dtype(s):
+            valid = s.dropna()
+            if (valid % 1 == 0).all() and (valid.abs() <= _INT32_MAX).all():
+                out[col] = s.astype("Int32" if s.isna().any() else "int32")
+        elif pd.api.types.is_float_dtype(s) and s.dtype == np.float64:
+            if float32:
+                out[col] = s.astype(np.float32)
+        elif s.dtype == object:
+            valid = s.dropna()
+            if valid.empty:
+                continue
+            first = valid.iloc[0]
+            if isinstance(first, dt.datetime):
+                # Zeitstempel einmal parsen statt als Python-Objekte mitzuschleppen
+                out[col] = pd.to_datetime(s)
+            elif isinstance(first, str) and valid.nunique() <= max_category_ratio * len(valid):
+                out[col] = s.astype("category")
+    return out
+
+
+def memory_report(before: pd.DataFrame, after: pd.DataFrame) -> pd.DataFrame:
+    """
+    Per-column memory (deep, in bytes) of ``before`` vs. ``after``, plus a
+    ``TOTAL`` row; ``saved_pct`` is relative to ``before``.
+    """
+    rows = []
+    for col in before.columns:
+        b = int(before[col].memory_usage(index=False, deep=True))
+        a = int(after[col].memory_usage(index=False, deep=True)) if col in after else 0
+        rows.append({
+            "column": col,
+            "dtype_before": str(before[col].dtype),
+            "dtype_after": str(after[col].dtype) if col in after else "",
+            "bytes_before": b,
+            "bytes_after": a,
+        })
+    report = pd.DataFrame(rows)
+    total = {
+        "column": "TOTAL", "dtype_before": "", "dtype_after": "",
+        "bytes_before": report["bytes_before"].sum(), "bytes_after": report["bytes_after"].sum(),
+    }
+    report = pd.concat([report, pd.DataFrame([total])], ignore_index=True)
+    report["saved_pct"] = (1 - report["bytes_after"] / report["bytes_before"].where(report["bytes_before"] > 0)) * 100
+    return report.set_index("column")
@@ -0,0 +1,116 @@
+# src/eventindex.py
+"""
+Compact per-stay event index (CSR layout) for repeated window slicing.
+
+Events are sorted by (icustay_id, offset) and stored as contiguous arrays —
+``offset`` (hours since intime, float64), ``value`` and an integer ``code``
+(itemid or category) — with int64 row pointers ``indptr`` per stay, as in a
+CSR sparse matrix. Cutting a window ``[start, end]`` (scalar or per stay)
+is then one binary search per stay boundary instead of a merge, a timestamp
+subtraction and a mask over the whole event frame.
+
+Built from the database by ``src.utils.build_event_index``; the
+``get_*_for_window`` functions and ``compute_sofa_from_raw`` accept it via
+``index=``.
+"""
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+
+
+class EventIndex:
+    """
+    Events of many stays in CSR layout.
+
+    Parameters
+    ----------
+    icustay_id, offset, value, code : array-like
+        One entry per event: stay, hours since intime, value and integer
+        code (e.g. itemid). Any order; sorted on construction.
+    value_dtype : dtype
+        Storage type of ``value``. float64 by default because SOFA cut-offs
+        (creatinine 1.2, norepinephrine 0.1 ...) flip when the value is
+        rounded to float32; pass ``np.float32`` to halve the memory where
+        that does not matter.
+    max_hours : float or None
+        Hours after intime covered by the events; windows ending later are
+        rejected. None = not checked.
+    """
+
+    def __init__(self, icustay_id, offset, value, code, value_dtype=np.float64, max_hours: float | None = None):
+        stay = np.asarray(icustay_id, dtype=np.int64)
+        # float64 wie die Stunden der Event-Pfade, damit Fenstergrenzen exakt gleich schneiden
+        offset = np.asarray(offset, dtype=np.float64)
+        order = np.lexsort((offset, stay))
+        stay = stay[order]
+        self.offset = offset[order]
+        self.value = np.asarray(value, dtype=value_dtype)[order]
+        self.code = np.asarray(code, dtype=np.int64)[order].astype(np.int32)
+        self.max_hours = max_hours
+
+        self.stay_ids, counts = np.unique(stay, return_counts=True)
+        self.indptr = np.zeros(len(self.stay_ids) + 1, dtype=np.int64)
+        np.cumsum(counts, out=self.indptr[1:])
+
+    def __len__(self) -> int:
+        return len(self.offset)
+
+    @property
+    def nbytes(self) -> int:
+        """Memory of the index arrays in bytes."""
+        return int(sum(a.nbytes for a in (self.stay_ids, self.indptr, self.offset, self.value, self.code)))
+
+    def _per_stay(self, hours: float | pd.Series) -> np.ndarray:
+        if isinstance(hours, pd.Series):
+            per_stay = hours.groupby(level=0).first()
+            return per_stay.reindex(self.stay_ids).to_numpy(dtype=float)
+        return np.full(len(self.stay_ids), float(hours))
+
+    def _search(self, targets: np.ndarray, side: str) -> np.ndarray:
+        """
+        Per stay, the first row whose offset is ``>= target`` (``side="left"``)
+        or ``> target`` (``side="right"``) — a binary search inside each
+        stay's segment, run for all stays at once.
+        """
+        lo = self.indptr[:-1].copy()
+        hi = self.indptr[1:].copy()
+        active = np.flatnonzero(lo < hi)
+        while len(active):
+            mid = (lo[active] + hi[active]) // 2
+            v = self.offset[mid]
+            right = v < targets[active] if side == "left" else v <= targets[active]
+            lo[active] = np.where(right, mid + 1, lo[active])
+            hi[active] = np.where(right, hi[active], mid)
+            active = active[lo[active] < hi[active]]
+        return lo
+
+    def window(self, end_hours: float | pd.Series, start_hours: float | pd.Series = 0.0) -> pd.DataFrame:
+        """
+        Events with ``start_hours <= offset <= end_hours``.
+
+        Bounds are scalars or Series indexed by ``icustay_id``; with a
+        Series, stays missing from it or with NaN contribute no events.
+        Returns ``icustay_id, code, hours, value`` ordered by stay and offset.
+        """
+        end = self._per_stay(end_hours)
+        start = self._per_stay(start_hours)
+        if self.max_hours is not None and np.nanmax(end, initial=-np.inf) > self.max_hours:
+            raise ValueError(
+                f"Fenster endet nach {self.max_hours} h; der Index deckt nur die ersten "
+                f"{self.max_hours} h ab (build_event_index(..., max_hours=...))."
+            )
+        valid = ~np.isnan(end) & ~np.isnan(start)
+        lo = self._search(np.where(valid, start, 0.0), "left")
+        hi = np.where(valid, self._search(np.where(valid, end, 0.0), "right"), lo)
+        lengths = np.maximum(hi - lo, 0)
+
+        # Zeilenbereiche [lo, hi) aller Aufenthalte ohne Python-Schleife aneinanderhängen
+        total = int(lengths.sum())
+        rows = np.arange(total) - np.repeat(np.cumsum(lengths) - lengths, lengths) + np.repeat(lo, lengths)
+        return pd.DataFrame({
+            "icustay_id": np.repeat(self.stay_ids, lengths),
+            "code": self.code[rows],
+            "hours": self.offset[rows],
+            "value": self.value[rows],
+        })
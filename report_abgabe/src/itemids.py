@@ -0,0 +1,82 @@
+# src/itemids.py
+"""
+Resolve ``d_items`` label patterns to itemid sets.
+
+The event helpers in ``src.utils`` used to select e.g. vasopressor rows via
+``JOIN d_items ... WHERE LOWER(di.label) LIKE '%norepinephrine%'``, i.e. the
+label match was re-evaluated for every scanned event row. ``resolve_itemids``
+evaluates the patterns once against ``d_items`` and returns the matching
+itemids, so the event queries become ``ie.itemid = ANY(:itemids)`` (index-
+friendly, no join). Results are memoized in-process and persisted to
+``itemids.json`` in ``src.db.cache_dir()``, keyed by ``src.db.db_fingerprint()``,
+so a restarted kernel does not query ``d_items`` again.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+from typing import Iterable
+
+from src.db import cache_dir, db_fingerprint, q
+
+_RESOLVE_SQL = """
+    SELECT itemid
+    FROM d_items
+    WHERE LOWER(label) LIKE ANY(CAST(:patterns AS text[]))
+      AND NOT (LOWER(label) LIKE ANY(CAST(:exclude AS text[])))
+    ORDER BY itemid
+"""
+
+_memo: dict[str, list[int]] = {}
+
+
+def _store_path():
+    return cache_dir() / "itemids.json"
+
+
+def _load_store() -> dict:
+    try:
+        return json.loads(_store_path().read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_store(store: dict) -> None:
+    path = _store_path()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(store, indent=1, sort_keys=True), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def resolve_itemids(patterns: Iterable[str], exclude: Iterable[str] = ()) -> list[int]:
+    """
+    Sorted itemids whose lower-cased ``d_items.label`` matches any of the
+    SQL ``LIKE`` ``patterns`` (e.g. ``"%dopamine%"``) and none of ``exclude``.
+
+    Equivalent to ``LOWER(di.label) LIKE p1 OR ... AND NOT (... LIKE e1 OR ...)``
+    in the event query; patterns should therefore be lower case.
+    """
+    patterns = sorted(set(patterns))
+    exclude = sorted(set(exclude))
+    fingerprint = db_fingerprint()
+    key = hashlib.sha256(json.dumps([fingerprint, patterns, exclude]).encode("utf-8")).hexdigest()
+    if key in _memo:
+        return _memo[key]
+
+    store = _load_store()
+    entry = store.get(key)
+    if entry is None:
+        ids = q(_RESOLVE_SQL, {"patterns": patterns, "exclude": exclude})["itemid"].astype(int).tolist()
+        entry = {"patterns": patterns, "exclude": exclude, "itemids": ids}
+        store[key] = entry
+        _save_store(store)
+    _memo[key] = entry["itemids"]
+    return _memo[key]
+
+
+def invalidate_itemids() -> None:
+    """Forget all resolved patterns (in memory and on disk), e.g. after a ``d_items`` change."""
+    _memo.clear()
+    _store_path().unlink(missing_ok=True)
@@ -0,0 +1,109 @@
+# src/querylog.py
+"""
+Per-call query instrumentation for ``src.db``.
+
+Inside ``with src.db.profile_queries() as prof:`` every ``q()``/``load_sql()``
+(and the bulk ``q_copy``/``q_arrow``/``q_iter`` pulls) is recorded with the
+calling function, wall time, rows and approximate bytes; with
+``explain=True`` additionally the ``EXPLAIN (ANALYZE, BUFFERS)`` plan and the
+server-side execution time. ``prof.report()`` aggregates a pipeline run per
+calling function. Queries slower than the slow-query threshold are logged to
+the ``src.db`` logger whether or not a profile is active.
+"""
+from __future__ import annotations
+
+import logging
+import re
+import sys
+from pathlib import Path
+
+import pandas as pd
+
+logger = logging.getLogger("src.db")
+
+# Frames aus diesen Modulen zählen nicht als "Aufrufer"
+_INTERNAL_FILES = {
+    str(Path(__file__).with_name(name)) for name in ("db.py", "db_connect.py", "querylog.py", "cache.py")
+}
+
+
+def calling_function() -> str:
+    """``module.function`` of the first stack frame outside the DB layer."""
+    frame = sys._getframe(1)
+    while frame is not None and (
+        frame.f_code.co_filename in _INTERNAL_FILES or frame.f_code.co_filename.endswith("contextlib.py")
+    ):
+        frame = frame.f_back
+    if frame is None:
+        return "<unknown>"
+    module = frame.f_globals.get("__name__", "?")
+    return f"{module}.{frame.f_code.co_name}"
+
+
+def approx_bytes(df: pd.DataFrame) -> int:
+    """In-memory size of a result (deep, i.e. including Python strings)."""
+    return int(df.memory_usage(index=False, deep=True).sum())
+
+
+def short_sql(sql: str, width: int = 160) -> str:
+    sql = re.sub(r"\s+", " ", sql).strip()
+    return sql if len(sql) <= width else sql[: width - 3] + "..."
+
+
+class QueryProfile:
+    """
+    Collects one record per query of a pipeline run.
+
+    Parameters
+    ----------
+    explain : bool
+        Also run ``EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON)`` for ``q()``
+        calls. Note that this executes each query a second time.
+    slow_seconds : float or None
+        Queries at or above this wall time are logged as warnings to the
+        ``src.db`` logger (overrides ``DB_SLOW_QUERY_SECONDS`` while active).
+    """
+
+    def __init__(self, explain: bool = False, slow_seconds: float | None = None):
+        self.explain = explain
+        self.slow_seconds = slow_seconds
+        self.records: list[dict] = []
+
+    def add(self, **record) -> None:
+        self.records.append(record)
+
+    def to_frame(self) -> pd.DataFrame:
+        """All records, one row per query (``plan`` holds the JSON plan if captured)."""
+        cols = ["caller", "kind", "sql", "seconds", "server_seconds", "rows", "bytes", "cached", "plan"]
+        return pd.DataFrame(self.records, columns=cols)
+
+    def report(self) -> pd.DataFrame:
+        """
+        Aggregate per calling function: number of calls, total / max wall
+        time, share of the run, server time, rows, bytes and cache hits;
+        sorted by total time.
+        """
+        df = self.to_frame()
+        if df.empty:
+            return pd.DataFrame(
+                columns=["calls", "seconds", "max_seconds", "share", "server_seconds", "rows", "bytes", "cache_hits"]
+            )
+        out = df.groupby("caller").agg(
+            calls=("sql", "size"),
+            seconds=("seconds", "sum"),
+            max_seconds=("seconds", "max"),
+            server_seconds=("server_seconds", lambda s: s.sum(min_count=1)),
+            rows=("rows", "sum"),
+            bytes=("bytes", "sum"),
+            cache_hits=("cached", "sum"),
+        )
+        out.insert(3, "share", out["seconds"] / out["seconds"].sum())
+        return out.sort_values("seconds", ascending=False)
+
+
+def log_if_slow(threshold: float | None, caller: str, kind: str, sql: str, seconds: float, rows) -> None:
+    if threshold is not None and seconds >= threshold:
+        logger.warning(
+            "Langsame Abfrage (%.2f s, %s Zeilen) in %s [%s]: %s",
+            seconds, "?" if rows is None else rows, caller, kind, short_sql(sql),
+        )
@@ -1,9 +1,37 @@
 # src/utils.py
 from __future__ import annotations
 
+import importlib.util
+
 import numpy as np
 import pandas as pd
-from src.db import q
+from src.cube import HourlyCube
+from src.db import cohort_table, q, q_copy, session, session_cache
+from src.eventindex import EventIndex
+from src.itemids import resolve_itemids
+
+
+def _id_list(s: pd.Series) -> list[int]:
+    """Unique non-null ids as plain Python ints (bound as one SQL array parameter)."""
+    return s.dropna().astype(int).unique().tolist()
+
+
+def _cohort_filter(df: pd.DataFrame, key: str, column: str | None = None) -> tuple[str, dict]:
+    """
+    SQL predicate restricting ``column`` (default: ``key``) to the cohort ids.
+
+    Joins against a cohort temp table from ``src.db.register_cohort`` when it
+    covers all ids of ``df``; otherwise binds the ids as array parameter
+    ``:<key>s``. Returns ``("TRUE", {})`` if ``df`` has no ``key`` column.
+    """
+    column = column or key
+    if key not in df.columns:
+        return "TRUE", {}
+    ids = _id_list(df[key])
+    table = cohort_table(key, ids)
+    if table is not None:
+        return f"{column} IN (SELECT {key} FROM {table})", {}
+    return f"{column} = ANY(:{key}s)", {f"{key}s": ids}
 
 
 def add_icu_los_days(df_aki: pd.DataFrame) -> pd.DataFrame:
@@ -13,6 +41,122 @@ def add_icu_los_days(df_aki: pd.DataFrame) -> pd.DataFrame:
     return df
 
 
+# d_items-Labelmuster für RRT-Events (Vereinigung aller Dialyse-Funktionen)
+_RRT_PATTERNS = ("hemodial", "haemodial", "dialysis", "crrt", "cvvh", "hemofiltration")
+# Standardmuster je Quelle: Dialyse-Prozeduren bzw. CRRT-Lösungen/-Filtration
+_RRT_PE_PATTERNS = ("hemodial", "haemodial", "dialysis", "crrt")
+_RRT_IE_PATTERNS = ("crrt", "cvvh", "hemofiltration")
+
+
+def _rrt_event_store(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    All RRT events of the cohort from ``procedureevents_mv`` (one query) and
+    ``inputevents_mv`` (from the shared ``_intervention_store``).
+
+    One row per event with ``source`` (``"pe"``/``"ie"``), ``icustay_id``,
+    ``starttime``, ``endtime`` and a boolean ``p_<pattern>`` column per
+    label pattern in ``_RRT_PATTERNS`` (resolved to itemids once via
+    ``src.itemids.resolve_itemids``). Inside ``session()`` the store is
+    built once and reused by every dialysis function of the session.
+    """
+    ids = _id_list(df["icustay_id"])
+    cache = session_cache()
+    if cache is not None and "rrt_events" in cache:
+        cached_ids, store = cache["rrt_events"]
+        if cached_ids.issuperset(ids):
+            return store[store["icustay_id"].isin(ids)]
+
+    pe_pred, params = _cohort_filter(df, "icustay_id", "pe.icustay_id")
+    pattern_ids = {p: resolve_itemids([f"%{p}%"]) for p in _RRT_PATTERNS}
+    params["rrt_itemids"] = sorted(set().union(*pattern_ids.values()))
+    params.update({f"p_{p}": ids for p, ids in pattern_ids.items()})
+    flags = ",\n".join(f"pe.itemid = ANY(:p_{p}) AS p_{p}" for p in _RRT_PATTERNS)
+
+    pe = q(f"""
+        SELECT 'pe' AS source, pe.icustay_id, pe.starttime, pe.endtime,
+               {flags}
+        FROM procedureevents_mv pe
+        WHERE {pe_pred}
+          AND pe.itemid = ANY(:rrt_itemids)
+    """, params)
+
+    rrt_classes = tuple(f"rrt_{p}" for p in _RRT_PATTERNS)
+    ie = _intervention_store(df, categories=rrt_classes)
+    ie = ie[ie[[f"c_{c}" for c in rrt_classes]].any(axis=1)]
+    ie = pd.DataFrame({
+        "source": "ie",
+        "icustay_id": ie["icustay_id"],
+        "starttime": ie["starttime"],
+        "endtime": ie["endtime"],
+        **{f"p_{p}": ie[f"c_rrt_{p}"] for p in _RRT_PATTERNS},
+    })
+    store = pd.concat([pe, ie], ignore_index=True)
+
+    if cache is not None:
+        cache["rrt_events"] = (frozenset(ids), store)
+    return store
+
+
+def _rrt_events(
+    df: pd.DataFrame,
+    pe_patterns: tuple[str, ...] = _RRT_PE_PATTERNS,
+    ie_patterns: tuple[str, ...] = _RRT_IE_PATTERNS,
+) -> pd.DataFrame:
+    """
+    RRT events (``icustay_id``, ``starttime``, ``endtime``) whose label
+    matches one of ``pe_patterns`` (procedureevents_mv) or ``ie_patterns``
+    (inputevents_mv; empty = no inputevents), taken from the shared store.
+    """
+    store = _rrt_event_store(df)
+    mask = pd.Series(False, index=store.index)
+    for source, patterns in (("pe", pe_patterns), ("ie", ie_patterns)):
+        if patterns:
+            hit = store[[f"p_{p}" for p in patterns]].fillna(False).astype(bool).any(axis=1)
+            mask |= (store["source"] == source) & hit
+    return store.loc[mask, ["icustay_id", "starttime", "endtime"]].reset_index(drop=True)
+
+
+def merge_intervals(
+    events: pd.DataFrame,
+    key: str,
+    start_col: str,
+    end_col: str,
+    gap_tolerance_hours: float = 0.0,
+) -> pd.DataFrame:
+    """
+    Merge overlapping or nearly adjacent intervals per ``key`` into sessions.
+
+    Within each group, intervals sorted by start belong to the same session
+    as long as their start is at most ``gap_tolerance_hours`` after the
+    running maximum end of the session so far. Vectorized: one sort, a
+    grouped ``cummax`` of the end times and a cumulative sum over the
+    session breaks, so it works for any start/end event table (RRT,
+    vasopressor infusions, ventilation, ...).
+
+    Returns one row per session with columns ``key``, ``start_col``
+    (session start) and ``end_col`` (session end), ordered by ``key`` and
+    start. Rows with missing ``key``/start/end are ignored; intervals are
+    assumed to satisfy ``end >= start``.
+    """
+    ev = events[[key, start_col, end_col]].dropna()
+    if ev.empty:
+        return ev.reset_index(drop=True)
+    ev = ev.sort_values([key, start_col, end_col], kind="stable")
+
+    run_end = ev.groupby(key, sort=False)[end_col].cummax()
+    prev_end = run_end.groupby(ev[key], sort=False).shift()
+    gap = pd.to_timedelta(gap_tolerance_hours, unit="h")
+    # neue Session: erstes Intervall der Gruppe oder Start nach (laufendem Ende + Toleranz)
+    new_session = prev_end.isna() | (ev[start_col] > prev_end + gap)
+    session_id = new_session.cumsum()
+
+    return (
+        ev.groupby(session_id, sort=False)
+        .agg(**{key: (key, "first"), start_col: (start_col, "first"), end_col: (end_col, "max")})
+        .reset_index(drop=True)
+    )
+
+
 def add_dialysis_flag(df_aki: pd.DataFrame) -> pd.DataFrame:
     """
     Adds 'dialysis' flag (0/1) to df_aki.
@@ -27,23 +171,16 @@ def add_dialysis_flag(df_aki: pd.DataFrame) -> pd.DataFrame:
       - Not suitable for exact RRT start time (timing analyses) without refinement.
     """
     df = df_aki.copy()
+    hadm_pred, hadm_params = _cohort_filter(df, "hadm_id")
 
-    df_rrt_proc = q("""
-        SELECT DISTINCT pe.icustay_id
-        FROM procedureevents_mv pe
-        JOIN d_items di ON pe.itemid = di.itemid
-        WHERE
-            LOWER(di.label) LIKE '%hemodial%'
-         OR LOWER(di.label) LIKE '%haemodial%'
-         OR LOWER(di.label) LIKE '%crrt%'
-         OR LOWER(di.label) LIKE '%dialysis%'
-    """)
-
-    df_rrt_icd = q("""
+    df_rrt_proc = _rrt_events(df, ie_patterns=())
+
+    df_rrt_icd = q(f"""
         SELECT DISTINCT hadm_id
         FROM procedures_icd
-        WHERE icd9_code IN ('3995','5498')
-    """)
+        WHERE {hadm_pred}
+          AND icd9_code IN ('3995','5498')
+    """, hadm_params)
 
     df["dialysis"] = (
         df["icustay_id"].isin(df_rrt_proc["icustay_id"])
@@ -57,26 +194,12 @@ def add_early_dopamine_flag(df_aki: pd.DataFrame, window_hours: float = 24.0) ->
     """
     Adds 'early_dopamine' flag (0/1): dopamine started within [0, window_hours] hours after ICU intime.
 
-    Uses inputevents_mv joined to d_items via itemid.
+    Uses inputevents_mv rows of category 'dopamine' (d_items label matching
+    '%dopamine%'), taken from the shared intervention store.
     """
     df = df_aki.copy()
-
-    df_dopamine = q("""
-        SELECT ie.icustay_id, ie.starttime
-        FROM inputevents_mv ie
-        JOIN d_items di ON ie.itemid = di.itemid
-        WHERE LOWER(di.label) LIKE '%dopamine%'
-    """)
-
-    # merge intime for delta calculation
-    dopa = df_dopamine.merge(df[["icustay_id", "intime"]], on="icustay_id", how="inner")
-
-    dopa["hours_since_icu"] = (dopa["starttime"] - dopa["intime"]).dt.total_seconds() / 3600
-
-    early_ids = dopa.loc[
-        (dopa["hours_since_icu"] >= 0) & (dopa["hours_since_icu"] <= window_hours),
-        "icustay_id"
-    ].unique()
+    first = _first_intervention_hours(df, categories=("dopamine",))
+    early_ids = first.index[first <= window_hours]
 
     df["early_dopamine"] = df["icustay_id"].isin(early_ids).astype(int)
     return df
@@ -102,8 +225,9 @@ def add_sofa_score(df_aki: pd.DataFrame) -> pd.DataFrame:
     ``compute_sofa_from_raw(window_hours=...)``.
     """
     df = df_aki.copy()
+    pred, params = _cohort_filter(df, "icustay_id")
     
-    df_sofa = q("""
+    df_sofa = q(f"""
         SELECT icustay_id, 
                sofa, 
                respiration, 
@@ -113,7 +237,8 @@ def add_sofa_score(df_aki: pd.DataFrame) -> pd.DataFrame:
                cns, 
                renal
         FROM mimiciii_derived.sofa
-    """)
+        WHERE {pred}
+    """, params)
     
     # Rename columns for clarity
     df_sofa = df_sofa.rename(columns={
@@ -156,8 +281,9 @@ def add_sapsii_score(df_aki: pd.DataFrame) -> pd.DataFrame:
       - sapsii_admissiontype_score: Admission type component
     """
     df = df_aki.copy()
+    pred, params = _cohort_filter(df, "icustay_id")
     
-    df_saps = q("""
+    df_saps = q(f"""
         SELECT icustay_id,
                sapsii,
                sapsii_prob,
@@ -177,7 +303,8 @@ def add_sapsii_score(df_aki: pd.DataFrame) -> pd.DataFrame:
                comorbidity_score,
                admissiontype_score
         FROM mimiciii_derived.sapsii
-    """)
+        WHERE {pred}
+    """, params)
     
     # Rename columns explicitly to avoid confusion with other scores 
     # (e.g., 'gcs_score' creates clarity vs just 'gcs' or potential overlaps)
@@ -202,6 +329,17 @@ def add_sapsii_score(df_aki: pd.DataFrame) -> pd.DataFrame:
     df = df.merge(df_saps, on='icustay_id', how='left')
     return df
 
+# d_items-Labelmuster (einschließen, ausschließen) je Katecholamin/Vasopressor
+_VASO_CLASSES = {
+    "norepinephrine": (("%norepinephrine%",), ()),
+    "epinephrine": (("%epinephrine%",), ("%norepi%",)),
+    "dopamine": (("%dopamine%",), ()),
+    "dobutamine": (("%dobutamine%",), ()),
+    "phenylephrine": (("%phenylephrine%",), ()),
+    "vasopressin": (("%vasopressin%",), ()),
+}
+
+
 def add_vasopressor_flags(df_aki: pd.DataFrame, window_hours: float = 24.0) -> pd.DataFrame:
     """
     Adds vasopressor flags (0/1) for early use within window_hours after ICU intime.
@@ -213,53 +351,13 @@ def add_vasopressor_flags(df_aki: pd.DataFrame, window_hours: float = 24.0) -> p
       - any_vasopressor: Any vasopressor started early
     """
     df = df_aki.copy()
-    
-    # Get all vasopressor events
-    vaso_events = q(f"""
-        SELECT ie.icustay_id, ie.starttime, 
-               CASE 
-                   WHEN LOWER(di.label) LIKE '%norepinephrine%' THEN 'norepinephrine'
-                   WHEN LOWER(di.label) LIKE '%epinephrine%' AND LOWER(di.label) NOT LIKE '%norepi%' THEN 'epinephrine'
-                   WHEN LOWER(di.label) LIKE '%phenylephrine%' THEN 'phenylephrine'
-                   WHEN LOWER(di.label) LIKE '%vasopressin%' THEN 'vasopressin'
-                   ELSE 'other'
-               END as vasopressor_type
-        FROM inputevents_mv ie
-        JOIN d_items di ON ie.itemid = di.itemid
-        WHERE LOWER(di.label) LIKE '%norepinephrine%'
-           OR LOWER(di.label) LIKE '%epinephrine%'
-           OR LOWER(di.label) LIKE '%phenylephrine%'
-           OR LOWER(di.label) LIKE '%vasopressin%'
-    """)
-    
-    if len(vaso_events) == 0:
-        # Add columns with all zeros if no vasopressors found
-        df['early_norepinephrine'] = 0
-        df['early_epinephrine'] = 0
-        df['early_phenylephrine'] = 0
-        df['any_vasopressor'] = 0
-        return df
-    
-    # Merge with intime for delta calculation
-    vaso = vaso_events.merge(df[["icustay_id", "intime"]], on="icustay_id", how="inner")
-    vaso["hours_since_icu"] = (vaso["starttime"] - vaso["intime"]).dt.total_seconds() / 3600
-    
-    # Filter early use only
-    vaso_early = vaso[(vaso["hours_since_icu"] >= 0) & (vaso["hours_since_icu"] <= window_hours)]
-    
-    # Create flags for each vasopressor type
-    df['early_norepinephrine'] = df['icustay_id'].isin(
-        vaso_early[vaso_early['vasopressor_type'] == 'norepinephrine']['icustay_id'].unique()
-    ).astype(int)
-    
-    df['early_epinephrine'] = df['icustay_id'].isin(
-        vaso_early[vaso_early['vasopressor_type'] == 'epinephrine']['icustay_id'].unique()
-    ).astype(int)
-    
-    df['early_phenylephrine'] = df['icustay_id'].isin(
-        vaso_early[vaso_early['vasopressor_type'] == 'phenylephrine']['icustay_id'].unique()
-    ).astype(int)
-    
+    names = ("norepinephrine", "epinephrine", "phenylephrine")
+    ev = _intervention_events(df, categories=names)
+    ev = ev[(ev["hours"] >= 0) & (ev["hours"] <= window_hours)]
+    for name in names:
+        early_ids = ev.loc[ev[f"c_{name}"].to_numpy(dtype=bool), "icustay_id"].unique()
+        df[f"early_{name}"] = df["icustay_id"].isin(early_ids).astype(int)
+
     df['any_vasopressor'] = (
         (df['early_norepinephrine'] == 1) |
         (df['early_epinephrine'] == 1) |
@@ -276,33 +374,42 @@ def add_mechanical_ventilation_flag(df_aki: pd.DataFrame) -> pd.DataFrame:
     Uses procedureevents_mv or ventilation_durations derived table if available.
     """
     df = df_aki.copy()
+    pred, params = _cohort_filter(df, "icustay_id")
     
     # Try derived table first, fall back to procedureevents
     try:
-        df_vent = q("""
+        df_vent = q(f"""
             SELECT DISTINCT icustay_id
             FROM mimiciii_derived.ventilation_durations
-        """)
+            WHERE {pred}
+        """, params)
     except:
-        df_vent = q("""
+        df_vent = q(f"""
             SELECT DISTINCT icustay_id
             FROM procedureevents_mv
-            WHERE LOWER(description) LIKE '%intubat%'
-               OR LOWER(description) LIKE '%ventilat%'
-        """)
+            WHERE {pred}
+              AND (
+                   LOWER(description) LIKE '%intubat%'
+                OR LOWER(description) LIKE '%ventilat%'
+              )
+        """, params)
     
     df['mechanical_ventilation'] = df['icustay_id'].isin(df_vent['icustay_id']).astype(int)
     return df
 
 
-def _run_first_successful_query(sql_queries: list[str], required_cols: list[str]) -> pd.DataFrame:
+def _run_first_successful_query(
+    sql_queries: list[str],
+    required_cols: list[str],
+    params: dict | None = None,
+) -> pd.DataFrame:
     """
     Execute SQL statements in order and return the first result containing
     all required columns.
     """
     for sql in sql_queries:
         try:
-            res = q(sql)
+            res = q(sql, params)
             if all(c in res.columns for c in required_cols):
                 return res
         except Exception:
@@ -328,32 +435,41 @@ def add_kdigo_stage(
     if "icustay_id" not in df.columns:
         raise ValueError("df_aki muss 'icustay_id' enthalten.")
 
+    pred, params = _cohort_filter(df, "icustay_id")
+    stay_pred, _ = _cohort_filter(df, "icustay_id", "stay_id")
+
     kdigo_queries = [
-        """
+        f"""
         SELECT icustay_id, aki_stage_6h AS aki_stage
         FROM kdigo_stage_first6h
+        WHERE {pred}
         """,
-        """
+        f"""
         SELECT icustay_id, aki_stage_48hr AS aki_stage
         FROM kdigo_stages_48hr
+        WHERE {pred}
         """,
-        """
+        f"""
         SELECT icustay_id, aki_stage_7day AS aki_stage
         FROM kdigo_stages_7day
+        WHERE {pred}
         """,
-        """
+        f"""
         SELECT icustay_id, MAX(aki_stage) AS aki_stage
         FROM kdigo_stages
+        WHERE {pred}
         GROUP BY icustay_id
         """,
-        """
+        f"""
         SELECT icustay_id, MAX(aki_stage) AS aki_stage
         FROM mimiciii_derived.kdigo_stages
+        WHERE {pred}
         GROUP BY icustay_id
         """,
-        """
+        f"""
         SELECT stay_id AS icustay_id, MAX(aki_stage) AS aki_stage
         FROM mimiciv_derived.kdigo_stages
+        WHERE {stay_pred}
         GROUP BY stay_id
         """,
     ]
@@ -361,6 +477,7 @@ def add_kdigo_stage(
     kdigo = _run_first_successful_query(
         sql_queries=kdigo_queries,
         required_cols=["icustay_id", "aki_stage"],
+        params=params,
     )
 
     if kdigo.empty:
@@ -393,39 +510,49 @@ def add_sepsis_flag(
     if "icustay_id" not in df.columns and "hadm_id" not in df.columns:
         raise ValueError("df_aki muss mindestens 'icustay_id' oder 'hadm_id' enthalten.")
 
+    icu_pred, icu_params = _cohort_filter(df, "icustay_id")
+    hadm_pred, hadm_params = _cohort_filter(df, "hadm_id")
+
     sepsis_queries = [
-        """
+        f"""
         SELECT icustay_id, COALESCE(sepsis_6h, sepsis_any_hosp) AS sepsis
         FROM sepsis_flag_first6h
+        WHERE {icu_pred}
         """,
-        """
+        f"""
         SELECT icustay_id, MAX(CASE WHEN sepsis3 THEN 1 ELSE 0 END) AS sepsis
         FROM sepsis3
+        WHERE {icu_pred}
         GROUP BY icustay_id
         """,
-        """
+        f"""
         SELECT icustay_id, MAX(CASE WHEN sepsis3 THEN 1 ELSE 0 END) AS sepsis
         FROM mimiciii_derived.sepsis3
+        WHERE {icu_pred}
         GROUP BY icustay_id
         """,
-        """
+        f"""
         SELECT hadm_id, MAX(sepsis) AS sepsis
         FROM angus
+        WHERE {hadm_pred}
         GROUP BY hadm_id
         """,
-        """
+        f"""
         SELECT hadm_id, MAX(sepsis) AS sepsis
         FROM martin
+        WHERE {hadm_pred}
         GROUP BY hadm_id
         """,
-        """
+        f"""
         SELECT hadm_id, MAX(sepsis) AS sepsis
         FROM explicit
+        WHERE {hadm_pred}
         GROUP BY hadm_id
         """,
-        """
+        f"""
         SELECT hadm_id, MAX(angus) AS sepsis
         FROM angus
+        WHERE {hadm_pred}
         GROUP BY hadm_id
         """,
     ]
@@ -433,6 +560,7 @@ def add_sepsis_flag(
     sepsis_df = _run_first_successful_query(
         sql_queries=sepsis_queries,
         required_cols=["sepsis"],
+        params={**icu_params, **hadm_params},
     )
 
     if sepsis_df.empty:
@@ -473,9 +601,10 @@ def add_first6h_baseline_confounders(
       - Mechanical ventilation flag via ``add_mechanical_ventilation_flag``
     """
     df = df_aki.copy()
-    df = add_kdigo_stage(df, col_name=kdigo_col)
-    df = add_sepsis_flag(df, col_name=sepsis_col)
-    df = add_mechanical_ventilation_flag(df)
+    with session():
+        df = add_kdigo_stage(df, col_name=kdigo_col)
+        df = add_sepsis_flag(df, col_name=sepsis_col)
+        df = add_mechanical_ventilation_flag(df)
 
     if ventilation_col != "mechanical_ventilation" and "mechanical_ventilation" in df.columns:
         df = df.rename(columns={"mechanical_ventilation": ventilation_col})
@@ -509,33 +638,10 @@ def add_early_late_dialysis_flags(
     if missing:
         raise ValueError(f"df_aki fehlt Spalten: {missing}")
 
-    # --- 1) RRT events from procedureevents_mv (timed)
-    pe = q("""
-        SELECT pe.icustay_id, pe.starttime
-        FROM procedureevents_mv pe
-        JOIN d_items di ON pe.itemid = di.itemid
-        WHERE
-            LOWER(di.label) LIKE '%hemodial%'
-         OR LOWER(di.label) LIKE '%haemodial%'
-         OR LOWER(di.label) LIKE '%crrt%'
-         OR LOWER(di.label) LIKE '%dialysis%'
-    """)
-
-    events = pe.copy()
-
-    # --- 2) Optional: inputevents_mv (some CRRT signals appear here)
-    if include_inputevents:
-        ie = q("""
-            SELECT ie.icustay_id, ie.starttime
-            FROM inputevents_mv ie
-            JOIN d_items di ON ie.itemid = di.itemid
-            WHERE
-                LOWER(di.label) LIKE '%crrt%'
-             OR LOWER(di.label) LIKE '%cvvh%'
-             OR LOWER(di.label) LIKE '%hemofiltration%'
-             OR LOWER(di.label) LIKE '%dialysis%'
-        """)
-        events = pd.concat([events, ie], ignore_index=True)
+    # RRT events from procedureevents_mv (timed), optional inputevents_mv
+    # (some CRRT signals appear there)
+    ie_patterns = _RRT_IE_PATTERNS + ("dialysis",) if include_inputevents else ()
+    events = _rrt_events(df, ie_patterns=ie_patterns)[["icustay_id", "starttime"]]
 
     # Clean & merge intime
     events = events.dropna(subset=["icustay_id", "starttime"])
@@ -581,30 +687,8 @@ def extract_dialysis_timing(df_aki: pd.DataFrame) -> pd.DataFrame:
 
     df = df_aki.copy()
 
-    # --- Procedure-based dialysis (IHD etc.)
-    pe = q("""
-        SELECT pe.icustay_id, pe.starttime, pe.endtime
-        FROM procedureevents_mv pe
-        JOIN d_items di ON pe.itemid = di.itemid
-        WHERE
-            LOWER(di.label) LIKE '%hemodial%'
-         OR LOWER(di.label) LIKE '%haemodial%'
-         OR LOWER(di.label) LIKE '%dialysis%'
-         OR LOWER(di.label) LIKE '%crrt%'
-    """)
-
-    # --- CRRT from inputevents
-    ie = q("""
-        SELECT ie.icustay_id, ie.starttime, ie.endtime
-        FROM inputevents_mv ie
-        JOIN d_items di ON ie.itemid = di.itemid
-        WHERE
-            LOWER(di.label) LIKE '%crrt%'
-         OR LOWER(di.label) LIKE '%cvvh%'
-         OR LOWER(di.label) LIKE '%hemofiltration%'
-    """)
-
-    events = pd.concat([pe, ie], ignore_index=True)
+    # Procedure-based dialysis (IHD etc.) + CRRT from inputevents
+    events = _rrt_events(df)
     events = events.dropna(subset=["icustay_id", "starttime"])
 
     # join ICU intime
@@ -664,31 +748,7 @@ def add_dialysis_near_icu_discharge_flag(
     # -----------------------------
     # 1) Dialysis events (timed)
     # -----------------------------
-    pe = q("""
-        SELECT pe.icustay_id, pe.starttime, pe.endtime
-        FROM procedureevents_mv pe
-        JOIN d_items di ON pe.itemid = di.itemid
-        WHERE
-            LOWER(di.label) LIKE '%hemodial%'
-         OR LOWER(di.label) LIKE '%haemodial%'
-         OR LOWER(di.label) LIKE '%dialysis%'
-         OR LOWER(di.label) LIKE '%crrt%'
-    """)
-
-    events = pe.copy()
-
-    if include_inputevents:
-        ie = q("""
-            SELECT ie.icustay_id, ie.starttime, ie.endtime
-            FROM inputevents_mv ie
-            JOIN d_items di ON ie.itemid = di.itemid
-            WHERE
-                LOWER(di.label) LIKE '%crrt%'
-             OR LOWER(di.label) LIKE '%cvvh%'
-             OR LOWER(di.label) LIKE '%hemofiltration%'
-        """)
-        events = pd.concat([events, ie], ignore_index=True)
-
+    events = _rrt_events(df, ie_patterns=_RRT_IE_PATTERNS if include_inputevents else ())
     events = events.dropna(subset=["icustay_id", "starttime"])
 
     # -----------------------------
@@ -760,35 +820,12 @@ def add_rrt_persistence_near_discharge(
         raise ValueError(f"df_aki fehlt Spalten: {missing}")
 
     # --- timed RRT events (start/end). endtime can be missing -> treat as instantaneous
-    pe = q("""
-        SELECT pe.icustay_id, pe.starttime, pe.endtime
-        FROM procedureevents_mv pe
-        JOIN d_items di ON pe.itemid = di.itemid
-        WHERE
-            LOWER(di.label) LIKE '%hemodial%'
-         OR LOWER(di.label) LIKE '%haemodial%'
-         OR LOWER(di.label) LIKE '%dialysis%'
-         OR LOWER(di.label) LIKE '%crrt%'
-         OR LOWER(di.label) LIKE '%cvvh%'
-         OR LOWER(di.label) LIKE '%hemofiltration%'
-    """)
-
-    events = pe.copy()
-
-    if include_inputevents:
-        ie = q("""
-            SELECT ie.icustay_id, ie.starttime, ie.endtime
-            FROM inputevents_mv ie
-            JOIN d_items di ON ie.itemid = di.itemid
-            WHERE
-                LOWER(di.label) LIKE '%crrt%'
-             OR LOWER(di.label) LIKE '%cvvh%'
-             OR LOWER(di.label) LIKE '%cvvhd%'
-             OR LOWER(di.label) LIKE '%cvvhdf%'
-             OR LOWER(di.label) LIKE '%hemofiltration%'
-             OR LOWER(di.label) LIKE '%dialysis%'
-        """)
-        events = pd.concat([events, ie], ignore_index=True)
+    # (cvvhd/cvvhdf sind über 'cvvh' abgedeckt)
+    events = _rrt_events(
+        df,
+        pe_patterns=_RRT_PATTERNS,
+        ie_patterns=_RRT_IE_PATTERNS + ("dialysis",) if include_inputevents else (),
+    )
 
     events = events.dropna(subset=["icustay_id", "starttime"]).copy()
     events["endtime"] = events["endtime"].fillna(events["starttime"])
@@ -802,36 +839,10 @@ def add_rrt_persistence_near_discharge(
     # -----------------------------
     # Build sessions per icustay_id
     # -----------------------------
-    gap_tol = pd.to_timedelta(gap_tolerance_hours, unit="h")
-
-    ev = ev.sort_values(["icustay_id", "starttime", "endtime"]).copy()
-
-    sessions = []
-    for icu_id, g in ev.groupby("icustay_id", sort=False):
-        # iterate in time order
-        cur_start = None
-        cur_end = None
-        outt = g["outtime"].iloc[0]
-
-        for _, row in g.iterrows():
-            s = row["starttime"]
-            e = row["endtime"]
-
-            if cur_start is None:
-                cur_start, cur_end = s, e
-                continue
-
-            # merge if overlapping or close gap
-            if s <= (cur_end + gap_tol):
-                cur_end = max(cur_end, e)
-            else:
-                sessions.append((icu_id, cur_start, cur_end, outt))
-                cur_start, cur_end = s, e
-
-        if cur_start is not None:
-            sessions.append((icu_id, cur_start, cur_end, outt))
-
-    sess = pd.DataFrame(sessions, columns=["icustay_id", "sess_start", "sess_end", "outtime"])
+    sess = merge_intervals(ev, "icustay_id", "starttime", "endtime", gap_tolerance_hours)
+    sess = sess.rename(columns={"starttime": "sess_start", "endtime": "sess_end"})
+    outtimes = ev.drop_duplicates("icustay_id")[["icustay_id", "outtime"]]
+    sess = sess.merge(outtimes, on="icustay_id", how="left")
     if sess.empty:
         # no events found -> all zeros
         df[f"rrt_any_in_last{int(hours_before_discharge)}h"] = 0
@@ -932,6 +943,258 @@ FLUID_PATTERNS = [
 ]
 
 
+# inputevents_mv-Kategorien (einschließen, ausschließen): Wirkstoffe, Flüssigkeit, Diuretika, CRRT
+_INTERVENTION_CLASSES = {
+    **_VASO_CLASSES,
+    "fluid": (tuple(FLUID_PATTERNS), ()),
+    "diuretic": (tuple(DIURETIC_PATTERNS), ()),
+    **{f"rrt_{p}": ((f"%{p}%",), ()) for p in _RRT_PATTERNS},
+}
+
+
+def _intervention_item_table() -> pd.DataFrame:
+    """
+    itemid → category table (``itemid, category``, one row per pair; an
+    itemid may fall into several categories) for ``_INTERVENTION_CLASSES``,
+    resolved via ``src.itemids.resolve_itemids``.
+    """
+    rows = [
+        (iid, name)
+        for name, (include, exclude) in _INTERVENTION_CLASSES.items()
+        for iid in resolve_itemids(include, exclude)
+    ]
+    return pd.DataFrame(rows, columns=["itemid", "category"])
+
+
+def _intervention_store(
+    df: pd.DataFrame,
+    categories: tuple[str, ...] | None = None,
+    extra_itemids=(),
+) -> pd.DataFrame:
+    """
+    ``inputevents_mv`` rows of the cohort in the ``_INTERVENTION_CLASSES``
+    ``categories`` (plus ``extra_itemids``) in one query.
+
+    Columns ``icustay_id, itemid, starttime, endtime, rate, rateuom, amount,
+    amountuom, patientweight`` and a boolean ``c_<category>`` per category,
+    classified through ``_intervention_item_table``. Inside ``session()`` the
+    store covers all categories, is built once and reused by the
+    intervention flags, the vasopressor window features and the RRT store;
+    outside a session only the requested categories are pulled.
+    """
+    ids = _id_list(df["icustay_id"])
+    table = _intervention_item_table()
+    cache = session_cache()
+    wanted = table if cache is not None or categories is None else table[table["category"].isin(categories)]
+    itemids = sorted(set(wanted["itemid"].astype(int)).union(extra_itemids))
+    if cache is not None and "intervention_events" in cache:
+        cached_ids, cached_items, store = cache["intervention_events"]
+        if cached_ids.issuperset(ids) and cached_items.issuperset(itemids):
+            return store[store["icustay_id"].isin(ids)]
+
+    pred, params = _cohort_filter(df, "icustay_id", "ie.icustay_id")
+    params["intervention_itemids"] = itemids
+    store = q(f"""
+        SELECT ie.icustay_id, ie.itemid, ie.starttime, ie.endtime,
+               ie.rate, ie.rateuom, ie.amount, ie.amountuom, ie.patientweight
+        FROM inputevents_mv ie
+        WHERE {pred}
+          AND ie.itemid = ANY(:intervention_itemids)
+    """, params)
+    for col in ("starttime", "endtime"):
+        store[col] = pd.to_datetime(store[col])
+
+    # Kategorie-Flags je Zeile über die itemid -> Kategorie-Tabelle
+    hits = pd.crosstab(table["itemid"], table["category"]).gt(0)
+    hits = hits.reindex(store["itemid"].to_numpy(), fill_value=False)
+    for name in _INTERVENTION_CLASSES:
+        store[f"c_{name}"] = hits[name].to_numpy() if name in hits.columns else False
+
+    if cache is not None:
+        cache["intervention_events"] = (frozenset(ids), frozenset(itemids), store)
+    return store
+
+
+def _intervention_events(
+    df: pd.DataFrame,
+    categories: tuple[str, ...] = (),
+    patterns: list[str] | None = None,
+    with_weight: bool = False,
+) -> pd.DataFrame:
+    """
+    Store rows in any of ``categories`` (names in ``_INTERVENTION_CLASSES``)
+    or, with ``patterns``, whose ``d_items`` label matches one of the
+    patterns; with ``intime`` of ``df`` and ``hours`` (starttime since ICU
+    intime). ``with_weight=True`` adds the stay's ``weight`` (see
+    ``_vaso_stay_weight``); the vasopressor rows it needs are pulled even if
+    not in ``categories``, so the weight does not depend on the session.
+    """
+    if patterns is not None:
+        itemids = resolve_itemids(patterns)
+        pulled = _VASO_DRUGS if with_weight else ()
+        store = _intervention_store(df, categories=pulled, extra_itemids=itemids)
+        ev = store[store["itemid"].isin(itemids)]
+    else:
+        pulled = tuple(dict.fromkeys([*categories, *(_VASO_DRUGS if with_weight else ())]))
+        store = _intervention_store(df, categories=pulled)
+        ev = store[store[[f"c_{c}" for c in categories]].any(axis=1)]
+
+    stays = df[["icustay_id", "intime"]].dropna(subset=["icustay_id"]).drop_duplicates(subset="icustay_id")
+    ev = ev.merge(stays, on="icustay_id", how="inner")
+    ev["hours"] = (ev["starttime"] - ev["intime"]).dt.total_seconds() / 3600
+    if with_weight:
+        ev["weight"] = ev["icustay_id"].map(_vaso_stay_weight(store)).astype(float)
+    return ev
+
+
+def _vaso_stay_weight(store: pd.DataFrame) -> pd.Series:
+    """
+    Weight per ``icustay_id``: median charted ``patientweight`` (> 0) over
+    the stay's vasopressor rows (``_VASO_DRUGS``) of an
+    ``_intervention_store``, as in ``_vaso_window_query``.
+    """
+    vaso = store[store[[f"c_{d}" for d in _VASO_DRUGS]].any(axis=1)]
+    kg = pd.to_numeric(vaso["patientweight"], errors="coerce")
+    return kg[kg > 0].groupby(vaso["icustay_id"]).median()
+
+
+def _first_intervention_hours(
+    df: pd.DataFrame,
+    categories: tuple[str, ...] = (),
+    patterns: list[str] | None = None,
+) -> pd.Series:
+    """Hours from ICU intime to the first start at/after intime, per ``icustay_id`` (stays with exposure only)."""
+    ev = _intervention_events(df, categories, patterns)
+    return ev.loc[ev["hours"] >= 0].groupby("icustay_id")["hours"].min()
+
+
+def first_intervention_timing(
+    df: pd.DataFrame,
+    category: str | list[str],
+    label: str,
+) -> pd.DataFrame:
+    """
+    Adds two columns:
+      - first_<label>_hours: hours from ICU intime to the first start
+      - first_<label>_timing in {0–12 h, 12–24 h, >24 h, No intervention}
+
+    ``category`` is a name in ``_INTERVENTION_CLASSES`` (e.g. ``"fluid"``)
+    or a list of ``d_items`` label patterns.
+    """
+    if isinstance(category, str):
+        first = _first_intervention_hours(df, categories=(category,))
+    else:
+        first = _first_intervention_hours(df, patterns=list(category))
+
+    out = df.copy()
+    hours_col = f"first_{label}_hours"
+    timing_col = f"first_{label}_timing"
+    out[hours_col] = out["icustay_id"].map(first)
+
+    out[timing_col] = np.select(
+        [
+            out[hours_col].between(0, 12, inclusive="left"),
+            out[hours_col].between(12, 24, inclusive="left"),
+            out[hours_col] > 24,
+            out[hours_col].isna(),
+        ],
+        [
+            "0–12 h",
+            "12–24 h",
+            ">24 h",
+            "No intervention",
+        ],
+        default="Other",
+    )
+    out[timing_col] = pd.Categorical(
+        out[timing_col],
+        categories=["0–12 h", "12–24 h", ">24 h", "No intervention"],
+        ordered=True
+    )
+    return out
+
+
+# Sammelkategorien des Window-Sweeps: Vasopressor wie any_vasopressor, Dialyse wie early/late_dialysis
+_SWEEP_GROUPS = {"vasopressor": ("norepinephrine", "epinephrine", "phenylephrine")}
+_SWEEP_DEFAULT = ("fluid", "diuretic", "dopamine", "norepinephrine", "epinephrine", "phenylephrine",
+                  "vasopressin", "vasopressor", "dialysis")
+
+
+def first_exposure_hours(
+    df_aki: pd.DataFrame,
+    categories: tuple[str, ...] = _SWEEP_DEFAULT,
+) -> pd.DataFrame:
+    """
+    Hours from ICU intime to the first start (>= 0 h) per stay and category.
+
+    ``categories`` are names in ``_INTERVENTION_CLASSES``, ``"vasopressor"``
+    (norepinephrine, epinephrine or phenylephrine, as ``any_vasopressor``)
+    and ``"dialysis"`` (timed RRT events as in
+    ``add_early_late_dialysis_flags``). Returns one row per ``icustay_id``
+    with a ``first_<category>_hours`` column per category (NaN = no
+    exposure). All inputevents categories come from one extraction; feed
+    the result to ``add_intervention_window_flags`` for any number of
+    window thresholds.
+    """
+    unknown = sorted(set(categories) - set(_INTERVENTION_CLASSES) - set(_SWEEP_GROUPS) - {"dialysis"})
+    if unknown:
+        raise ValueError(f"Unbekannte Kategorien: {unknown}")
+    stays = df_aki[["icustay_id", "intime"]].dropna(subset=["icustay_id"]).drop_duplicates(subset="icustay_id")
+    out = pd.DataFrame(index=pd.Index(stays["icustay_id"].astype(int).to_numpy(), name="icustay_id"))
+
+    members = {c: _SWEEP_GROUPS.get(c, (c,)) for c in categories if c != "dialysis"}
+    if members:
+        ev = _intervention_events(df_aki, categories=tuple(dict.fromkeys(m for ms in members.values() for m in ms)))
+        ev = ev[ev["hours"] >= 0]
+        for c, ms in members.items():
+            hit = ev[[f"c_{m}" for m in ms]].any(axis=1)
+            out[f"first_{c}_hours"] = ev.loc[hit].groupby("icustay_id")["hours"].min()
+
+    if "dialysis" in categories:
+        rrt = _rrt_events(df_aki, ie_patterns=_RRT_IE_PATTERNS + ("dialysis",))
+        rrt = rrt.merge(stays, on="icustay_id", how="inner")
+        hours = (rrt["starttime"] - rrt["intime"]).dt.total_seconds() / 3600
+        out["first_dialysis_hours"] = hours[hours >= 0].groupby(rrt["icustay_id"]).min()
+
+    return out[[f"first_{c}_hours" for c in categories]]
+
+
+def add_intervention_window_flags(
+    df_aki: pd.DataFrame,
+    window_hours=tuple(range(1, 73)),
+    categories: tuple[str, ...] = _SWEEP_DEFAULT,
+    first: pd.DataFrame | None = None,
+) -> pd.DataFrame:
+    """
+    Early-exposure flags for many window thresholds at once.
+
+    Adds ``early_<category>_<N>h`` (0/1: first start within ``[0, N]`` hours
+    after ICU intime, as ``add_early_fluid_flag`` & co. with
+    ``window_hours=N``) for every category and window; for ``"dialysis"``
+    also ``late_dialysis_<N>h`` (first timed RRT start after ``N`` hours).
+    ``first`` is a precomputed ``first_exposure_hours`` frame — otherwise it
+    is computed here (one extraction); the flags themselves are one
+    vectorized comparison of first-exposure hours against all thresholds.
+    """
+    windows = _window_list(window_hours)
+    if first is None:
+        first = first_exposure_hours(df_aki, categories)
+
+    # Zeilen x Kategorien x Schwellen in einem Vergleich
+    per_row = first.reindex(df_aki["icustay_id"].to_numpy())[[f"first_{c}_hours" for c in categories]]
+    h = per_row.to_numpy(dtype=float)[:, :, None]
+    w = np.asarray(windows, dtype=float)[None, None, :]
+    early = (h <= w).astype(int)
+
+    names = [f"early_{c}{_window_suffix(x)}" for c in categories for x in windows]
+    blocks = [pd.DataFrame(early.reshape(len(df_aki), -1), columns=names, index=df_aki.index)]
+    if "dialysis" in categories:
+        late = (h[:, [list(categories).index("dialysis")], :] > w).astype(int)
+        blocks.append(pd.DataFrame(late.reshape(len(df_aki), -1), index=df_aki.index,
+                                   columns=[f"late_dialysis{_window_suffix(x)}" for x in windows]))
+    return pd.concat([df_aki.drop(columns=[c for b in blocks for c in b.columns], errors="ignore")] + blocks, axis=1)
+
+
 def add_inputevents_flag(
     df_aki: pd.DataFrame,
     col_early: str,
@@ -940,44 +1203,13 @@ def add_inputevents_flag(
     col_any: str | None = None,
 ) -> pd.DataFrame:
     df = df_aki.copy()
-
-    where = " OR ".join([f"LOWER(di.label) LIKE '{p}'" for p in patterns])
-
-    ev = q(f"""
-        SELECT ie.icustay_id, ie.starttime
-        FROM inputevents_mv ie
-        JOIN d_items di ON ie.itemid = di.itemid
-        WHERE {where}
-    """)
-
-    if len(ev) == 0:
-        df[col_early] = 0
-        if col_any:
-            df[col_any] = 0
-        return df
+    ev = _intervention_events(df, patterns=patterns)
 
     if col_any:
-        any_ids = ev["icustay_id"].dropna().unique()
-        df[col_any] = df["icustay_id"].isin(any_ids).astype(int)
-
-    ev = ev.merge(
-        df[["icustay_id", "intime"]],
-        on="icustay_id",
-        how="inner"
-    ).dropna(subset=["intime", "starttime"])
-
-    ev["hours_since_icu"] = (
-        ev["starttime"] - ev["intime"]
-    ).dt.total_seconds() / 3600
-
-    ev = ev[(ev["hours_since_icu"] >= 0) & (ev["hours_since_icu"] <= window_hours)]
-
-    early_ids = ev["icustay_id"].unique()
-    df[col_early] = df["icustay_id"].isin(early_ids).astype(int)
-
-    if col_any and col_any not in df.columns:
-        df[col_any] = 0
+        df[col_any] = df["icustay_id"].isin(ev["icustay_id"].unique()).astype(int)
 
+    ev = ev[(ev["hours"] >= 0) & (ev["hours"] <= window_hours)]
+    df[col_early] = df["icustay_id"].isin(ev["icustay_id"].unique()).astype(int)
     return df
 
 
@@ -1039,308 +1271,806 @@ _VITAL_ITEMS = {
     "fio2_chart":  (223835, 3420),
 }
 
+# "worst" = Maximum für diese Analyte, sonst Minimum
+_LAB_WORST_MAX = {"creatinine", "bilirubin", "bun", "lactate", "wbc", "potassium"}
+_VITAL_WORST_MAX = set(_VITAL_ITEMS) - {"sbp", "dbp", "mbp", "gcs_total", "spo2"}
 
-def get_labs_for_window(
-    df_cohort: pd.DataFrame,
-    window_hours: float = 24.0,
-    agg: str = "worst",
-    end_hours_col: str | None = None,
-) -> pd.DataFrame:
-    """
-    Retrieve lab values from ``labevents`` within ``[intime, intime + window_hours]``.
-
-    Parameters
-    ----------
-    df_cohort : DataFrame
-        Must contain ``subject_id``, ``hadm_id``, ``icustay_id``, ``intime``.
-    window_hours : float
-        Length of observation window after ICU intime (default 24).
-    agg : str
-        Aggregation strategy per lab per ICU stay.
-        ``"worst"`` picks the clinically worst value (max for creatinine /
-        bilirubin / BUN / lactate / WBC / potassium; min for platelets /
-        bicarbonate / sodium).
-        ``"first"`` picks the earliest measurement.
-        ``"mean"`` averages.
+# -- Urin-ItemIDs (outputevents) ------------------------------
+_UO_ITEMS = [40055, 43175, 40069, 40094, 40715, 40473, 40085, 40057, 40056,
+             227488, 226559, 226560, 226561, 226563, 226564, 226565,
+             226567, 226557]
 
-    Returns
-    -------
-    DataFrame with one row per ``icustay_id`` and one column per lab analyte,
-    suffixed with ``_<window_hours>h`` (e.g. ``creatinine_6h``).
-    """
-    ids = tuple(df_cohort["hadm_id"].dropna().astype(int).unique().tolist())
-    if not ids:
-        return df_cohort.copy()
+# Zeilen pro dekodiertem COPY-Chunk in den Fenster-Pulls (_window_events)
+_EVENT_CHUNKSIZE = 200_000
 
-    in_clause = f"({ids[0]})" if len(ids) == 1 else str(ids)
-
-    all_itemids = []
-    item_to_lab: dict[int, str] = {}
-    for lab_name, itemids in _LAB_ITEMS.items():
-        for iid in itemids:
-            all_itemids.append(iid)
-            item_to_lab[iid] = lab_name
-    itemid_str = ",".join(str(i) for i in all_itemids)
-
-    raw = q(f"""
-        SELECT le.hadm_id, le.itemid, le.charttime, le.valuenum
-        FROM labevents le
-        WHERE le.hadm_id IN {in_clause}
-          AND le.itemid IN ({itemid_str})
-          AND le.valuenum IS NOT NULL
-    """)
+# Lab-/Vital-Events als Arrow-Spalten dekodieren, falls pyarrow vorhanden ist
+_EVENT_DTYPE_BACKEND = "pyarrow" if importlib.util.find_spec("pyarrow") else None
 
-    if raw.empty:
-        return df_cohort.copy()
 
-    raw["lab"] = raw["itemid"].map(item_to_lab)
+def _check_end_hours_col(df_cohort: pd.DataFrame, end_hours_col: str | None) -> None:
+    if end_hours_col is not None and end_hours_col not in df_cohort.columns:
+        raise ValueError(
+            f"Spalte '{end_hours_col}' fehlt in df_cohort. "
+            f"Sie sollte den patientenspezifischen Fensterende in Stunden enthalten "
+            f"(z.B. 'first_vaso_hours' aus der Vasopressor-Timing-Berechnung)."
+        )
 
-    # Merge-Spalten: bei end_hours_col patientenspezifisches Fensterende einbeziehen
-    _merge_cols = ["hadm_id", "icustay_id", "intime"]
-    if end_hours_col is not None:
-        if end_hours_col not in df_cohort.columns:
-            raise ValueError(
-                f"Spalte '{end_hours_col}' fehlt in df_cohort. "
-                f"Sie sollte den patientenspezifischen Fensterende in Stunden enthalten "
-                f"(z.B. 'first_vaso_hours' aus der Vasopressor-Timing-Berechnung)."
-            )
-        _merge_cols.append(end_hours_col)
 
-    merged = raw.merge(
-        df_cohort[_merge_cols].drop_duplicates(),
-        on="hadm_id",
-        how="inner",
-    )
-    merged["charttime"] = pd.to_datetime(merged["charttime"])
-    merged["intime"] = pd.to_datetime(merged["intime"])
-    merged["hours"] = (merged["charttime"] - merged["intime"]).dt.total_seconds() / 3600
+def _window_list(window_hours, end_hours_col: str | None = None) -> list[float]:
+    """
+    ``window_hours`` as a list of distinct windows (one entry for a scalar).
+    Several windows are only meaningful for fixed windows, not together
+    with a patient-specific ``end_hours_col``.
+    """
+    if np.ndim(window_hours) == 0:
+        return [float(window_hours)]
+    windows = list(dict.fromkeys(float(w) for w in window_hours))
+    if not windows:
+        raise ValueError("window_hours ist leer.")
+    if end_hours_col is not None and len(windows) > 1:
+        raise ValueError("Mehrere window_hours sind nur ohne end_hours_col möglich.")
+    return windows
 
-    # Zeitfilterung: fixes oder patientenspezifisches Fenster
-    if end_hours_col is not None:
-        merged = merged[(merged["hours"] >= 0) & (merged["hours"] <= merged[end_hours_col])]
-    else:
-        merged = merged[(merged["hours"] >= 0) & (merged["hours"] <= window_hours)]
-
-    _WORST_MAX = {"creatinine", "bilirubin", "bun", "lactate", "wbc", "potassium"}
-
-    def _agg_fn(group: pd.DataFrame) -> float:
-        lab_name = group["lab"].iloc[0]
-        if agg == "first":
-            return group.sort_values("charttime").iloc[0]["valuenum"]
-        if agg == "mean":
-            return group["valuenum"].mean()
-        if lab_name in _WORST_MAX:
-            return group["valuenum"].max()
-        return group["valuenum"].min()
-
-    result = (
-        merged.groupby(["icustay_id", "lab"])
-        .apply(_agg_fn)
-        .unstack("lab")
-    )
 
+def _window_suffix(window_hours: float, end_hours_col: str | None = None) -> str:
     # Suffix: patientenspezifisches Fenster → '_t_star', fixes Fenster → '_{N}h'
-    sfx = "_t_star" if end_hours_col is not None else f"_{int(window_hours)}h"
-    result.columns = [c + sfx for c in result.columns]
-    result = result.reset_index()
+    return "_t_star" if end_hours_col is not None else f"_{int(window_hours)}h"
 
-    return df_cohort.merge(result, on="icustay_id", how="left")
 
-
-def get_vitals_for_window(
+def _merge_window_results(
     df_cohort: pd.DataFrame,
-    window_hours: float = 24.0,
-    agg: str = "worst",
+    per_window: dict[float, pd.DataFrame],
     end_hours_col: str | None = None,
 ) -> pd.DataFrame:
     """
-    Retrieve vital signs from ``chartevents`` within ``[intime, intime + window_hours]``.
+    Suffix each wide per-window result (index ``icustay_id``) with its
+    ``_<N>h``/``_t_star`` suffix and merge all of them onto ``df_cohort``.
+    """
+    parts = []
+    for w, result in per_window.items():
+        if not result.empty:
+            parts.append(result.add_suffix(_window_suffix(w, end_hours_col)))
+    if not parts:
+        return df_cohort.copy()
+    result = pd.concat(parts, axis=1)
+    result.index.name = "icustay_id"
+    return df_cohort.merge(result.reset_index(), on="icustay_id", how="left")
 
-    Parameters
-    ----------
-    df_cohort : DataFrame
-        Must contain ``icustay_id``, ``intime``.
-    window_hours : float
-        Length of observation window after ICU intime (default 24).
-    agg : str
-        ``"worst"`` picks clinically worst (min for BP/GCS/SpO2, max for HR/temp/RR).
-        ``"first"`` picks earliest.  ``"mean"`` averages.
 
-    Returns
-    -------
-    DataFrame with one column per vital, suffixed ``_<window_hours>h``.
+def _window_relation(
+    df_cohort: pd.DataFrame,
+    window_hours: float,
+    end_hours_col: str | None = None,
+    with_hadm: bool = False,
+) -> tuple[str, dict]:
     """
-    icu_ids = tuple(df_cohort["icustay_id"].dropna().astype(int).unique().tolist())
-    if not icu_ids:
-        return df_cohort.copy()
+    SQL relation ``w(icustay_id[, hadm_id], t0, t1)`` with each stay's window
+    ``[intime, intime + window_hours]`` (or up to ``end_hours_col``).
+
+    Event queries join it so the window predicate is evaluated in the
+    database and only in-window rows are transferred. Uses a registered
+    cohort temp table with ``intime`` (see ``src.db.register_cohort``) for
+    fixed windows; otherwise the windows are bound as array parameters and
+    expanded with ``unnest``. Stays without end (NaN in ``end_hours_col``)
+    get an empty window.
+    """
+    cols = ["icustay_id"] + (["hadm_id"] if with_hadm else [])
+    win = df_cohort.dropna(subset=cols).drop_duplicates(subset="icustay_id")
+    ids = _id_list(win["icustay_id"])
+
+    table = cohort_table("icustay_id", ids, columns=("intime", *cols)) if end_hours_col is None else None
+    if table is not None:
+        return (
+            f"(SELECT {', '.join(cols)}, intime AS t0, "
+            f"intime + CAST(:window_hours AS float8) * INTERVAL '1 hour' AS t1 FROM {table}) AS w",
+            {"window_hours": float(window_hours)},
+        )
 
-    in_clause = f"({icu_ids[0]})" if len(icu_ids) == 1 else str(icu_ids)
-
-    all_itemids = []
-    item_to_vital: dict[int, str] = {}
-    for vital_name, itemids in _VITAL_ITEMS.items():
-        for iid in itemids:
-            all_itemids.append(iid)
-            item_to_vital[iid] = vital_name
-    itemid_str = ",".join(str(i) for i in all_itemids)
-
-    raw = q(f"""
-        SELECT ce.icustay_id, ce.itemid, ce.charttime, ce.valuenum
-        FROM chartevents ce
-        WHERE ce.icustay_id IN {in_clause}
-          AND ce.itemid IN ({itemid_str})
-          AND ce.valuenum IS NOT NULL
-    """)
+    t0 = pd.to_datetime(win["intime"])
+    upper = win[end_hours_col] if end_hours_col is not None else window_hours
+    t1 = t0 + pd.to_timedelta(upper, unit="h")
 
-    if raw.empty:
-        return df_cohort.copy()
+    def _ts(s: pd.Series) -> list:
+        return [None if pd.isna(t) else t.to_pydatetime() for t in s]
 
-    raw["vital"] = raw["itemid"].map(item_to_vital)
+    params = {f"w_{c}": win[c].astype(int).tolist() for c in cols}
+    params.update({"w_t0": _ts(t0), "w_t1": _ts(t1)})
+    arrays = [f"CAST(:w_{c} AS integer[])" for c in cols]
+    arrays += ["CAST(:w_t0 AS timestamp[])", "CAST(:w_t1 AS timestamp[])"]
+    return f"unnest({', '.join(arrays)}) AS w({', '.join(cols)}, t0, t1)", params
 
-    # Merge-Spalten: bei end_hours_col patientenspezifisches Fensterende einbeziehen
-    _merge_cols_v = ["icustay_id", "intime"]
-    if end_hours_col is not None:
-        if end_hours_col not in df_cohort.columns:
-            raise ValueError(
-                f"Spalte '{end_hours_col}' fehlt in df_cohort. "
-                f"Sie sollte den patientenspezifischen Fensterende in Stunden enthalten "
-                f"(z.B. 'first_vaso_hours' aus der Vasopressor-Timing-Berechnung)."
-            )
-        _merge_cols_v.append(end_hours_col)
 
-    merged = raw.merge(
-        df_cohort[_merge_cols_v].drop_duplicates(),
-        on="icustay_id",
-        how="inner",
+def _window_events(
+    sql: str,
+    params: dict,
+    dtype_backend: str | None = None,
+    chunksize: int = _EVENT_CHUNKSIZE,
+) -> pd.DataFrame:
+    """
+    Pull the in-window events of ``sql`` (which joins ``_window_relation``)
+    with ``COPY ... TO STDOUT`` (``q_copy``), decoded in typed chunks of
+    ``chunksize`` rows, so peak memory is bounded by one chunk plus the
+    in-window rows rather than by decoding the whole pull at once.
+    ``dtype_backend="pyarrow"`` keeps the event columns Arrow-backed.
+    """
+    parts = list(q_copy(sql, params, chunksize=chunksize, dtype_backend=dtype_backend))
+    if not parts:
+        return pd.DataFrame()
+    if len(parts) == 1:
+        return parts[0]
+    return pd.concat(parts, ignore_index=True)
+
+
+def _item_map_relation(items: dict[str, tuple[int, ...]]) -> tuple[str, dict]:
+    """SQL relation ``m(itemid, name)`` mapping each itemid to its analyte name."""
+    pairs = [(iid, name) for name, itemids in items.items() for iid in itemids]
+    return (
+        "unnest(CAST(:m_itemid AS integer[]), CAST(:m_name AS text[])) AS m(itemid, name)",
+        {"m_itemid": [iid for iid, _ in pairs], "m_name": [name for _, name in pairs]},
     )
-    merged["charttime"] = pd.to_datetime(merged["charttime"])
-    merged["intime"] = pd.to_datetime(merged["intime"])
-    merged["hours"] = (merged["charttime"] - merged["intime"]).dt.total_seconds() / 3600
 
-    # Zeitfilterung: fixes oder patientenspezifisches Fenster
-    if end_hours_col is not None:
-        merged = merged[(merged["hours"] >= 0) & (merged["hours"] <= merged[end_hours_col])]
+
+def _server_window_agg(
+    events_sql: str,
+    params: dict,
+    agg: str,
+    worst_max: set[str],
+    windows: list[float],
+) -> dict[float, pd.DataFrame]:
+    """
+    Aggregate ``events_sql`` (columns ``icustay_id, name, charttime,
+    valuenum, hours``) per stay and analyte in the database and return one
+    wide result per window (index ``icustay_id``, one column per analyte).
+
+    ``"first"`` uses ``DISTINCT ON`` ordered by ``charttime``, ``"mean"``
+    ``AVG``, ``"worst"`` ``MAX`` for analytes in ``worst_max`` and ``MIN``
+    otherwise. With several ``windows`` the events (pulled up to the
+    largest window) are expanded per window with ``hours <= window_hours``
+    and grouped by window as well.
+    """
+    if len(windows) > 1:
+        source = f"""(
+            SELECT ev.*, h.window_hours
+            FROM ({events_sql}) ev
+            JOIN unnest(CAST(:windows AS float8[])) AS h(window_hours) ON ev.hours <= h.window_hours
+        ) ev"""
+        params = {**params, "windows": windows}
+        keys = "icustay_id, window_hours, name"
     else:
-        merged = merged[(merged["hours"] >= 0) & (merged["hours"] <= window_hours)]
-
-    _WORST_MIN = {"sbp", "dbp", "mbp", "gcs_total", "spo2"}
-
-    def _agg_fn(group: pd.DataFrame) -> float:
-        vital_name = group["vital"].iloc[0]
-        if agg == "first":
-            return group.sort_values("charttime").iloc[0]["valuenum"]
-        if agg == "mean":
-            return group["valuenum"].mean()
-        if vital_name in _WORST_MIN:
-            return group["valuenum"].min()
-        return group["valuenum"].max()
-
-    result = (
-        merged.groupby(["icustay_id", "vital"])
-        .apply(_agg_fn)
-        .unstack("vital")
-    )
+        source = f"({events_sql}) ev"
+        keys = "icustay_id, name"
+
+    if agg == "first":
+        sql = f"""
+            SELECT DISTINCT ON ({keys}) {keys}, valuenum AS value
+            FROM {source}
+            ORDER BY {keys}, charttime
+        """
+    elif agg == "mean":
+        sql = f"""
+            SELECT {keys}, AVG(valuenum) AS value
+            FROM {source}
+            GROUP BY {keys}
+        """
+    else:
+        sql = f"""
+            SELECT {keys},
+                   CASE WHEN name = ANY(:worst_max) THEN MAX(valuenum) ELSE MIN(valuenum) END AS value
+            FROM {source}
+            GROUP BY {keys}
+        """
+        params = {**params, "worst_max": sorted(worst_max)}
+
+    res = q_copy(sql, params)
+    if len(windows) == 1:
+        res = res.assign(window_hours=windows[0])
+    per_window = {}
+    for w in windows:
+        sub = res[res["window_hours"] == w]
+        if sub.empty:
+            per_window[w] = pd.DataFrame()
+            continue
+        wide = sub.pivot(index="icustay_id", columns="name", values="value").astype("float64")
+        wide.columns.name = None
+        per_window[w] = wide
+    return per_window
 
-    # Suffix: patientenspezifisches Fenster → '_t_star', fixes Fenster → '_{N}h'
-    sfx = "_t_star" if end_hours_col is not None else f"_{int(window_hours)}h"
-    result.columns = [c + sfx for c in result.columns]
-    result = result.reset_index()
 
-    return df_cohort.merge(result, on="icustay_id", how="left")
+def _window_subsets(events: pd.DataFrame, windows: list[float]):
+    """``(window, events with hours <= window)`` per window; all events for a single window."""
+    if len(windows) == 1:
+        yield windows[0], events
+        return
+    for w in windows:
+        yield w, events[events["hours"] <= w]
 
 
-def get_urine_output_for_window(
-    df_cohort: pd.DataFrame,
-    window_hours: float = 24.0,
-    end_hours_col: str | None = None,
-) -> pd.DataFrame:
+def _aggregate_window(events: pd.DataFrame, name_col: str, agg: str, worst_max: set[str]) -> pd.DataFrame:
     """
-    Total urine output (mL) from ``outputevents`` within
-    ``[intime, intime + window_hours]`` (oder patientenspezifisch bis ``end_hours_col``).
+    Reduce in-window events to one value per stay and analyte (wide result,
+    index ``icustay_id``, one column per analyte) with whole-frame grouped
+    operations.
 
-    Returns df with new column ``uo_ml_<window_hours>h`` (bzw. ``uo_ml_t_star``).
+    ``"first"`` takes the value at the earliest offset ``hours``, ``"mean"``
+    the mean, ``"worst"`` the maximum for analytes in ``worst_max`` and the
+    minimum otherwise.
     """
-    icu_ids = tuple(df_cohort["icustay_id"].dropna().astype(int).unique().tolist())
-    if not icu_ids:
-        return df_cohort.copy()
-
-    in_clause = f"({icu_ids[0]})" if len(icu_ids) == 1 else str(icu_ids)
-
-    uo_items = (40055, 43175, 40069, 40094, 40715, 40473, 40085, 40057, 40056,
-                227488, 226559, 226560, 226561, 226563, 226564, 226565,
-                226567, 226557)
-    uo_str = ",".join(str(i) for i in uo_items)
+    if events.empty:
+        return pd.DataFrame()
+    keys = ["icustay_id", name_col]
+    if agg == "first":
+        # erste Zeile pro Gruppe, auch wenn deren Wert NaN ist (wie iloc[0])
+        ordered = events.dropna(subset=keys).sort_values("hours", kind="stable").drop_duplicates(keys)
+        values = ordered.set_index(keys)["valuenum"].sort_index()
+    elif agg == "mean":
+        values = events.groupby(keys, sort=True)["valuenum"].mean()
+    else:
+        stats = events.groupby(keys, sort=True)["valuenum"].agg(["min", "max"])
+        # Richtung pro Analyt: max ist "worst" für worst_max, sonst min
+        use_max = stats.index.get_level_values(name_col).isin(list(worst_max))
+        values = stats["max"].where(use_max, stats["min"])
+    return values.unstack(name_col).astype("float64")
 
-    raw = q(f"""
-        SELECT oe.icustay_id, oe.charttime, oe.value
-        FROM outputevents oe
-        WHERE oe.icustay_id IN {in_clause}
-          AND oe.itemid IN ({uo_str})
-          AND oe.value IS NOT NULL
-          AND oe.value > 0
-    """)
 
-    # Spaltenname für UO-Ergebnis
-    _uo_col = "uo_ml_t_star" if end_hours_col is not None else f"uo_ml_{int(window_hours)}h"
+def _lab_events(win: str, params: dict, items: dict[str, tuple[int, ...]] = _LAB_ITEMS) -> pd.DataFrame:
+    """
+    ``labevents`` of ``items`` (default ``_LAB_ITEMS``) inside the windows of
+    ``win`` (see ``_window_relation(..., with_hadm=True)``): ``icustay_id,
+    itemid, charttime, valuenum, hours`` (since window start) and the
+    analyte ``lab``.
+    """
+    # Zeitfenster wird in der DB ausgewertet: nur Labs im Fenster des jeweiligen Aufenthalts
+    merged = _window_events(
+        f"""
+        SELECT w.icustay_id, le.itemid, le.charttime, le.valuenum,
+               EXTRACT(EPOCH FROM le.charttime - w.t0) / 3600 AS hours
+        FROM {win}
+        JOIN labevents le
+          ON le.hadm_id = w.hadm_id
+         AND le.charttime BETWEEN w.t0 AND w.t1
+        WHERE le.itemid = ANY(:itemids)
+          AND le.valuenum IS NOT NULL
+        """,
+        {**params, "itemids": [iid for itemids in items.values() for iid in itemids]},
+        dtype_backend=_EVENT_DTYPE_BACKEND,
+    )
+    merged["lab"] = merged["itemid"].map({iid: name for name, itemids in items.items() for iid in itemids})
+    return merged
 
-    if raw.empty:
-        df_out = df_cohort.copy()
-        df_out[_uo_col] = np.nan
-        return df_out
 
-    # Merge-Spalten: bei end_hours_col patientenspezifisches Fensterende einbeziehen
-    _merge_cols_uo = ["icustay_id", "intime"]
-    if end_hours_col is not None:
-        if end_hours_col not in df_cohort.columns:
-            raise ValueError(
-                f"Spalte '{end_hours_col}' fehlt in df_cohort. "
-                f"Sie sollte den patientenspezifischen Fensterende in Stunden enthalten "
-                f"(z.B. 'first_vaso_hours' aus der Vasopressor-Timing-Berechnung)."
-            )
-        _merge_cols_uo.append(end_hours_col)
+def _vital_events(win: str, params: dict, items: dict[str, tuple[int, ...]] = _VITAL_ITEMS) -> pd.DataFrame:
+    """
+    ``chartevents`` of ``items`` (default ``_VITAL_ITEMS``) inside the
+    windows of ``win``: ``icustay_id, itemid, charttime, valuenum, hours``
+    and the name ``vital``.
+    """
+    # Zeitfenster wird in der DB ausgewertet
+    merged = _window_events(
+        f"""
+        SELECT ce.icustay_id, ce.itemid, ce.charttime, ce.valuenum,
+               EXTRACT(EPOCH FROM ce.charttime - w.t0) / 3600 AS hours
+        FROM {win}
+        JOIN chartevents ce
+          ON ce.icustay_id = w.icustay_id
+         AND ce.charttime BETWEEN w.t0 AND w.t1
+        WHERE ce.itemid = ANY(:itemids)
+          AND ce.valuenum IS NOT NULL
+        """,
+        {**params, "itemids": [iid for itemids in items.values() for iid in itemids]},
+        dtype_backend=_EVENT_DTYPE_BACKEND,
+    )
+    merged["vital"] = merged["itemid"].map({iid: name for name, itemids in items.items() for iid in itemids})
+    return merged
+
+
+def _urine_events(win: str, params: dict) -> pd.DataFrame:
+    """Positive urine outputs inside the windows of ``win``: ``icustay_id, itemid, charttime, value, hours``."""
+    # Zeitfenster wird in der DB ausgewertet
+    return _window_events(
+        f"""
+        SELECT oe.icustay_id, oe.itemid, oe.charttime, oe.value,
+               EXTRACT(EPOCH FROM oe.charttime - w.t0) / 3600 AS hours
+        FROM {win}
+        JOIN outputevents oe
+          ON oe.icustay_id = w.icustay_id
+         AND oe.charttime BETWEEN w.t0 AND w.t1
+        WHERE oe.itemid = ANY(:itemids)
+          AND oe.value IS NOT NULL
+          AND oe.value > 0
+        """,
+        {**params, "itemids": _UO_ITEMS},
+    )
 
-    merged = raw.merge(
-        df_cohort[_merge_cols_uo].drop_duplicates(),
-        on="icustay_id",
-        how="inner",
+
+# Reihenfolge = Vorrang bei der Zuordnung eines Items zu einem Wirkstoff
+_VASO_DRUGS = ("norepinephrine", "epinephrine", "dobutamine", "dopamine", "phenylephrine", "vasopressin")
+
+
+# rateuom (klein, ohne Leerzeichen) -> (Faktor nach mcg/kg/min, durch Körpergewicht teilen)
+_RATE_TO_MCGKGMIN = {
+    "mcg/kg/min": (1.0, False),
+    "mcg/kg/minute": (1.0, False),
+    "mcg/kg/hour": (1 / 60, False),
+    "mg/kg/min": (1000.0, False),
+    "mg/kg/hour": (1000 / 60, False),
+    "mcg/min": (1.0, True),
+    "mcg/hour": (1 / 60, True),
+    "mg/min": (1000.0, True),
+    "mg/hour": (1000 / 60, True),
+}
+# Vasopressin: rateuom -> Faktor nach units/min
+_RATE_TO_UNITSMIN = {"units/min": 1.0, "units/hour": 1 / 60, "u/min": 1.0, "u/hour": 1 / 60}
+# Norepinephrin-Äquivalent je mcg/kg/min (Vasopressin: je units/min); Dobutamin ohne Vasopressorwirkung
+_NE_EQUIVALENT = {"norepinephrine": 1.0, "epinephrine": 1.0, "phenylephrine": 0.1, "dopamine": 0.01, "vasopressin": 2.5}
+# In den SOFA-Norepinephrin-Äquivalenten: Dopamin hat im SOFA eigene Schwellen
+_NE_SOFA_DRUGS = ("norepinephrine", "epinephrine", "phenylephrine", "vasopressin")
+
+
+def _vaso_dose(ev: pd.DataFrame) -> np.ndarray:
+    """
+    Dose per infusion row in the drug's reference unit — mcg/kg/min, units/min
+    for vasopressin — converted in bulk from ``rate``/``rateuom`` (see
+    ``_RATE_TO_MCGKGMIN``) with the per-stay ``weight`` in kg. NaN for
+    unknown units, or for per-minute/-hour units without weight.
+    """
+    uom = (
+        ev["rateuom"].astype(object).str.lower()
+        .str.replace(" ", "", regex=False)
+        .str.replace(r"/(hr|h)$", "/hour", regex=True)
+    )
+    rate = pd.to_numeric(ev["rate"], errors="coerce").to_numpy(dtype=float)
+    factor = uom.map({u: f for u, (f, _) in _RATE_TO_MCGKGMIN.items()}).to_numpy(dtype=float)
+    per_weight = uom.map({u: w for u, (_, w) in _RATE_TO_MCGKGMIN.items()}).eq(True).to_numpy()
+    weight = ev["weight"].to_numpy(dtype=float)
+    weight = np.where(weight > 0, weight, np.nan)
+
+    dose = rate * factor / np.where(per_weight, weight, 1.0)
+    vasopressin = (ev["drug"] == "vasopressin").to_numpy()
+    dose[vasopressin] = rate[vasopressin] * uom[vasopressin].map(_RATE_TO_UNITSMIN).to_numpy(dtype=float)
+    return dose
+
+
+def _vaso_dose_columns(drug: pd.Series, dose) -> dict[str, np.ndarray]:
+    """
+    ``rate_mcgkgmin`` (catecholamines; NaN for vasopressin) and
+    ``ne_equiv_mcgkgmin`` (norepinephrine equivalent, ``_NE_EQUIVALENT``)
+    from the reference-unit ``dose`` of each row.
+    """
+    dose = np.asarray(dose, dtype=float)
+    factor = drug.map(_NE_EQUIVALENT).to_numpy(dtype=float)
+    return {
+        "rate_mcgkgmin": np.where((drug == "vasopressin").to_numpy(), np.nan, dose),
+        "ne_equiv_mcgkgmin": dose * factor,
+    }
+
+
+def _vaso_events(df: pd.DataFrame, limit: float | str) -> pd.DataFrame:
+    """
+    Vasopressor/inotrope infusions of the stays of ``df`` starting within
+    ``[intime, intime + limit]`` (``limit``: hours or a column with per-stay
+    hours): ``icustay_id, starttime, rate, rateuom, drug`` (see
+    ``_VASO_CLASSES``), ``hours`` since intime, the stay's ``weight``
+    (median charted ``patientweight`` over all its vasopressor rows, also
+    outside the window) and the normalized
+    ``dose``, ``rate_mcgkgmin`` and ``ne_equiv_mcgkgmin`` (see ``_vaso_dose``).
+
+    Taken from the shared ``_intervention_store`` when the session already
+    holds one; otherwise only the in-window vasopressor rows are queried.
+    """
+    cache = session_cache()
+    if cache is not None and "intervention_events" in cache:
+        # Gewicht einmal je Aufenthalt, unabhängig vom Fenster
+        ev = _intervention_events(df, categories=_VASO_DRUGS, with_weight=True)
+        ev = _events_within(ev[ev["hours"] >= 0], df, limit)
+        drug = np.select([ev[f"c_{d}"].to_numpy(dtype=bool) for d in _VASO_DRUGS], _VASO_DRUGS, "other")
+        ev = ev.assign(drug=drug)
+    else:
+        ev = _vaso_window_query(df, limit)
+
+    ev["dose"] = _vaso_dose(ev)
+    ev = ev.assign(**_vaso_dose_columns(ev["drug"], ev["dose"]))
+    cols = ["icustay_id", "starttime", "rate", "rateuom", "drug", "hours",
+            "weight", "dose", "rate_mcgkgmin", "ne_equiv_mcgkgmin"]
+    return ev[cols].reset_index(drop=True)
+
+
+def _vaso_window_query(df: pd.DataFrame, limit: float | str) -> pd.DataFrame:
+    """In-window vasopressor rows of ``_vaso_events`` straight from ``inputevents_mv``."""
+    if isinstance(limit, str):
+        win, params = _window_relation(df, 0.0, limit)
+    else:
+        win, params = _window_relation(df, limit)
+    params = dict(params)
+    drug_ids = {d: resolve_itemids(*_VASO_CLASSES[d]) for d in _VASO_DRUGS}
+    params.update({f"{d}_itemids": ids for d, ids in drug_ids.items()})
+    params["vaso_itemids"] = sorted(set().union(*drug_ids.values()))
+    drug_case = "\n".join(f"WHEN ie.itemid = ANY(:{d}_itemids) THEN '{d}'" for d in _VASO_DRUGS)
+
+    # Zeitfenster (starttime) wird in der DB ausgewertet
+    return _window_events(
+        f"""
+        SELECT
+            ie.icustay_id,
+            ie.starttime,
+            ie.rate,
+            ie.rateuom,
+            CASE {drug_case} ELSE 'other' END AS drug,
+            EXTRACT(EPOCH FROM ie.starttime - w.t0) / 3600 AS hours,
+            wt.weight
+        FROM {win}
+        JOIN inputevents_mv ie
+          ON ie.icustay_id = w.icustay_id
+         AND ie.starttime BETWEEN w.t0 AND w.t1
+        LEFT JOIN LATERAL (
+            -- Gewicht je Aufenthalt: Median über alle Vasopressor-Zeilen, auch außerhalb des Fensters
+            SELECT percentile_cont(0.5) WITHIN GROUP (ORDER BY pw.patientweight) AS weight
+            FROM inputevents_mv pw
+            WHERE pw.icustay_id = w.icustay_id
+              AND pw.itemid = ANY(:vaso_itemids)
+              AND pw.patientweight > 0
+        ) wt ON TRUE
+        WHERE ie.itemid = ANY(:vaso_itemids)
+        """,
+        params,
     )
-    merged["charttime"] = pd.to_datetime(merged["charttime"])
-    merged["intime"] = pd.to_datetime(merged["intime"])
-    merged["hours"] = (merged["charttime"] - merged["intime"]).dt.total_seconds() / 3600
 
-    # Zeitfilterung: fixes oder patientenspezifisches Fenster
+
+def build_hourly_cube(df_cohort: pd.DataFrame, max_hours: float = 72.0) -> HourlyCube:
+    """
+    Pull ``labevents`` (``_LAB_ITEMS``), ``chartevents`` (``_VITAL_ITEMS``)
+    and ``outputevents`` (urine items) of the first ``max_hours`` hours of
+    each stay once and reduce them to an ``src.cube.HourlyCube``. Pass it as
+    ``cube=`` to ``get_labs_for_window``, ``get_vitals_for_window`` or
+    ``get_urine_output_for_window`` to answer any window up to
+    ``max_hours`` without querying the database again.
+    """
+    cols = ["icustay_id", "itemid", "hours", "value"]
+    frames = []
+    with session():
+        if _id_list(df_cohort["hadm_id"]):
+            labs = _lab_events(*_window_relation(df_cohort, max_hours, with_hadm=True))
+            frames.append(labs.rename(columns={"valuenum": "value"})[cols])
+        win, params = _window_relation(df_cohort, max_hours)
+        frames.append(_vital_events(win, params).rename(columns={"valuenum": "value"})[cols])
+        frames.append(_urine_events(win, params)[cols])
+    frames = [f.astype({"icustay_id": "int64", "itemid": "int64", "hours": "float64", "value": "float64"}) for f in frames]
+    return HourlyCube(pd.concat(frames, ignore_index=True), max_hours=max_hours)
+
+
+def _cube_window(
+    cube: HourlyCube,
+    df_cohort: pd.DataFrame,
+    window_hours: float,
+    end_hours_col: str | None,
+    items: dict[str, tuple[int, ...]],
+    agg: str,
+    worst_max: set[str],
+) -> pd.DataFrame:
+    """
+    Window aggregate per stay and analyte of ``items`` answered from
+    ``cube`` (wide, index ``icustay_id``), same layout as ``_aggregate_window``.
+    Windows always start at intime and must end on whole hours, where the
+    hourly buckets give exactly the event-level window ``[0, end]``;
+    fractional ends raise ValueError instead of being rounded.
+    """
+    if agg not in ("worst", "mean", "sum"):
+        raise ValueError(f"agg='{agg}' ist mit cube= nicht möglich (nur 'worst', 'mean', 'sum').")
+    stays = df_cohort.dropna(subset=["icustay_id"]).drop_duplicates(subset="icustay_id")
     if end_hours_col is not None:
-        merged = merged[(merged["hours"] >= 0) & (merged["hours"] <= merged[end_hours_col])]
+        end = pd.Series(stays[end_hours_col].to_numpy(dtype=float), index=stays["icustay_id"].astype(int))
     else:
-        merged = merged[(merged["hours"] >= 0) & (merged["hours"] <= window_hours)]
+        end = pd.Series(float(window_hours), index=stays["icustay_id"].astype(int))
+    fractional = end.notna() & (end != np.floor(end))
+    if fractional.any():
+        source = f"end_hours_col='{end_hours_col}'" if end_hours_col is not None else f"window_hours={window_hours}"
+        raise ValueError(
+            f"cube= braucht Fenster in ganzen Stunden ({source}: {int(fractional.sum())} Aufenthalte mit "
+            "Bruchteil). Enden selbst runden oder index= statt cube= verwenden."
+        )
+    item_to_name = {iid: name for name, itemids in items.items() for iid in itemids}
+    res = cube.query(end, itemids=item_to_name)
+    if res.empty:
+        return pd.DataFrame()
+    res["name"] = res["itemid"].map(item_to_name)
+    by = res.groupby(["icustay_id", "name"], sort=True)
+    if agg == "mean":
+        values = by["sum"].sum() / by["count"].sum()
+    elif agg == "sum":
+        values = by["sum"].sum()
+    else:
+        values = by["min"].min()
+        use_max = values.index.get_level_values("name").isin(list(worst_max))
+        values = by["max"].max().where(use_max, values)
+    wide = values.unstack("name").astype("float64")
+    wide.columns.name = None
+    return wide
 
-    uo_total = merged.groupby("icustay_id")["value"].sum().reset_index()
-    uo_total = uo_total.rename(columns={"value": _uo_col})
 
-    return df_cohort.merge(uo_total, on="icustay_id", how="left")
+def build_event_index(
+    df_cohort: pd.DataFrame,
+    max_hours: float = 72.0,
+    value_dtype=np.float64,
+) -> dict[str, EventIndex]:
+    """
+    Pull the first ``max_hours`` hours of labs, vitals, urine output and
+    vasopressor infusions once and store each source as an
+    ``src.eventindex.EventIndex`` (keys ``"labs"``, ``"vitals"``,
+    ``"urine"``, ``"vaso"``; vasopressors keep the normalized dose as
+    value, see ``_vaso_dose``). Pass the dict as ``index=`` to the ``get_*_for_window``
+    functions or ``compute_sofa_from_raw`` to cut any window up to
+    ``max_hours`` in memory.
+    """
+    with session():
+        if _id_list(df_cohort["hadm_id"]):
+            labs = _lab_events(*_window_relation(df_cohort, max_hours, with_hadm=True))
+        else:
+            labs = pd.DataFrame(columns=["icustay_id", "itemid", "hours", "valuenum"])
+        win, params = _window_relation(df_cohort, max_hours)
+        vitals = _vital_events(win, params)
+        uo = _urine_events(win, params)
+        vaso = _vaso_events(df_cohort, max_hours)
+
+    drug_code = pd.Categorical(vaso["drug"].astype(object), categories=[*_VASO_DRUGS, "other"]).codes
+    kw = {"value_dtype": value_dtype, "max_hours": max_hours}
+    return {
+        "labs": EventIndex(labs["icustay_id"], labs["hours"], labs["valuenum"], labs["itemid"], **kw),
+        "vitals": EventIndex(vitals["icustay_id"], vitals["hours"], vitals["valuenum"], vitals["itemid"], **kw),
+        "urine": EventIndex(uo["icustay_id"], uo["hours"], uo["value"], uo["itemid"], **kw),
+        "vaso": EventIndex(vaso["icustay_id"], vaso["hours"], vaso["dose"], drug_code, **kw),
+    }
 
 
-def get_vasopressor_features_for_window(
+def _index_events(
+    index: dict[str, EventIndex],
+    kind: str,
     df_cohort: pd.DataFrame,
-    window_hours: float = 24.0,
+    limit: float | str,
+) -> pd.DataFrame:
+    """
+    Events of source ``kind`` in ``[intime, intime + limit]`` for the stays
+    of ``df_cohort`` (``limit``: hours or a column with per-stay hours), with
+    the columns of the corresponding ``_<kind>_events`` pull.
+    """
+    stays = df_cohort.dropna(subset=["icustay_id"]).drop_duplicates(subset="icustay_id")
+    ends = stays[limit].to_numpy(dtype=float) if isinstance(limit, str) else float(limit)
+    ev = index[kind].window(pd.Series(ends, index=stays["icustay_id"].astype(int).to_numpy()))
+    if kind in ("labs", "vitals"):
+        items, name = (_LAB_ITEMS, "lab") if kind == "labs" else (_VITAL_ITEMS, "vital")
+        ev = ev.rename(columns={"code": "itemid", "value": "valuenum"})
+        ev[name] = ev["itemid"].map({iid: n for n, itemids in items.items() for iid in itemids})
+    elif kind == "vaso":
+        ev = ev.rename(columns={"value": "dose"})
+        ev["drug"] = np.array([*_VASO_DRUGS, "other"], dtype=object)[ev.pop("code").to_numpy()]
+        ev = ev.assign(**_vaso_dose_columns(ev["drug"], ev["dose"]))
+    return ev
+
+
+def get_labs_for_window(
+    df_cohort: pd.DataFrame,
+    window_hours: float | list[float] = 24.0,
+    agg: str = "worst",
     end_hours_col: str | None = None,
+    server_agg: bool = False,
+    cube: HourlyCube | None = None,
+    index: dict[str, EventIndex] | None = None,
 ) -> pd.DataFrame:
     """
-    Retrieve vasopressor/inotrope exposure within a time window and derive
-    coarse dose features usable for SOFA cardiovascular scoring.
+    Retrieve lab values from ``labevents`` within ``[intime, intime + window_hours]``.
 
-    Returns one row per icustay_id with:
-      - vaso_any_<suffix>, dopamine_any_<suffix>, dobutamine_any_<suffix>,
-        norepinephrine_any_<suffix>, epinephrine_any_<suffix>,
-        phenylephrine_any_<suffix>, vasopressin_any_<suffix>
-      - dopamine_rate_mcgkgmin_<suffix>, norepinephrine_rate_mcgkgmin_<suffix>,
-        epinephrine_rate_mcgkgmin_<suffix>
+    Parameters
+    ----------
+    df_cohort : DataFrame
+        Must contain ``subject_id``, ``hadm_id``, ``icustay_id``, ``intime``.
+    window_hours : float or list of float
+        Length of observation window after ICU intime (default 24). A list
+        (e.g. ``[6, 12, 24, 48]``) pulls the events once up to the largest
+        window and returns the column set of every window.
+    agg : str
+        Aggregation strategy per lab per ICU stay.
+        ``"worst"`` picks the clinically worst value (max for creatinine /
+        bilirubin / BUN / lactate / WBC / potassium; min for platelets /
+        bicarbonate / sodium).
+        ``"first"`` picks the earliest measurement.
+        ``"mean"`` averages.
+    server_agg : bool
+        Aggregate in the database (``GROUP BY``/``DISTINCT ON``) so only one
+        row per stay and lab is transferred instead of every measurement.
+    cube : HourlyCube, optional
+        Answer the windows from a prebuilt ``build_hourly_cube`` instead of
+        querying ``labevents`` (``agg`` ``"worst"`` or ``"mean"``; window
+        ends in whole hours, otherwise ValueError).
+    index : dict of EventIndex, optional
+        Cut the windows from a prebuilt ``build_event_index`` instead of
+        querying ``labevents``.
+
+    Returns
+    -------
+    DataFrame with one row per ``icustay_id`` and one column per lab analyte
+    (and window), suffixed with ``_<window_hours>h`` (e.g. ``creatinine_6h``).
     """
-    df = df_cohort.copy()
-    icu_ids = tuple(df["icustay_id"].dropna().astype(int).unique().tolist())
-    sfx = "_t_star" if end_hours_col is not None else f"_{int(window_hours)}h"
+    ids = _id_list(df_cohort["hadm_id"])
+    if not ids:
+        return df_cohort.copy()
 
-    out_cols = [
+    _check_end_hours_col(df_cohort, end_hours_col)
+    windows = _window_list(window_hours, end_hours_col)
+    if cube is not None:
+        per_window = {
+            w: _cube_window(cube, df_cohort, w, end_hours_col, _LAB_ITEMS, agg, _LAB_WORST_MAX) for w in windows
+        }
+        return _merge_window_results(df_cohort, per_window, end_hours_col)
+    if index is not None:
+        per_window = {
+            w: _aggregate_window(_index_events(index, "labs", df_cohort, end_hours_col or w), "lab", agg, _LAB_WORST_MAX)
+            for w in windows
+        }
+        return _merge_window_results(df_cohort, per_window, end_hours_col)
+    win, params = _window_relation(df_cohort, max(windows), end_hours_col, with_hadm=True)
+
+    if server_agg:
+        items, item_params = _item_map_relation(_LAB_ITEMS)
+        per_window = _server_window_agg(
+            f"""
+            SELECT w.icustay_id, m.name, le.charttime, le.valuenum,
+                   EXTRACT(EPOCH FROM le.charttime - w.t0) / 3600 AS hours
+            FROM {win}
+            JOIN labevents le
+              ON le.hadm_id = w.hadm_id
+             AND le.charttime BETWEEN w.t0 AND w.t1
+            JOIN {items} ON m.itemid = le.itemid
+            WHERE le.valuenum IS NOT NULL
+            """,
+            {**params, **item_params},
+            agg,
+            _LAB_WORST_MAX,
+            windows,
+        )
+        return _merge_window_results(df_cohort, per_window, end_hours_col)
+
+    merged = _lab_events(win, params)
+    if merged.empty:
+        return df_cohort.copy()
+
+    per_window = {
+        w: _aggregate_window(sub, "lab", agg, _LAB_WORST_MAX) for w, sub in _window_subsets(merged, windows)
+    }
+    return _merge_window_results(df_cohort, per_window, end_hours_col)
+
+
+def get_vitals_for_window(
+    df_cohort: pd.DataFrame,
+    window_hours: float | list[float] = 24.0,
+    agg: str = "worst",
+    end_hours_col: str | None = None,
+    server_agg: bool = False,
+    cube: HourlyCube | None = None,
+    index: dict[str, EventIndex] | None = None,
+) -> pd.DataFrame:
+    """
+    Retrieve vital signs from ``chartevents`` within ``[intime, intime + window_hours]``.
+
+    Parameters
+    ----------
+    df_cohort : DataFrame
+        Must contain ``icustay_id``, ``intime``.
+    window_hours : float or list of float
+        Length of observation window after ICU intime (default 24); a list
+        returns all windows from one pull, see ``get_labs_for_window``.
+    agg : str
+        ``"worst"`` picks clinically worst (min for BP/GCS/SpO2, max for HR/temp/RR).
+        ``"first"`` picks earliest.  ``"mean"`` averages.
+    server_agg : bool
+        Aggregate in the database, see ``get_labs_for_window``.
+    cube : HourlyCube, optional
+        Answer from a prebuilt ``build_hourly_cube``, see ``get_labs_for_window``.
+    index : dict of EventIndex, optional
+        Cut the windows from a prebuilt ``build_event_index``.
+
+    Returns
+    -------
+    DataFrame with one column per vital (and window), suffixed ``_<window_hours>h``.
+    """
+    icu_ids = _id_list(df_cohort["icustay_id"])
+    if not icu_ids:
+        return df_cohort.copy()
+
+    _check_end_hours_col(df_cohort, end_hours_col)
+    windows = _window_list(window_hours, end_hours_col)
+    if cube is not None:
+        per_window = {
+            w: _cube_window(cube, df_cohort, w, end_hours_col, _VITAL_ITEMS, agg, _VITAL_WORST_MAX) for w in windows
+        }
+        return _merge_window_results(df_cohort, per_window, end_hours_col)
+    if index is not None:
+        per_window = {
+            w: _aggregate_window(
+                _index_events(index, "vitals", df_cohort, end_hours_col or w), "vital", agg, _VITAL_WORST_MAX
+            )
+            for w in windows
+        }
+        return _merge_window_results(df_cohort, per_window, end_hours_col)
+    win, params = _window_relation(df_cohort, max(windows), end_hours_col)
+
+    if server_agg:
+        items, item_params = _item_map_relation(_VITAL_ITEMS)
+        per_window = _server_window_agg(
+            f"""
+            SELECT ce.icustay_id, m.name, ce.charttime, ce.valuenum,
+                   EXTRACT(EPOCH FROM ce.charttime - w.t0) / 3600 AS hours
+            FROM {win}
+            JOIN chartevents ce
+              ON ce.icustay_id = w.icustay_id
+             AND ce.charttime BETWEEN w.t0 AND w.t1
+            JOIN {items} ON m.itemid = ce.itemid
+            WHERE ce.valuenum IS NOT NULL
+            """,
+            {**params, **item_params},
+            agg,
+            _VITAL_WORST_MAX,
+            windows,
+        )
+        return _merge_window_results(df_cohort, per_window, end_hours_col)
+
+    merged = _vital_events(win, params)
+    if merged.empty:
+        return df_cohort.copy()
+
+    per_window = {
+        w: _aggregate_window(sub, "vital", agg, _VITAL_WORST_MAX) for w, sub in _window_subsets(merged, windows)
+    }
+    return _merge_window_results(df_cohort, per_window, end_hours_col)
+
+
+def get_urine_output_for_window(
+    df_cohort: pd.DataFrame,
+    window_hours: float | list[float] = 24.0,
+    end_hours_col: str | None = None,
+    cube: HourlyCube | None = None,
+    index: dict[str, EventIndex] | None = None,
+) -> pd.DataFrame:
+    """
+    Total urine output (mL) from ``outputevents`` within
+    ``[intime, intime + window_hours]`` (oder patientenspezifisch bis ``end_hours_col``).
+
+    Returns df with new column ``uo_ml_<window_hours>h`` (bzw. ``uo_ml_t_star``);
+    for a list of windows one column per window from a single pull.
+    With ``cube`` (see ``build_hourly_cube``) the totals come from the cube,
+    with ``index`` (see ``build_event_index``) from the in-memory index.
+    """
+    icu_ids = _id_list(df_cohort["icustay_id"])
+    if not icu_ids:
+        return df_cohort.copy()
+
+    _check_end_hours_col(df_cohort, end_hours_col)
+    windows = _window_list(window_hours, end_hours_col)
+
+    # Spaltenname für UO-Ergebnis: uo_ml_<N>h bzw. uo_ml_t_star
+    if cube is not None:
+        per_window = {
+            w: _cube_window(cube, df_cohort, w, end_hours_col, {"uo_ml": tuple(_UO_ITEMS)}, "sum", set())
+            for w in windows
+        }
+    elif index is not None:
+        per_window = {
+            w: _index_events(index, "urine", df_cohort, end_hours_col or w).groupby("icustay_id")["value"].sum().to_frame("uo_ml")
+            for w in windows
+        }
+    else:
+        win, params = _window_relation(df_cohort, max(windows), end_hours_col)
+        merged = _urine_events(win, params)
+        per_window = {
+            w: sub.groupby("icustay_id")["value"].sum().to_frame("uo_ml") for w, sub in _window_subsets(merged, windows)
+        }
+    df_out = _merge_window_results(df_cohort, per_window, end_hours_col)
+    for w in windows:
+        col = "uo_ml" + _window_suffix(w, end_hours_col)
+        if col not in df_out.columns:
+            df_out[col] = np.nan
+    return df_out
+
+
+def _vaso_feature_cols(sfx: str) -> list[str]:
+    return [
         f"vaso_any{sfx}",
         f"dopamine_any{sfx}",
         f"dobutamine_any{sfx}",
@@ -1351,92 +2081,18 @@ def get_vasopressor_features_for_window(
         f"dopamine_rate_mcgkgmin{sfx}",
         f"norepinephrine_rate_mcgkgmin{sfx}",
         f"epinephrine_rate_mcgkgmin{sfx}",
+        f"ne_equiv_mcgkgmin{sfx}",
     ]
 
-    if not icu_ids:
-        for c in out_cols:
-            df[c] = np.nan
-        return df
 
-    in_clause = f"({icu_ids[0]})" if len(icu_ids) == 1 else str(icu_ids)
-
-    ev = q(f"""
-        SELECT
-            ie.icustay_id,
-            ie.starttime,
-            ie.rate,
-            ie.rateuom,
-            LOWER(di.label) AS label
-        FROM inputevents_mv ie
-        JOIN d_items di ON ie.itemid = di.itemid
-        WHERE ie.icustay_id IN {in_clause}
-          AND (
-               LOWER(di.label) LIKE '%norepinephrine%'
-            OR (LOWER(di.label) LIKE '%epinephrine%' AND LOWER(di.label) NOT LIKE '%norepi%')
-            OR LOWER(di.label) LIKE '%dopamine%'
-            OR LOWER(di.label) LIKE '%dobutamine%'
-            OR LOWER(di.label) LIKE '%phenylephrine%'
-            OR LOWER(di.label) LIKE '%vasopressin%'
-          )
-    """)
-
-    if ev.empty:
-        for c in out_cols:
-            df[c] = 0.0 if c.endswith(f"_any{sfx}") else np.nan
-        return df
-
-    merge_cols = ["icustay_id", "intime"]
-    if end_hours_col is not None:
-        if end_hours_col not in df.columns:
-            raise ValueError(
-                f"Spalte '{end_hours_col}' fehlt in df_cohort. "
-                f"Sie sollte den patientenspezifischen Fensterende in Stunden enthalten."
-            )
-        merge_cols.append(end_hours_col)
-
-    ev = ev.merge(df[merge_cols].drop_duplicates(), on="icustay_id", how="inner")
-    ev["starttime"] = pd.to_datetime(ev["starttime"])
-    ev["intime"] = pd.to_datetime(ev["intime"])
-    ev["hours"] = (ev["starttime"] - ev["intime"]).dt.total_seconds() / 3600
-
-    if end_hours_col is not None:
-        ev = ev[(ev["hours"] >= 0) & (ev["hours"] <= ev[end_hours_col])].copy()
-    else:
-        ev = ev[(ev["hours"] >= 0) & (ev["hours"] <= window_hours)].copy()
-
-    if ev.empty:
-        for c in out_cols:
-            df[c] = 0.0 if c.endswith(f"_any{sfx}") else np.nan
-        return df
-
-    def _drug_from_label(lbl: str) -> str:
-        l = str(lbl).lower()
-        if "norepinephrine" in l:
-            return "norepinephrine"
-        if "epinephrine" in l and "norepi" not in l:
-            return "epinephrine"
-        if "dobutamine" in l:
-            return "dobutamine"
-        if "dopamine" in l:
-            return "dopamine"
-        if "phenylephrine" in l:
-            return "phenylephrine"
-        if "vasopressin" in l:
-            return "vasopressin"
-        return "other"
-
-    def _to_mcgkgmin(rate: float, uom: str) -> float:
-        if pd.isna(rate) or pd.isna(uom):
-            return np.nan
-        u = str(uom).lower().replace(" ", "")
-        if "mcg/kg/min" in u or "mcg/kg/minute" in u:
-            return float(rate)
-        return np.nan
-
-    ev["drug"] = ev["label"].map(_drug_from_label)
-    ev["rate_mcgkgmin"] = [
-        _to_mcgkgmin(r, u) for r, u in zip(ev["rate"], ev["rateuom"])
-    ]
+def _vaso_window_features(ev: pd.DataFrame, sfx: str) -> pd.DataFrame:
+    """
+    Per-stay exposure flags, maximum mcg/kg/min rates and maximum
+    norepinephrine equivalent (``_NE_SOFA_DRUGS``) from the in-window
+    infusions ``ev`` (see ``_vaso_events``); columns ``icustay_id`` plus
+    ``_vaso_feature_cols(sfx)``, one row per stay with at least one infusion.
+    """
+    out_cols = _vaso_feature_cols(sfx)
 
     by_icu = ev.groupby("icustay_id")
     out = pd.DataFrame({"icustay_id": by_icu.size().index})
@@ -1455,7 +2111,7 @@ def get_vasopressor_features_for_window(
         + out[f"vasopressin_any{sfx}"]
     ).gt(0).astype(float)
 
-    # Rate features (only where unit is already mcg/kg/min).
+    # Rate features (mcg/kg/min after unit/weight conversion).
     for drug in ["dopamine", "norepinephrine", "epinephrine"]:
         tmp = (
             ev.loc[ev["drug"] == drug, ["icustay_id", "rate_mcgkgmin"]]
@@ -1465,11 +2121,171 @@ def get_vasopressor_features_for_window(
         )
         out = out.merge(tmp, on="icustay_id", how="left")
 
+    nee = ev.loc[ev["drug"].isin(_NE_SOFA_DRUGS)].groupby("icustay_id")["ne_equiv_mcgkgmin"].max()
+    out[f"ne_equiv_mcgkgmin{sfx}"] = out["icustay_id"].map(nee)
+
     for c in out_cols:
         if c not in out.columns:
             out[c] = 0.0 if c.endswith(f"_any{sfx}") else np.nan
 
-    return df.merge(out[["icustay_id"] + out_cols], on="icustay_id", how="left")
+    return out[["icustay_id"] + out_cols]
+
+
+def get_vasopressor_features_for_window(
+    df_cohort: pd.DataFrame,
+    window_hours: float = 24.0,
+    end_hours_col: str | None = None,
+    index: dict[str, EventIndex] | None = None,
+) -> pd.DataFrame:
+    """
+    Retrieve vasopressor/inotrope exposure within a time window and derive
+    coarse dose features usable for SOFA cardiovascular scoring
+    (optionally cut from a prebuilt ``build_event_index``).
+
+    Returns one row per icustay_id with:
+      - vaso_any_<suffix>, dopamine_any_<suffix>, dobutamine_any_<suffix>,
+        norepinephrine_any_<suffix>, epinephrine_any_<suffix>,
+        phenylephrine_any_<suffix>, vasopressin_any_<suffix>
+      - dopamine_rate_mcgkgmin_<suffix>, norepinephrine_rate_mcgkgmin_<suffix>,
+        epinephrine_rate_mcgkgmin_<suffix> (rates in mcg/min, mg/hour ... are
+        converted with the stay's weight, see ``_vaso_dose``)
+      - ne_equiv_mcgkgmin_<suffix>: maximum norepinephrine-equivalent dose
+        of norepinephrine, epinephrine, phenylephrine and vasopressin
+    """
+    df = df_cohort.copy()
+    icu_ids = _id_list(df["icustay_id"])
+    sfx = "_t_star" if end_hours_col is not None else f"_{int(window_hours)}h"
+    out_cols = _vaso_feature_cols(sfx)
+
+    if not icu_ids:
+        for c in out_cols:
+            df[c] = np.nan
+        return df
+
+    _check_end_hours_col(df, end_hours_col)
+    if index is not None:
+        ev = _index_events(index, "vaso", df, end_hours_col or window_hours)
+    else:
+        ev = _vaso_events(df, end_hours_col or window_hours)
+
+    if ev.empty:
+        for c in out_cols:
+            df[c] = 0.0 if c.endswith(f"_any{sfx}") else np.nan
+        return df
+
+    return df.merge(_vaso_window_features(ev, sfx), on="icustay_id", how="left")
+
+
+# Exposition je Kategorie: (Spalte kumulierte Dosis, Spalte zeitgewichtete Rate)
+_EXPOSURE_COLS = {
+    **{d: (f"{d}_dose_mcgkg", f"{d}_twrate_mcgkgmin") for d in _VASO_DRUGS},
+    "vasopressin": ("vasopressin_dose_units", "vasopressin_twrate_unitsmin"),
+    "fluid": ("fluid_ml", "fluid_twrate_mlh"),
+}
+# amountuom (klein) -> Faktor nach mL
+_AMOUNT_TO_ML = {"ml": 1.0, "l": 1000.0}
+
+
+def get_infusion_exposure_for_window(
+    df_cohort: pd.DataFrame,
+    window_hours: float = 24.0,
+    end_hours_col: str | None = None,
+    categories: tuple[str, ...] = (*_VASO_DRUGS, "fluid"),
+) -> pd.DataFrame:
+    """
+    Time-weighted infusion exposure within ``[intime, intime + window_hours]``
+    (or up to ``end_hours_col``) from the ``starttime``/``endtime`` intervals
+    of ``inputevents_mv``.
+
+    Each infusion is clipped to the window. Per stay and category
+    (vasopressor/inotrope classes of ``_VASO_DRUGS`` and ``"fluid"``) adds:
+      - cumulative dose: ``<drug>_dose_mcgkg_<suffix>`` (normalized rate,
+        see ``_vaso_dose``, times clipped minutes; vasopressin in units),
+        ``fluid_ml_<suffix>`` (``amount`` pro rata of the clipped duration;
+        boluses count fully when given inside the window)
+      - ``<category>_hours_<suffix>``: hours covered by at least one infusion
+        (overlapping infusions merged with ``merge_intervals``)
+      - time-weighted mean rate: dose of the infusions inside the window
+        (boluses excluded) divided by the time they cover
+        (``<drug>_twrate_mcgkgmin_<suffix>``,
+        ``vasopressin_twrate_unitsmin_<suffix>``, ``fluid_twrate_mlh_<suffix>``)
+
+    Stays without infusion get dose and hours 0; stays without window end
+    (NaN in ``end_hours_col``) get NaN.
+    """
+    df = df_cohort.copy()
+    unknown = sorted(set(categories) - set(_EXPOSURE_COLS))
+    if unknown:
+        raise ValueError(f"Unbekannte Kategorien: {unknown}")
+    _check_end_hours_col(df, end_hours_col)
+    sfx = _window_suffix(window_hours, end_hours_col)
+    out_cols = [
+        c
+        for cat in categories
+        for c in (f"{_EXPOSURE_COLS[cat][0]}{sfx}", f"{cat}_hours{sfx}", f"{_EXPOSURE_COLS[cat][1]}{sfx}")
+    ]
+    if not _id_list(df["icustay_id"]):
+        for c in out_cols:
+            df[c] = np.nan
+        return df
+
+    stays = df.dropna(subset=["icustay_id"]).drop_duplicates(subset="icustay_id").set_index("icustay_id")
+    ends = stays[end_hours_col].astype(float) if end_hours_col is not None else pd.Series(float(window_hours), index=stays.index)
+
+    # Gewicht wie in _vaso_events (nur Vasopressor-Zeilen), nur nötig für Vasopressor-Dosen
+    vaso = any(c in _VASO_DRUGS for c in categories)
+    ev = _intervention_events(df, categories=tuple(categories), with_weight=vaso)
+    if not vaso:
+        ev["weight"] = np.nan
+    ev["drug"] = np.select([ev[f"c_{d}"].to_numpy(dtype=bool) for d in _VASO_DRUGS], _VASO_DRUGS, "other")
+    ev["dose"] = _vaso_dose(ev)
+
+    # Infusion auf das Fenster [t0, t1] zuschneiden (fehlendes endtime = Bolus bei starttime)
+    t0 = ev["intime"]
+    t1 = t0 + pd.to_timedelta(ev["icustay_id"].map(ends), unit="h")
+    endtime = ev["endtime"].fillna(ev["starttime"])
+    ev["clip_start"] = ev["starttime"].where(ev["starttime"] > t0, t0)
+    ev["clip_end"] = endtime.where(endtime < t1, t1)
+    clipped = (ev["clip_end"] - ev["clip_start"]).dt.total_seconds() / 3600
+    duration = (endtime - ev["starttime"]).dt.total_seconds() / 3600
+    bolus = duration <= 0
+    ev["overlap_h"] = clipped.clip(lower=0).where(~bolus, 0.0)
+    in_window = (ev["starttime"] >= t0) & (ev["starttime"] <= t1)
+    share = (ev["overlap_h"] / duration).where(~bolus, in_window.astype(float))
+
+    amount_ml = (
+        pd.to_numeric(ev["amount"], errors="coerce")
+        * ev["amountuom"].astype(object).str.lower().str.strip().map(_AMOUNT_TO_ML).astype(float)
+    )
+
+    def covered_hours(rows: pd.DataFrame) -> pd.Series:
+        sessions = merge_intervals(rows[rows["overlap_h"] > 0], "icustay_id", "clip_start", "clip_end")
+        length = (sessions["clip_end"] - sessions["clip_start"]).dt.total_seconds() / 3600
+        return length.groupby(sessions["icustay_id"]).sum()
+
+    res = pd.DataFrame(index=stays.index)
+    for cat in categories:
+        dose_col, rate_col = (f"{c}{sfx}" for c in _EXPOSURE_COLS[cat])
+        if cat == "fluid":
+            rows = ev[ev["c_fluid"].to_numpy(dtype=bool)].assign(cum=amount_ml * share)
+            per_hour = 1.0
+        else:
+            rows = ev[ev["drug"] == cat].assign(cum=ev["dose"] * ev["overlap_h"] * 60)
+            per_hour = 60.0
+        dosed = rows.dropna(subset=["cum"])
+        res[dose_col] = dosed.groupby("icustay_id")["cum"].sum()
+        res[f"{cat}_hours{sfx}"] = covered_hours(rows)
+        # Rate nur aus Infusionen: Boli zählen zur Gesamtmenge, decken aber keine Zeit ab
+        infused = dosed[dosed["overlap_h"] > 0]
+        res[rate_col] = infused.groupby("icustay_id")["cum"].sum() / (covered_hours(infused) * per_hour)
+
+    # nur Boli (keine abgedeckte Zeit) -> keine Rate; ohne Infusion: Dosis und Stunden 0
+    res = res.replace([np.inf, -np.inf], np.nan)
+    totals = res.columns.difference([f"{_EXPOSURE_COLS[cat][1]}{sfx}" for cat in categories])
+    res[totals] = res[totals].fillna(0.0)
+    res.loc[ends.isna().to_numpy()] = np.nan
+
+    return df.merge(res[out_cols].reset_index(), on="icustay_id", how="left")
 
 
 def summarize_map_coverage(
@@ -1488,8 +2304,9 @@ def summarize_map_coverage(
     n_total = len(base)
     rows: list[dict[str, float]] = []
 
+    # Ein Abruf bis zum größten Fenster, alle Fenster daraus
+    d = get_vitals_for_window(base, window_hours=list(windows_hours), agg="worst") if windows_hours else base
     for w in windows_hours:
-        d = get_vitals_for_window(base, window_hours=float(w), agg="worst", end_hours_col=None)
         col = f"mbp_{int(w)}h"
         n_map = int(d[col].notna().sum()) if col in d.columns else 0
         pct = (100.0 * n_map / n_total) if n_total > 0 else np.nan
@@ -1699,6 +2516,8 @@ def compute_sofa_from_raw(
     df_cohort: pd.DataFrame,
     window_hours: float = 24.0,
     end_hours_col: str | None = None,
+    index: dict[str, EventIndex] | None = None,
+    vaso_scoring: str = "standard",
 ) -> pd.DataFrame:
     """
     Compute SOFA total and component scores from raw MIMIC-III tables
@@ -1708,6 +2527,10 @@ def compute_sofa_from_raw(
     and allows computing e.g. a 6h-baseline SOFA or a 48h-SOFA.
 
     Scoring follows the standard SOFA definition (Vincent et al., 1996).
+    ``vaso_scoring="ne_equivalent"`` additionally scores the cardiovascular
+    component 3/4 from the norepinephrine-equivalent dose
+    (``ne_equiv_mcgkgmin``, <= 0.1 / > 0.1), so phenylephrine and
+    vasopressin support count like norepinephrine; default ``"standard"``.
 
     Requirements on ``df_cohort``: ``icustay_id``, ``hadm_id``,
     ``subject_id``, ``intime``.
@@ -1715,15 +2538,178 @@ def compute_sofa_from_raw(
     Returns df with new columns (suffixed ``_<window_hours>h``):
       sofa_respiration, sofa_coagulation, sofa_liver,
       sofa_cardiovascular, sofa_cns, sofa_renal, sofa_total.
+
+    For several windows use ``compute_sofa_for_windows`` (one extraction).
+    With ``index`` (see ``build_event_index``) the window is cut from the
+    in-memory event index instead of querying the database.
     """
-    df = df_cohort.copy()
-    # Suffix: patientenspezifisches Fenster → '_t_star', fixes Fenster → '_{N}h'
+    _check_end_hours_col(df_cohort, end_hours_col)
     sfx = "_t_star" if end_hours_col is not None else f"_{int(window_hours)}h"
+    return _compute_sofa(
+        df_cohort, [(sfx, end_hours_col or float(window_hours), window_hours)], index=index, vaso_scoring=vaso_scoring
+    )
+
+
+def compute_sofa_for_windows(
+    df_cohort: pd.DataFrame,
+    window_hours: float | list[float] = (24.0,),
+    end_hours_cols: list[str] | dict[str, str] = (),
+    uo_norm_hours: float = 24.0,
+    index: dict[str, EventIndex] | None = None,
+    vaso_scoring: str = "standard",
+) -> pd.DataFrame:
+    """
+    SOFA scores (as ``compute_sofa_from_raw``) for many windows at once.
+
+    Labs, vitals, urine output and vasopressors are pulled once per source
+    up to the latest window end of each stay; every window is then cut from
+    these events in memory and scored. The result has the same
+    ``sofa_*_<suffix>`` (and feature) columns as separate
+    ``compute_sofa_from_raw``/``add_sofa_at_intervention`` calls.
+
+    Parameters
+    ----------
+    window_hours : float or list of float
+        Fixed windows ``[intime, intime + N h]``, suffix ``_<N>h``.
+    end_hours_cols : list of str or dict
+        Columns with patient-specific window ends (hours after intime).
+        A single column gets the suffix ``_t_star``, several get
+        ``_<column>``; a dict maps column → suffix explicitly. As in
+        ``add_sofa_at_intervention``, stays without end (NaN) get NaN in
+        all columns of that window, and urine output is normalized to
+        24h with ``uo_norm_hours``.
+    index : dict of EventIndex, optional
+        Cut all windows from a prebuilt ``build_event_index`` (no queries).
+    vaso_scoring : {"standard", "ne_equivalent"}
+        Cardiovascular scoring, see ``compute_sofa_from_raw``.
+    """
+    specs = [(f"_{int(w)}h", w, w) for w in (_window_list(window_hours) if np.size(window_hours) else [])]
+    if not isinstance(end_hours_cols, dict):
+        end_hours_cols = {
+            c: "_t_star" if len(end_hours_cols) == 1 else f"_{c}" for c in end_hours_cols
+        }
+    for col, sfx in end_hours_cols.items():
+        _check_end_hours_col(df_cohort, col)
+        specs.append((sfx if sfx.startswith("_") else f"_{sfx}", col, uo_norm_hours))
+    if not specs:
+        return df_cohort.copy()
+
+    df = _compute_sofa(df_cohort, specs, index=index, vaso_scoring=vaso_scoring)
+    # Fenster ohne Ende (kein t*): alle Spalten dieses Fensters NaN
+    for sfx, limit, _ in specs:
+        if isinstance(limit, str):
+            new_cols = [c for c in df.columns if c.endswith(sfx) and c not in df_cohort.columns]
+            df.loc[df[limit].isna(), new_cols] = np.nan
+    return df
+
+
+def _events_within(events: pd.DataFrame, df_cohort: pd.DataFrame, limit: float | str) -> pd.DataFrame:
+    """Events with ``hours <= limit`` (fixed hours, or per stay from column ``limit``)."""
+    if isinstance(limit, str):
+        ends = df_cohort.drop_duplicates(subset="icustay_id").set_index("icustay_id")[limit]
+        end = events["icustay_id"].map(ends).to_numpy(dtype=float)
+    else:
+        end = limit
+    return events[events["hours"].to_numpy(dtype=float) <= end]
+
 
-    df = get_labs_for_window(df, window_hours=window_hours, agg="worst", end_hours_col=end_hours_col)
-    df = get_vitals_for_window(df, window_hours=window_hours, agg="worst", end_hours_col=end_hours_col)
-    df = get_urine_output_for_window(df, window_hours=window_hours, end_hours_col=end_hours_col)
+def _compute_sofa(
+    df_cohort: pd.DataFrame,
+    specs: list[tuple[str, float | str, float]],
+    index: dict[str, EventIndex] | None = None,
+    vaso_scoring: str = "standard",
+) -> pd.DataFrame:
+    """
+    Shared engine of ``compute_sofa_from_raw``/``compute_sofa_for_windows``.
 
+    ``specs`` holds ``(suffix, window end, UO normalization hours)`` per
+    window; the window end is a fixed number of hours or the name of a
+    column with per-stay hours. One extraction per source covers the
+    latest end of each stay, or the windows are cut from ``index``.
+    """
+    _check_vaso_scoring(vaso_scoring)
+    df = df_cohort.copy()
+    icu_ids = _id_list(df["icustay_id"])
+
+    if index is not None:
+        def within(kind: str, limit: float | str) -> pd.DataFrame:
+            return _index_events(index, kind, df, limit)
+    else:
+        pulled = _pull_sofa_events(df, specs) if icu_ids else {}
+
+        def within(kind: str, limit: float | str) -> pd.DataFrame:
+            ev = pulled.get(kind, pd.DataFrame())
+            return ev if ev.empty else _events_within(ev, df, limit)
+
+    for sfx, limit, _ in specs:
+        wide = _aggregate_window(within("labs", limit), "lab", "worst", _LAB_WORST_MAX)
+        if not wide.empty:
+            df = df.merge(wide.add_suffix(sfx).reset_index(), on="icustay_id", how="left")
+    for sfx, limit, _ in specs:
+        wide = _aggregate_window(within("vitals", limit), "vital", "worst", _VITAL_WORST_MAX)
+        if not wide.empty:
+            df = df.merge(wide.add_suffix(sfx).reset_index(), on="icustay_id", how="left")
+    for sfx, limit, _ in specs:
+        if not icu_ids:
+            continue
+        uo = within("urine", limit)
+        if uo.empty:
+            df[f"uo_ml{sfx}"] = np.nan
+        else:
+            total = uo.groupby("icustay_id")["value"].sum()
+            df = df.merge(total.rename(f"uo_ml{sfx}").reset_index(), on="icustay_id", how="left")
+    for sfx, limit, _ in specs:
+        ev = within("vaso", limit) if icu_ids else pd.DataFrame()
+        if ev.empty:
+            for c in _vaso_feature_cols(sfx):
+                df[c] = 0.0 if icu_ids and c.endswith(f"_any{sfx}") else np.nan
+        else:
+            df = df.merge(_vaso_window_features(ev, sfx), on="icustay_id", how="left")
+
+    for sfx, _, uo_hours in specs:
+        df = _score_sofa(df, sfx, uo_hours, vaso_scoring)
+    return df
+
+
+def _pull_sofa_events(df: pd.DataFrame, specs: list[tuple[str, float | str, float]]) -> dict[str, pd.DataFrame]:
+    """SOFA input events of all sources up to the latest window end of each stay in ``specs``."""
+    fixed = [limit for _, limit, _ in specs if not isinstance(limit, str)]
+    cols = [limit for _, limit, _ in specs if isinstance(limit, str)]
+    if cols:
+        # spätestes Fensterende je Aufenthalt als Hilfsspalte für _window_relation
+        ends = pd.concat([df[c] for c in cols] + [pd.Series(w, index=df.index) for w in fixed], axis=1)
+        rel_df, rel_hours, rel_col = df.assign(_sofa_window_end=ends.max(axis=1)), 0.0, "_sofa_window_end"
+    else:
+        rel_df, rel_hours, rel_col = df, max(fixed), None
+
+    pulled = {}
+    # Alle Rohdaten-Abfragen über eine Verbindung, je Quelle einmal bis zum spätesten Fensterende
+    with session():
+        if _id_list(df["hadm_id"]):
+            pulled["labs"] = _lab_events(*_window_relation(rel_df, rel_hours, rel_col, with_hadm=True))
+        win, params = _window_relation(rel_df, rel_hours, rel_col)
+        pulled["vitals"] = _vital_events(win, params)
+        pulled["urine"] = _urine_events(win, params)
+        pulled["vaso"] = _vaso_events(rel_df, rel_col or rel_hours)
+    return pulled
+
+
+_VASO_SCORINGS = ("standard", "ne_equivalent")
+
+
+def _check_vaso_scoring(vaso_scoring: str) -> None:
+    if vaso_scoring not in _VASO_SCORINGS:
+        raise ValueError(f"vaso_scoring={vaso_scoring!r} unbekannt (erlaubt: {', '.join(_VASO_SCORINGS)}).")
+
+
+def _score_sofa(df: pd.DataFrame, sfx: str, uo_hours, vaso_scoring: str = "standard") -> pd.DataFrame:
+    """
+    SOFA component and total scores from the ``<feature><sfx>`` columns of
+    ``df`` (in place). ``uo_hours`` (scalar or per row) is the window length
+    the urine output is normalized from; ``vaso_scoring="ne_equivalent"``
+    also scores the norepinephrine-equivalent dose (see
+    ``compute_sofa_from_raw``).
+    """
     pao2_col = f"pao2{sfx}"
     fio2_col = f"fio2_lab{sfx}"
     plat_col = f"platelets{sfx}"
@@ -1732,7 +2718,7 @@ def compute_sofa_from_raw(
     gcs_col = f"gcs_total{sfx}"
     creat_col = f"creatinine{sfx}"
     # UO-Spaltenname konsistent mit get_urine_output_for_window
-    uo_col = "uo_ml_t_star" if end_hours_col is not None else f"uo_ml_{int(window_hours)}h"
+    uo_col = f"uo_ml{sfx}"
 
     # --- Respiration (PaO2/FiO2) ---
     if pao2_col in df.columns and fio2_col in df.columns:
@@ -1768,11 +2754,6 @@ def compute_sofa_from_raw(
         df[f"sofa_liver{sfx}"] = np.nan
 
     # --- Cardiovascular (MAP + vasopressor/inotrope support) ---
-    df = get_vasopressor_features_for_window(
-        df,
-        window_hours=window_hours,
-        end_hours_col=end_hours_col,
-    )
     cardio_col = f"sofa_cardiovascular{sfx}"
 
     map_val = pd.to_numeric(df.get(mbp_col), errors="coerce") if mbp_col in df.columns else pd.Series(np.nan, index=df.index)
@@ -1787,6 +2768,11 @@ def compute_sofa_from_raw(
     dop_rate = pd.to_numeric(df.get(f"dopamine_rate_mcgkgmin{sfx}"), errors="coerce")
     norepi_rate = pd.to_numeric(df.get(f"norepinephrine_rate_mcgkgmin{sfx}"), errors="coerce")
     epi_rate = pd.to_numeric(df.get(f"epinephrine_rate_mcgkgmin{sfx}"), errors="coerce")
+    nee_col = f"ne_equiv_mcgkgmin{sfx}"
+    if vaso_scoring == "ne_equivalent" and nee_col in df.columns:
+        ne_equiv = pd.to_numeric(df[nee_col], errors="coerce")
+    else:
+        ne_equiv = pd.Series(np.nan, index=df.index)
 
     cardio = pd.Series(0.0, index=df.index)
 
@@ -1802,11 +2788,12 @@ def compute_sofa_from_raw(
         ((dop_rate > 5) & (dop_rate <= 15))
         | ((norepi_rate > 0) & (norepi_rate <= 0.1))
         | ((epi_rate > 0) & (epi_rate <= 0.1))
+        | ((ne_equiv > 0) & (ne_equiv <= 0.1))
     )
     cardio = cardio.where(~score3, 3.0)
 
     # Score 4: high catecholamine dose
-    score4 = (dop_rate > 15) | (norepi_rate > 0.1) | (epi_rate > 0.1)
+    score4 = (dop_rate > 15) | (norepi_rate > 0.1) | (epi_rate > 0.1) | (ne_equiv > 0.1)
     cardio = cardio.where(~score4, 4.0)
 
     # If neither MAP nor vaso information exists, keep missing.
@@ -1835,7 +2822,7 @@ def compute_sofa_from_raw(
             labels=[0, 1, 2, 3, 4],
         ).astype(float)
     if uo_col in df.columns:
-        uo_per_day = df[uo_col] * (24 / max(window_hours, 1))
+        uo_per_day = df[uo_col] * (24 / np.maximum(uo_hours, 1))
         uo_score = pd.Series(0.0, index=df.index)
         uo_score = uo_score.where(uo_per_day >= 500, 3)
         uo_score = uo_score.where(uo_per_day >= 200, 4)
@@ -1856,9 +2843,146 @@ def compute_sofa_from_raw(
     return df
 
 
+# SOFA-Eingangsgrößen der Trajektorie und ihre Aggregation im Rückblickfenster
+# (Labs/Vitals wie "worst" in _aggregate_window, Urin summiert, Katecholamine max.)
+_TRAJECTORY_LABS = {n: _LAB_ITEMS[n] for n in ("pao2", "fio2_lab", "platelets", "bilirubin", "creatinine")}
+_TRAJECTORY_VITALS = {n: _VITAL_ITEMS[n] for n in ("mbp", "gcs_total")}
+_TRAJECTORY_DRUGS = ("dopamine", "dobutamine", "norepinephrine", "epinephrine", "phenylephrine", "vasopressin")
+
+
+def compute_sofa_trajectory(
+    df_cohort: pd.DataFrame,
+    lookback_hours: int = 24,
+    chunk_size: int = 2000,
+    vaso_scoring: str = "standard",
+) -> pd.DataFrame:
+    """
+    Hourly SOFA time series per ICU stay.
+
+    For every stay and every hour ``t = 1 .. ceil(LOS)`` after intime, the
+    SOFA inputs are aggregated over the events of the preceding
+    ``lookback_hours`` hours, i.e. offsets in ``(t - lookback_hours, t]``
+    (events at intime count towards hour 1), and scored as in
+    ``compute_sofa_from_raw``; urine output is normalized from
+    ``min(t, lookback_hours)`` hours. For ``t <= lookback_hours`` this is the
+    window ``[intime, intime + t]``. ``vaso_scoring`` as in
+    ``compute_sofa_from_raw``.
+
+    The events of each stay are pulled once (intime to outtime) and bucketed
+    per hour; the rolling worst/sum/max is then computed in one sliding
+    window pass over all stays (stays are separated by ``lookback_hours - 1``
+    empty buckets so no window crosses a stay boundary). Stays are processed
+    in chunks of ``chunk_size`` to bound memory.
+
+    Requirements on ``df_cohort``: ``icustay_id``, ``hadm_id``, ``intime``,
+    ``outtime``.
+
+    Returns
+    -------
+    DataFrame with one row per stay and hour: ``icustay_id``, ``hour``, the
+    SOFA inputs (``pao2``, ``mbp``, ``uo_ml``, ``vaso_any`` ...) and
+    ``sofa_respiration`` ... ``sofa_renal``, ``sofa_total``.
+    """
+    _check_vaso_scoring(vaso_scoring)
+    lookback_hours = int(lookback_hours)
+    if lookback_hours < 1:
+        raise ValueError("lookback_hours muss mindestens 1 sein.")
+    missing = {"icustay_id", "hadm_id", "intime", "outtime"} - set(df_cohort.columns)
+    if missing:
+        raise ValueError(f"df_cohort fehlen Spalten: {sorted(missing)}")
+
+    stays = df_cohort.dropna(subset=["icustay_id", "intime", "outtime"]).drop_duplicates(subset="icustay_id")
+    los_hours = (pd.to_datetime(stays["outtime"]) - pd.to_datetime(stays["intime"])).dt.total_seconds() / 3600
+    stays = stays.assign(_los_hours=los_hours)[["icustay_id", "hadm_id", "intime", "_los_hours"]]
+    stays = stays[stays["_los_hours"] > 0]
+
+    parts = []
+    for start in range(0, len(stays), chunk_size):
+        chunk = stays.iloc[start:start + chunk_size]
+        with session():
+            events = _trajectory_events(chunk)
+        parts.append(_hourly_sofa(chunk, events, lookback_hours, vaso_scoring))
+    if not parts:
+        return pd.DataFrame(columns=["icustay_id", "hour"])
+    return pd.concat(parts, ignore_index=True)
+
+
+def _trajectory_events(stays: pd.DataFrame) -> pd.DataFrame:
+    """
+    SOFA input events of ``stays`` between intime and outtime as one long
+    frame ``icustay_id, hours, name, value``.
+    """
+    frames = []
+    if _id_list(stays["hadm_id"]):
+        labs = _lab_events(*_window_relation(stays, 0.0, "_los_hours", with_hadm=True), items=_TRAJECTORY_LABS)
+        frames.append(labs[["icustay_id", "hours", "lab", "valuenum"]].set_axis(["icustay_id", "hours", "name", "value"], axis=1))
+    win, params = _window_relation(stays, 0.0, "_los_hours")
+    vitals = _vital_events(win, params, items=_TRAJECTORY_VITALS)
+    frames.append(vitals[["icustay_id", "hours", "vital", "valuenum"]].set_axis(["icustay_id", "hours", "name", "value"], axis=1))
+    uo = _urine_events(win, params)
+    frames.append(uo[["icustay_id", "hours"]].assign(name="uo_ml", value=uo["value"]))
+
+    vaso = _vaso_events(stays, "_los_hours")
+    vaso = vaso[vaso["drug"].isin(_TRAJECTORY_DRUGS)]
+    frames.append(vaso[["icustay_id", "hours"]].assign(name=vaso["drug"].astype(str) + "_any", value=1.0))
+    rates = vaso.assign(value=vaso["rate_mcgkgmin"]).dropna(subset=["value"])
+    frames.append(rates[["icustay_id", "hours"]].assign(name=rates["drug"].astype(str) + "_rate_mcgkgmin", value=rates["value"]))
+    nee = vaso[vaso["drug"].isin(_NE_SOFA_DRUGS)].dropna(subset=["ne_equiv_mcgkgmin"])
+    frames.append(nee[["icustay_id", "hours"]].assign(name="ne_equiv_mcgkgmin", value=nee["ne_equiv_mcgkgmin"]))
+
+    frames = [f.astype({"icustay_id": "int64", "hours": "float64", "name": object, "value": "float64"}) for f in frames]
+    return pd.concat(frames, ignore_index=True)
+
+
+def _hourly_sofa(stays: pd.DataFrame, events: pd.DataFrame, lookback: int, vaso_scoring: str = "standard") -> pd.DataFrame:
+    """Rolling hourly SOFA inputs and scores of ``stays`` (see ``compute_sofa_trajectory``)."""
+    n_hours = np.ceil(stays["_los_hours"].to_numpy(dtype=float)).astype(np.int64)
+    ids = stays["icustay_id"].astype(np.int64).to_numpy()
+    # Block je Aufenthalt: (lookback - 1) leere Stunden als Puffer, dann Stunde 1..n
+    block = n_hours + lookback - 1
+    first_hour = np.cumsum(block) - n_hours
+    n_rows = int(block.sum())
+    hour = np.arange(int(n_hours.sum())) - np.repeat(np.cumsum(n_hours) - n_hours, n_hours) + 1
+    hour_rows = np.repeat(first_hour, n_hours) + hour - 1
+
+    stay_pos = pd.Series(np.arange(len(ids)), index=ids)
+    pos = stay_pos.reindex(events["icustay_id"].to_numpy()).to_numpy()
+    bucket = np.maximum(np.ceil(events["hours"].to_numpy(dtype=float)), 1)
+    valid = ~np.isnan(pos) & (bucket <= n_hours[np.nan_to_num(pos).astype(np.int64)])
+    events = events[valid].assign(
+        row=first_hour[pos[valid].astype(np.int64)] + bucket[valid].astype(np.int64) - 1
+    )
+
+    aggs = {name: ("max" if name in _LAB_WORST_MAX else "min") for name in _TRAJECTORY_LABS}
+    aggs.update({name: ("max" if name in _VITAL_WORST_MAX else "min") for name in _TRAJECTORY_VITALS})
+    aggs["uo_ml"] = "sum"
+    for drug in _TRAJECTORY_DRUGS:
+        aggs[f"{drug}_any"] = "max"
+        if drug in ("dopamine", "norepinephrine", "epinephrine"):
+            aggs[f"{drug}_rate_mcgkgmin"] = "max"
+    aggs["ne_equiv_mcgkgmin"] = "max"
+
+    out = pd.DataFrame({"icustay_id": np.repeat(ids, n_hours), "hour": hour})
+    by_name = dict(tuple(events.groupby("name", sort=False)))
+    for name, how in aggs.items():
+        dense = np.full(n_rows, np.nan)
+        ev = by_name.get(name)
+        if ev is not None:
+            per_bucket = ev.groupby("row")["value"].agg(how)
+            dense[per_bucket.index.to_numpy()] = per_bucket.to_numpy()
+        rolled = getattr(pd.Series(dense).rolling(lookback, min_periods=1), how)()
+        out[name] = rolled.to_numpy()[hour_rows]
+
+    drug_flags = out[[f"{drug}_any" for drug in _TRAJECTORY_DRUGS]].fillna(0)
+    out[drug_flags.columns] = drug_flags
+    out["vaso_any"] = drug_flags.max(axis=1)
+    return _score_sofa(out, "", np.minimum(out["hour"], lookback), vaso_scoring)
+
+
 def add_sofa_at_intervention(
     df: pd.DataFrame,
     t_star_col: str,
+    vaso_scoring: str = "standard",
 ) -> pd.DataFrame:
     """
     Berechnet SOFA-Scores zum patientenspezifischen Interventionszeitpunkt t*.
@@ -1878,6 +3002,8 @@ def add_sofa_at_intervention(
     t_star_col : str
         Spaltenname mit dem patientenspezifischen Interventionszeitpunkt in Stunden
         nach ICU-Aufnahme (z.B. 'first_vaso_hours').
+    vaso_scoring : str
+        "standard" (Vincent et al.) oder "ne_equivalent", siehe compute_sofa_from_raw.
 
     Rückgabe
     --------
@@ -1915,7 +3041,9 @@ def add_sofa_at_intervention(
 
     # SOFA-Berechnung für behandelte Patienten mit patientenspezifischem Fenster
     df_treated = df[mask].copy()
-    df_treated = compute_sofa_from_raw(df_treated, window_hours=24.0, end_hours_col=t_star_col)
+    df_treated = compute_sofa_from_raw(
+        df_treated, window_hours=24.0, end_hours_col=t_star_col, vaso_scoring=vaso_scoring
+    )
 
     # Nur die neuen t*-Spalten zurückmergen (verhindert Dopplung anderer Spalten)
     new_cols = [c for c in df_treated.columns if c.endswith("_t_star")]
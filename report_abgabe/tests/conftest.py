@@ -0,0 +1,12 @@
+import importlib.util
+import sys
+from importlib.machinery import PathFinder
+from pathlib import Path
+
+# Tests importieren das Paket als ``src`` (wie die Notebooks aus report_abgabe/)
+_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(_ROOT))
+
+# report_abgabe/src ist ein Namespace-Paket; ein reguläres ``src`` an anderer
+# Stelle in sys.path (z. B. im Repo-Wurzelverzeichnis) hätte sonst Vorrang.
+sys.modules["src"] = importlib.util.module_from_spec(PathFinder.find_spec("src", [str(_ROOT)]))
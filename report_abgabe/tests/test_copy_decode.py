@@ -0,0 +1,63 @@
+"""
+Decoding of ``COPY ... TO STDOUT (FORMAT csv, NULL '\\N')`` output by
+``q_copy``'s pandas and Arrow readers, on output as PostgreSQL writes it.
+"""
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.db import _read_copy_arrow, _read_copy_csv
+
+# icustay_id int4, valueuom text, valuenum float8, charttime timestamp, error bool
+_DESC = [("icustay_id", 23), ("valueuom", 25), ("valuenum", 701), ("charttime", 1114), ("error", 16)]
+_COPY_OUTPUT = (
+    b"icustay_id,valueuom,valuenum,charttime,error\n"
+    b"1,mg/dL,1.5,2101-01-01 10:00:00,f\n"
+    b'2,"",\\N,2101-01-01 11:00:00,t\n'
+    b"3,\\N,2.5,\\N,\\N\n"
+    b'4,"a,b",3,2101-01-02 00:30:00,f\n'
+)
+
+
+def _read(backend: str) -> pd.DataFrame:
+    buf = io.BytesIO(_COPY_OUTPUT)
+    if backend == "pyarrow":
+        return _read_copy_arrow(buf, _DESC, None)
+    return _read_copy_csv(buf, _DESC, None)
+
+
+@pytest.mark.parametrize("backend", ["numpy", "pyarrow"])
+def test_empty_text_is_not_null(backend):
+    df = _read(backend)
+    assert df["valueuom"].iloc[0] == "mg/dL"
+    assert df["valueuom"].iloc[1] == ""
+    assert pd.isna(df["valueuom"].iloc[2])
+    assert df["valueuom"].iloc[3] == "a,b"
+
+
+@pytest.mark.parametrize("backend", ["numpy", "pyarrow"])
+def test_typed_columns_and_nulls(backend):
+    df = _read(backend)
+    np.testing.assert_allclose(df["valuenum"].astype("float64"), [1.5, np.nan, 2.5, 3.0])
+    assert df["charttime"].isna().tolist() == [False, False, True, False]
+    assert df["charttime"].iloc[3] == pd.Timestamp("2101-01-02 00:30:00")
+    assert df["error"].isna().tolist() == [False, False, True, False]
+    assert df["icustay_id"].tolist() == [1, 2, 3, 4]
+
+
+@pytest.mark.parametrize("backend", ["numpy", "pyarrow"])
+def test_chunks_cover_all_rows(backend):
+    reader = _read_copy_arrow if backend == "pyarrow" else _read_copy_csv
+    chunks = list(reader(io.BytesIO(_COPY_OUTPUT), _DESC, 3))
+    assert [len(c) for c in chunks] == [3, 1]
+    pd.testing.assert_frame_equal(pd.concat(chunks, ignore_index=True), _read(backend))
+
+
+@pytest.mark.parametrize("backend", ["numpy", "pyarrow"])
+def test_empty_result_yields_one_typed_chunk(backend):
+    reader = _read_copy_arrow if backend == "pyarrow" else _read_copy_csv
+    chunks = list(reader(io.BytesIO(_COPY_OUTPUT.split(b"\n")[0] + b"\n"), _DESC, 3))
+    assert len(chunks) == 1 and chunks[0].empty
+    assert list(chunks[0].columns) == [name for name, _ in _DESC]
@@ -0,0 +1,92 @@
+"""
+Windows answered from ``HourlyCube`` (``_cube_window``) against the
+event-level aggregation over ``0 <= hours <= end`` (``_aggregate_window``).
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.cube import HourlyCube
+from src.utils import _aggregate_window, _cube_window
+
+ITEMS = {"creatinine": (1, 2), "lactate": (3,), "platelets": (4,)}
+WORST_MAX = {"creatinine", "lactate"}
+ITEM_TO_NAME = {iid: name for name, ids in ITEMS.items() for iid in ids}
+
+
+def _events(n: int = 5000, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    hours = rng.uniform(0, 48, n)
+    # ein Teil genau auf Stundengrenzen (Bucket-Ränder)
+    on_edge = rng.random(n) < 0.2
+    hours[on_edge] = np.round(hours[on_edge])
+    return pd.DataFrame(
+        {
+            "icustay_id": rng.integers(0, 200, n),
+            "itemid": rng.choice(list(ITEM_TO_NAME), n),
+            "hours": hours,
+            "value": rng.normal(5.0, 2.0, n),
+        }
+    )
+
+
+def _cohort(end=None) -> pd.DataFrame:
+    cohort = pd.DataFrame({"icustay_id": np.arange(200)})
+    if end is not None:
+        cohort["t_end"] = end
+    return cohort
+
+
+def _event_level(events: pd.DataFrame, end: pd.Series, agg: str) -> pd.DataFrame:
+    ev = events.assign(end=events["icustay_id"].map(end))
+    ev = ev[(ev["hours"] >= 0) & (ev["hours"] <= ev["end"])]
+    ev = ev.assign(lab=ev["itemid"].map(ITEM_TO_NAME)).rename(columns={"value": "valuenum"})
+    if agg == "sum":
+        return ev.groupby(["icustay_id", "lab"])["valuenum"].sum().unstack("lab")
+    return _aggregate_window(ev, "lab", agg, WORST_MAX)
+
+
+@pytest.mark.parametrize("agg", ["worst", "mean", "sum"])
+@pytest.mark.parametrize("window_hours", [0, 1, 6, 24, 48])
+def test_fixed_whole_hour_windows_match_events(agg, window_hours):
+    events = _events()
+    cube = HourlyCube(events, max_hours=48)
+    got = _cube_window(cube, _cohort(), float(window_hours), None, ITEMS, agg, WORST_MAX)
+    expected = _event_level(events, pd.Series(float(window_hours), index=np.arange(200)), agg)
+    pd.testing.assert_frame_equal(got, expected, check_names=False, check_like=True)
+
+
+@pytest.mark.parametrize("agg", ["worst", "mean"])
+def test_per_stay_whole_hour_ends_match_events(agg):
+    events = _events(seed=1)
+    rng = np.random.default_rng(2)
+    end = rng.integers(0, 49, 200).astype(float)
+    end[::17] = np.nan
+    cube = HourlyCube(events, max_hours=48)
+    got = _cube_window(cube, _cohort(end), 24.0, "t_end", ITEMS, agg, WORST_MAX)
+    expected = _event_level(events, pd.Series(end, index=np.arange(200)), agg)
+    pd.testing.assert_frame_equal(got, expected, check_names=False, check_like=True)
+
+
+def test_fractional_windows_are_rejected():
+    cube = HourlyCube(_events(), max_hours=48)
+    with pytest.raises(ValueError, match="ganzen Stunden"):
+        _cube_window(cube, _cohort(), 6.5, None, ITEMS, "worst", WORST_MAX)
+    with pytest.raises(ValueError, match="end_hours_col='t_end'"):
+        _cube_window(cube, _cohort(np.full(200, 12.25)), 24.0, "t_end", ITEMS, "mean", WORST_MAX)
+
+
+def test_first_is_rejected():
+    cube = HourlyCube(_events(), max_hours=48)
+    with pytest.raises(ValueError, match="'worst', 'mean', 'sum'"):
+        _cube_window(cube, _cohort(), 24.0, None, ITEMS, "first", WORST_MAX)
+
+
+def test_query_rejects_fractional_bounds():
+    cube = HourlyCube(_events(), max_hours=48)
+    with pytest.raises(ValueError, match="ganzen Stunden"):
+        cube.query(6.5)
+    with pytest.raises(ValueError, match="ganzen Stunden"):
+        cube.query(24.0, start_hours=pd.Series(0.5, index=np.arange(200)))
+    # NaN-Enden sind erlaubt und liefern keine Zeilen
+    assert cube.query(pd.Series(np.nan, index=np.arange(200))).empty
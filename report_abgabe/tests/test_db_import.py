@@ -0,0 +1,47 @@
+"""
+Importing ``src`` must not touch the database: no ``.env``, no SQLAlchemy,
+no engine (see ``src.db``). Checked in a fresh interpreter without
+``DB_HOST``.
+"""
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+# pandas/numpy werden vorab importiert und nicht mitgemessen
+IMPORT_BUDGET_SECONDS = 1.0
+
+_SCRIPT = """
+import sys, time
+import numpy, pandas
+t0 = time.perf_counter()
+import src.utils, src.db, src.db_connect
+elapsed = time.perf_counter() - t0
+assert src.db._engine is None
+assert not src.db._env_loaded
+assert "sqlalchemy" not in sys.modules and "psycopg2" not in sys.modules
+print(elapsed)
+"""
+
+
+def test_import_creates_no_engine():
+    env = {k: v for k, v in os.environ.items() if not k.startswith("DB_")}
+    result = subprocess.run(
+        [sys.executable, "-c", _SCRIPT],
+        cwd=Path(__file__).resolve().parents[1],
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    assert result.returncode == 0, result.stderr
+    elapsed = float(result.stdout.strip())
+    assert elapsed < IMPORT_BUDGET_SECONDS, f"Import von src dauerte {elapsed:.2f}s"
+
+
+def test_db_connect_engine_is_lazy(monkeypatch):
+    from src import db, db_connect
+
+    sentinel = object()
+    monkeypatch.setattr(db, "get_engine", lambda: sentinel)
+    assert db_connect.engine is sentinel
+    assert db_connect.get_engine() is sentinel
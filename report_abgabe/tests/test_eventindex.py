@@ -0,0 +1,76 @@
+"""
+Windows cut from ``EventIndex`` against a plain mask over the event frame
+(``_events_within``), including bounds that equal an event's offset.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.eventindex import EventIndex
+from src.utils import _events_within
+
+
+def _events(n: int = 5000, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame(
+        {
+            "icustay_id": rng.integers(0, 300, n),
+            # Offsets wie aus EXTRACT(EPOCH ...)/3600: nicht exakt in float32 darstellbar
+            "hours": rng.integers(0, 72 * 3600, n) / 3600.0,
+            "value": rng.normal(size=n),
+            "itemid": rng.integers(1, 5, n),
+        }
+    )
+
+
+def _index(events: pd.DataFrame) -> EventIndex:
+    return EventIndex(events["icustay_id"], events["hours"], events["value"], events["itemid"], max_hours=72)
+
+
+def _sorted(df: pd.DataFrame) -> pd.DataFrame:
+    return df.sort_values(["icustay_id", "hours", "value"]).reset_index(drop=True)
+
+
+@pytest.mark.parametrize("window_hours", [0.0, 6.0, 24.0, 71.99])
+def test_fixed_window_matches_mask(window_hours):
+    events = _events()
+    cohort = pd.DataFrame({"icustay_id": np.arange(300)})
+    got = _index(events).window(pd.Series(window_hours, index=cohort["icustay_id"]))
+    expected = _events_within(events, cohort, window_hours)
+    pd.testing.assert_frame_equal(
+        _sorted(got.rename(columns={"code": "itemid"}))[expected.columns],
+        _sorted(expected),
+        check_dtype=False,
+    )
+
+
+def test_per_stay_end_at_event_offset_is_included():
+    events = _events(seed=1)
+    # Ende je Aufenthalt = Offset eines seiner Events (wie t* = erste Intervention)
+    t_star = events.groupby("icustay_id").sample(1, random_state=0)
+    cohort = pd.DataFrame({"icustay_id": t_star["icustay_id"], "t_star": t_star["hours"]})
+    cohort.loc[cohort.index[::11], "t_star"] = np.nan
+
+    got = _index(events).window(cohort.set_index("icustay_id")["t_star"])
+    expected = _events_within(events[events["icustay_id"].isin(cohort["icustay_id"])], cohort, "t_star")
+    assert len(got) == len(expected)
+    pd.testing.assert_frame_equal(
+        _sorted(got.rename(columns={"code": "itemid"}))[expected.columns],
+        _sorted(expected),
+        check_dtype=False,
+    )
+    assert got["hours"].dtype == np.float64
+
+
+def test_start_bound_is_inclusive():
+    events = _events(seed=2)
+    start = events.groupby("icustay_id")["hours"].min()
+    got = _index(events).window(72.0, start_hours=start)
+    assert len(got) == len(events)
+
+
+def test_offsets_just_past_the_end_are_excluded():
+    # 6 h + 0.36 ms ist in float32 von 6.0 nicht zu unterscheiden
+    events = pd.DataFrame({"icustay_id": [1, 1, 1], "hours": [5.0, 6.0, 6.0 + 1e-7], "value": [1.0, 2.0, 3.0], "itemid": 1})
+    got = _index(events).window(6.0)
+    assert got["value"].tolist() == [1.0, 2.0]
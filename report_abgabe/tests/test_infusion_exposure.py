@@ -0,0 +1,66 @@
+"""
+``get_infusion_exposure_for_window`` on a hand-made ``inputevents_mv``:
+bolus handling of the fluid rate and the stay weight of vasopressor doses.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+import src.utils as utils
+
+T0 = pd.Timestamp("2101-01-01 08:00")
+ITEMS = pd.DataFrame({"itemid": [1, 2], "category": ["norepinephrine", "fluid"]})
+
+
+def _row(itemid, start_h, end_h, rate=np.nan, rateuom=None, amount=np.nan, weight=np.nan):
+    return {
+        "icustay_id": 10,
+        "itemid": itemid,
+        "starttime": T0 + pd.Timedelta(hours=start_h),
+        "endtime": T0 + pd.Timedelta(hours=end_h),
+        "rate": rate,
+        "rateuom": rateuom,
+        "amount": amount,
+        "amountuom": "ml" if itemid == 2 else None,
+        "patientweight": weight,
+    }
+
+
+INPUTEVENTS = pd.DataFrame(
+    [
+        # Noradrenalin 8 mcg/min über 10 h bei 80 kg = 0.1 mcg/kg/min
+        _row(1, 0, 10, rate=8.0, rateuom="mcg/min", weight=80.0),
+        # Infusion 1000 ml über 10 h und ein Bolus 500 ml (endtime = starttime), anderes Gewicht
+        _row(2, 0, 10, amount=1000.0, weight=40.0),
+        _row(2, 2, 2, amount=500.0, weight=40.0),
+    ]
+)
+COHORT = pd.DataFrame({"icustay_id": [10], "intime": [T0]})
+
+
+@pytest.fixture(params=["no_session", "session"])
+def db(request, monkeypatch):
+    cache = {} if request.param == "session" else None
+
+    def fake_q(sql, params=None, **kwargs):
+        return INPUTEVENTS[INPUTEVENTS["itemid"].isin(params["intervention_itemids"])].reset_index(drop=True)
+
+    monkeypatch.setattr(utils, "_intervention_item_table", lambda: ITEMS)
+    monkeypatch.setattr(utils, "q", fake_q)
+    monkeypatch.setattr(utils, "cohort_table", lambda *a, **k: None)
+    monkeypatch.setattr(utils, "session_cache", lambda: cache)
+    return request.param
+
+
+def test_bolus_counts_in_total_but_not_in_rate(db):
+    out = utils.get_infusion_exposure_for_window(COHORT, window_hours=24, categories=("fluid",)).iloc[0]
+    assert out["fluid_ml_24h"] == pytest.approx(1500.0)
+    assert out["fluid_hours_24h"] == pytest.approx(10.0)
+    assert out["fluid_twrate_mlh_24h"] == pytest.approx(100.0)
+
+
+@pytest.mark.parametrize("categories", [("norepinephrine",), ("norepinephrine", "fluid")])
+def test_weight_from_vasopressor_rows_only(db, categories):
+    out = utils.get_infusion_exposure_for_window(COHORT, window_hours=24, categories=categories).iloc[0]
+    assert out["norepinephrine_twrate_mcgkgmin_24h"] == pytest.approx(0.1)
+    assert out["norepinephrine_dose_mcgkg_24h"] == pytest.approx(60.0)
@@ -0,0 +1,86 @@
+"""
+``merge_intervals`` against the per-stay ``iterrows`` loop it replaced in
+``add_rrt_persistence_near_discharge``.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.utils import merge_intervals
+
+T0 = pd.Timestamp("2101-01-01")
+
+
+def _loop_reference(ev: pd.DataFrame, gap_tolerance_hours: float) -> pd.DataFrame:
+    # Alte Implementierung (ohne outtime)
+    gap_tol = pd.to_timedelta(gap_tolerance_hours, unit="h")
+    ev = ev.sort_values(["icustay_id", "starttime", "endtime"])
+    sessions = []
+    for icu_id, g in ev.groupby("icustay_id", sort=False):
+        cur_start = cur_end = None
+        for _, row in g.iterrows():
+            s, e = row["starttime"], row["endtime"]
+            if cur_start is None:
+                cur_start, cur_end = s, e
+                continue
+            if s <= cur_end + gap_tol:
+                cur_end = max(cur_end, e)
+            else:
+                sessions.append((icu_id, cur_start, cur_end))
+                cur_start, cur_end = s, e
+        if cur_start is not None:
+            sessions.append((icu_id, cur_start, cur_end))
+    return pd.DataFrame(sessions, columns=["icustay_id", "starttime", "endtime"])
+
+
+def _intervals(*spans: tuple[int, float, float]) -> pd.DataFrame:
+    # (icustay_id, Start in h, Ende in h)
+    ids, starts, ends = zip(*spans)
+    return pd.DataFrame(
+        {
+            "icustay_id": ids,
+            "starttime": T0 + pd.to_timedelta(starts, unit="h"),
+            "endtime": T0 + pd.to_timedelta(ends, unit="h"),
+        }
+    )
+
+
+def _assert_same(ev: pd.DataFrame, gap_tolerance_hours: float = 0.0) -> pd.DataFrame:
+    got = merge_intervals(ev, "icustay_id", "starttime", "endtime", gap_tolerance_hours)
+    pd.testing.assert_frame_equal(got, _loop_reference(ev, gap_tolerance_hours), check_dtype=False)
+    return got
+
+
+def test_touching_intervals_merge():
+    got = _assert_same(_intervals((1, 0, 2), (1, 2, 4), (1, 4.5, 5)))
+    assert len(got) == 2
+
+
+def test_nested_intervals():
+    # (1, 3) liegt in (0, 10); (11, 12) beginnt erst nach dem laufenden Maximum
+    got = _assert_same(_intervals((1, 0, 10), (1, 1, 3), (1, 4, 5), (1, 11, 12)))
+    assert got["endtime"].tolist() == [T0 + pd.Timedelta(hours=10), T0 + pd.Timedelta(hours=12)]
+
+
+def test_unsorted_input_and_several_stays():
+    _assert_same(_intervals((2, 5, 6), (1, 3, 4), (2, 0, 1), (1, 0, 3.5), (2, 1, 2), (1, 8, 9)))
+
+
+@pytest.mark.parametrize("gap", [0.0, 0.5, 2.0])
+def test_gap_tolerance(gap):
+    _assert_same(_intervals((1, 0, 1), (1, 1.5, 2), (1, 4, 5), (2, 0, 1), (2, 3, 3)), gap)
+
+
+@pytest.mark.parametrize("gap", [0.0, 1.0, 6.0])
+def test_random_intervals(gap):
+    rng = np.random.default_rng(0)
+    n = 3000
+    starts = rng.uniform(0, 200, n).round(1)
+    ev = _intervals(*zip(rng.integers(0, 100, n), starts, starts + rng.exponential(3, n).round(1)))
+    _assert_same(ev, gap)
+
+
+def test_empty_and_missing_values():
+    ev = _intervals((1, 0, 1))
+    ev.loc[0, "endtime"] = pd.NaT
+    assert merge_intervals(ev, "icustay_id", "starttime", "endtime").empty
@@ -0,0 +1,77 @@
+"""
+``_aggregate_window`` against the per-group ``groupby.apply`` loop it
+replaced in ``get_labs_for_window`` / ``get_vitals_for_window``.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.utils import _aggregate_window
+
+WORST_MAX = {"creatinine", "lactate"}
+
+
+def _loop_reference(events: pd.DataFrame, name_col: str, agg: str, worst_max: set[str]) -> pd.DataFrame:
+    # Alte Implementierung (vor der Vektorisierung), sortiert wie jetzt nach hours
+    def _agg_fn(group: pd.DataFrame) -> float:
+        name = group.name[1]
+        if agg == "first":
+            return group.sort_values("hours").iloc[0]["valuenum"]
+        if agg == "mean":
+            return group["valuenum"].mean()
+        if name in worst_max:
+            return group["valuenum"].max()
+        return group["valuenum"].min()
+
+    grouped = events.groupby(["icustay_id", name_col])[["hours", "valuenum"]]
+    return grouped.apply(_agg_fn).unstack(name_col).astype("float64")
+
+
+def _events(n: int = 2000, seed: int = 0, nan_share: float = 0.0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    events = pd.DataFrame(
+        {
+            "icustay_id": rng.integers(200000, 200150, n),
+            "lab": rng.choice(["creatinine", "lactate", "platelets", "bicarbonate"], n),
+            # eindeutige Zeitpunkte: die alte Sortierung war nicht stabil
+            "hours": rng.permutation(n) / 10.0,
+            "valuenum": rng.normal(5.0, 2.0, n),
+        }
+    )
+    if nan_share:
+        events.loc[rng.random(n) < nan_share, "valuenum"] = np.nan
+    return events
+
+
+def _assert_same(events: pd.DataFrame, agg: str) -> None:
+    got = _aggregate_window(events, "lab", agg, WORST_MAX)
+    expected = _loop_reference(events, "lab", agg, WORST_MAX)
+    pd.testing.assert_frame_equal(got, expected, check_names=False)
+
+
+@pytest.mark.parametrize("agg", ["worst", "mean", "first"])
+def test_matches_loop(agg):
+    _assert_same(_events(), agg)
+
+
+@pytest.mark.parametrize("agg", ["worst", "mean", "first"])
+def test_matches_loop_with_nan(agg):
+    events = _events(seed=1, nan_share=0.3)
+    # eine Gruppe nur aus NaN, eine mit NaN als frühestem Wert
+    events.loc[events["icustay_id"] == 200000, "valuenum"] = np.nan
+    first = events[events["icustay_id"] == 200001].sort_values("hours").index[0]
+    events.loc[first, "valuenum"] = np.nan
+    _assert_same(events, agg)
+
+
+@pytest.mark.parametrize("agg", ["worst", "mean", "first"])
+def test_single_event_groups(agg):
+    events = _events(n=40, seed=2)
+    events["icustay_id"] = np.arange(len(events))
+    _assert_same(events, agg)
+
+
+@pytest.mark.parametrize("agg", ["worst", "mean", "first"])
+def test_empty_window(agg):
+    empty = _events().iloc[:0]
+    assert _aggregate_window(empty, "lab", agg, WORST_MAX).empty
@@ -0,0 +1,37 @@
+"""``_window_events`` decodes the COPY output in chunks and concatenates them."""
+import io
+
+import pandas as pd
+import pytest
+
+import src.utils as utils
+from src.db import _read_copy_csv
+
+_DESC = [("icustay_id", 23), ("itemid", 23), ("valuenum", 701), ("hours", 701)]
+_CSV = b"icustay_id,itemid,valuenum,hours\n" + b"".join(
+    f"{i % 7},{50912 + i % 3},{i / 10},{i / 4}\n".encode() for i in range(23)
+)
+
+
+@pytest.fixture
+def copy_calls(monkeypatch):
+    calls = []
+
+    def fake_q_copy(sql, params=None, chunksize=None, dtype_backend=None):
+        calls.append(chunksize)
+        return _read_copy_csv(io.BytesIO(_CSV), _DESC, chunksize)
+
+    monkeypatch.setattr(utils, "q_copy", fake_q_copy)
+    return calls
+
+
+def test_streams_in_chunks(copy_calls):
+    got = utils._window_events("SELECT ...", {}, chunksize=5)
+    assert copy_calls == [5]
+    expected = _read_copy_csv(io.BytesIO(_CSV), _DESC, None)
+    pd.testing.assert_frame_equal(got, expected)
+
+
+def test_default_chunksize(copy_calls):
+    utils._window_events("SELECT ...", {})
+    assert copy_calls == [utils._EVENT_CHUNKSIZE]